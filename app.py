@@ -1,22 +1,28 @@
-from flask import Flask, send_from_directory, jsonify, request, render_template, redirect
+from flask import Flask, jsonify, request, render_template, redirect
 from flask_migrate import Migrate
-from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, verify_jwt_in_request
 from config import Config
 from flask_cors import CORS
 from models import db, MedicalStudy, User
 from routes.auth import auth_bp
-from routes.medical_studies import medical_studies_bp
+from routes.medical_studies import medical_studies_bp, allowed_file
 from routes.nutrition import nutrition_bp, init_app as init_nutrition
 from routes.doctors import doctors_bp, init_app as init_doctors
 from routes.admin import admin_bp
 from routes.profile import profile_bp
 from routes.doctor_profile import doctor_profile_bp
+from routes.storage import storage_bp, is_public_upload, can_access_upload
 import os
 from datetime import timedelta
 from dotenv import load_dotenv
-from werkzeug.utils import secure_filename
-import uuid
 from werkzeug.security import generate_password_hash
+from utils.blob_store import store_upload, register_uploaded
+from utils.ingest import IngestError
+from utils.storage import init_storage, get_storage
+from utils.file_serving import serve_upload, serve_image_derivative
+from utils.thumbnails import schedule_thumbnails, thumbnail_urls
+from utils.db_engine import engine_options, init_engine
+from utils.db_routing import init_replicas
 
 migrate = Migrate()
 jwt = JWTManager()
@@ -61,6 +67,34 @@ def create_app():
         app.config['SQLALCHEMY_DATABASE_URI'] = app.config['SQLALCHEMY_DATABASE_URI'].replace('postgres://', 'postgresql://', 1)
     
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    
+    # Pool de conexiones (ver utils/db_engine.py): por defecto se deriva de
+    # GUNICORN_WORKERS/GUNICORN_THREADS y del máximo de conexiones de la base
+    app.config['DB_MAX_CONNECTIONS'] = int(os.environ.get('DB_MAX_CONNECTIONS', '20'))
+    app.config['DB_RESERVED_CONNECTIONS'] = int(os.environ.get('DB_RESERVED_CONNECTIONS', '3'))
+    app.config['DB_POOL_SIZE'] = int(os.environ['DB_POOL_SIZE']) if os.environ.get('DB_POOL_SIZE') else None
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ['DB_MAX_OVERFLOW']) if os.environ.get('DB_MAX_OVERFLOW') else None
+    app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', '10'))  # segundos esperando una conexión libre
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+    app.config['DB_CONNECT_TIMEOUT'] = int(os.environ.get('DB_CONNECT_TIMEOUT', '10'))
+    app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '15000'))  # 0 = sin límite
+    app.config['DB_PGBOUNCER'] = os.environ.get('DB_PGBOUNCER', 'false').lower() == 'true'
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    
+    # Réplicas de lectura (URLs separadas por comas) para las rutas GET marcadas con
+    # @replica_read; ver utils/db_routing.py
+    app.config['DATABASE_REPLICA_URLS'] = [
+        url.strip().replace('postgres://', 'postgresql://', 1)
+        for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+    ]
+    app.config['REPLICA_MAX_LAG_SECONDS'] = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+    app.config['REPLICA_LAG_CHECK_SECONDS'] = float(os.environ.get('REPLICA_LAG_CHECK_SECONDS', '5'))
+    # Debe cubrir el retraso máximo aceptado más el intervalo entre mediciones
+    app.config['READ_YOUR_WRITES_SECONDS'] = float(os.environ.get(
+        'READ_YOUR_WRITES_SECONDS',
+        str(app.config['REPLICA_MAX_LAG_SECONDS'] + app.config['REPLICA_LAG_CHECK_SECONDS'])
+    ))
+    app.config['READ_YOUR_WRITES_DIR'] = os.environ.get('READ_YOUR_WRITES_DIR', os.path.join(app.root_path, 'cache', 'read_your_writes'))
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'default-secret-key')
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'default-secret-key')
     
@@ -68,6 +102,25 @@ def create_app():
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max-limit
     app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'uploads')
     
+    # Backend de almacenamiento: 'local' (disco) o 's3' (AWS S3, MinIO u otro compatible)
+    app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local').lower()
+    app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET')
+    app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')
+    app.config['S3_REGION'] = os.environ.get('S3_REGION')
+    app.config['S3_ACCESS_KEY_ID'] = os.environ.get('S3_ACCESS_KEY_ID')
+    app.config['S3_SECRET_ACCESS_KEY'] = os.environ.get('S3_SECRET_ACCESS_KEY')
+    
+    # Entrega de /uploads por el proxy: '' (Flask envía el archivo), 'x-accel' (nginx) o 'x-sendfile' (Apache)
+    app.config['UPLOADS_SENDFILE'] = os.environ.get('UPLOADS_SENDFILE', '').lower()
+    app.config['UPLOADS_ACCEL_PREFIX'] = os.environ.get('UPLOADS_ACCEL_PREFIX', '/protected-uploads/')
+    
+    # Caché en disco de imágenes redimensionadas (/uploads/<ruta>?w=&h=&fmt=)
+    app.config['DERIVATIVE_CACHE_DIR'] = os.environ.get('DERIVATIVE_CACHE_DIR', os.path.join(app.root_path, 'cache', 'derivatives'))
+    app.config['DERIVATIVE_CACHE_MAX_BYTES'] = int(os.environ.get('DERIVATIVE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))  # 512MB
+    
+    # Caché compartida (entre workers) del directorio público de médicos
+    app.config['DIRECTORY_CACHE_DIR'] = os.environ.get('DIRECTORY_CACHE_DIR', os.path.join(app.root_path, 'cache', 'directory'))
+    
     # Inicializar extensiones
     db.init_app(app)
     migrate.init_app(app, db)
@@ -75,12 +128,16 @@ def create_app():
     CORS(app, 
          resources={r"/api/*": {"origins": allowed_origins}}, 
          supports_credentials=True, 
-         expose_headers=['Authorization'],
-         allow_headers=["Content-Type", "Authorization", "Accept"],
-         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
+         expose_headers=['Authorization', 'Location', 'Upload-Offset', 'Upload-Length'],
+         allow_headers=["Content-Type", "Authorization", "Accept", "Upload-Offset"],
+         methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+
+    init_storage(app)
 
     # Asegurar que existan los directorios necesarios
     with app.app_context():
+        init_engine(app, db)
+        init_replicas(app)
         ensure_upload_dirs(app)
         from routes.medical_studies import init_app as init_medical_studies
         init_medical_studies(app)
@@ -95,11 +152,26 @@ def create_app():
     app.register_blueprint(admin_bp, url_prefix='/api/admin')
     app.register_blueprint(profile_bp, url_prefix='/api/profile')
     app.register_blueprint(doctor_profile_bp, url_prefix='/api/doctor-profile')
+    app.register_blueprint(storage_bp, url_prefix='/api/storage')
 
     # Ruta para servir archivos estáticos desde cualquier subdirectorio de uploads
     @app.route('/uploads/<path:filename>')
     def uploaded_file(filename):
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+        storage = get_storage()
+        if storage.name != 'local' and not is_public_upload(filename):
+            # En S3 la URL prefirmada da acceso a cualquiera: solo al dueño del archivo
+            # (o a médicos y administradores), igual que /api/storage/presign-download
+            verify_jwt_in_request(optional=True)
+            if get_jwt_identity() is None:
+                return jsonify({'error': 'Autenticación requerida'}), 401
+            if not can_access_upload(filename):
+                return jsonify({'error': 'No tienes permiso para acceder a este archivo'}), 403
+        if request.args.get('w') or request.args.get('h'):
+            return serve_image_derivative(filename)
+        if storage.name != 'local':
+            # Los archivos en S3 se descargan directamente del bucket con una URL prefirmada
+            return redirect(storage.presigned_get_url(filename))
+        return serve_upload(filename)
 
     # Solo registrar las rutas del frontend si serve_frontend es True
     if serve_frontend:
@@ -149,6 +221,36 @@ def create_app():
                 db.session.commit()
                 print(f"Usuario creado automáticamente con ID: {user.id}, Email: {user.email}")
             
+            # Archivo subido directamente al almacenamiento con una URL prefirmada
+            data = request.get_json(silent=True) or request.form
+            if 'file' not in request.files and data.get('storage_key'):
+                try:
+                    db_file_path = register_uploaded(data['storage_key'], user_id)
+                except IngestError as e:
+                    return jsonify({'error': str(e)}), e.status
+                if not db_file_path or not allowed_file(db_file_path):
+                    return jsonify({'error': 'Archivo no encontrado en el almacenamiento'}), 400
+                study = MedicalStudy(
+                    patient_id=user_id,
+                    study_type=data.get('study_type', 'general'),
+                    file_path=db_file_path,
+                    storage_key=db_file_path
+                )
+                db.session.add(study)
+                db.session.commit()
+                schedule_thumbnails(db_file_path)
+                return jsonify({
+                    'message': 'Estudio médico subido con éxito',
+                    'study': {
+                        'id': study.id,
+                        'patient_id': study.patient_id,
+                        'study_type': study.study_type,
+                        'file_path': study.file_path,
+                        'thumbnails': thumbnail_urls(study.file_path),
+                        'created_at': study.created_at.isoformat() if study.created_at else None
+                    }
+                }), 201
+            
             # Verificar si se envió un archivo
             if 'file' not in request.files:
                 print("No se envió ningún archivo")
@@ -169,27 +271,24 @@ def create_app():
                 print(f"Tipo de archivo no permitido: {file.filename}")
                 return jsonify({'error': 'Tipo de archivo no permitido'}), 400
             
-            # Crear un nombre de archivo seguro y único
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            
-            # Guardar el archivo en el subdirectorio correcto
-            file_path = os.path.join(app.root_path, 'uploads', 'medical_studies', unique_filename)
-            print(f"Guardando archivo en: {file_path}")
-            file.save(file_path)
-            
-            # La ruta que se guarda en la base de datos incluye el subdirectorio
-            db_file_path = f"medical_studies/{unique_filename}"
+            # Guardar el archivo en el almacén por contenido (un archivo idéntico se guarda una sola vez)
+            try:
+                db_file_path = store_upload(file)
+            except IngestError as e:
+                return jsonify({'error': str(e)}), e.status
+            print(f"Archivo guardado como: {db_file_path}")
             
             # Crear el registro en la base de datos
             study = MedicalStudy(
                 patient_id=user_id,
                 study_type=study_type,
-                file_path=db_file_path
+                file_path=db_file_path,
+                storage_key=db_file_path
             )
             
             db.session.add(study)
             db.session.commit()
+            schedule_thumbnails(db_file_path)
             
             print(f"Estudio médico guardado con ID: {study.id}")
             
@@ -200,6 +299,7 @@ def create_app():
                     'patient_id': study.patient_id,
                     'study_type': study.study_type,
                     'file_path': study.file_path,
+                    'thumbnails': thumbnail_urls(study.file_path),
                     'created_at': study.created_at.isoformat() if study.created_at else None
                 }
             }), 201
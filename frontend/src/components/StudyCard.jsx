@@ -20,9 +20,11 @@ import {
   Pending as PendingIcon
 } from '@mui/icons-material';
 import { useNavigate } from 'react-router-dom';
+import useUploadUrl, { studyImageKey } from '../services/useUploadUrl';
 
 const StudyCard = ({ study, onEdit }) => {
   const navigate = useNavigate();
+  const imageUrl = useUploadUrl(studyImageKey(study));
 
   // Mapeo de tipos de estudio a colores y etiquetas
   const studyTypeConfig = {
@@ -66,7 +68,7 @@ const StudyCard = ({ study, onEdit }) => {
       <CardMedia
         component="img"
         height="200"
-        image={`/uploads/${study.file_path}`}
+        image={imageUrl || undefined}
         alt={study.name || "Estudio médico"}
         sx={{ 
           objectFit: 'cover',
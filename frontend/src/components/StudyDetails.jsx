@@ -26,6 +26,7 @@ import {
 import { Edit as EditIcon } from '@mui/icons-material';
 import { useAuth } from '../context/AuthContext';
 import { medicalStudiesService } from '../services/api';
+import useUploadUrl, { studyImageKey } from '../services/useUploadUrl';
 
 const StudyDetails = () => {
   const { studyId } = useParams();
@@ -33,6 +34,7 @@ const StudyDetails = () => {
   const { user } = useAuth();
   
   const [study, setStudy] = useState(null);
+  const imageUrl = useUploadUrl(studyImageKey(study));
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [interpretation, setInterpretation] = useState('');
@@ -238,7 +240,7 @@ const StudyDetails = () => {
         <Card sx={{ mb: 3 }}>
           <CardMedia
             component="img"
-            image={`/uploads/${study.file_path}`}
+            image={imageUrl || undefined}
             alt="Imagen del estudio médico"
             sx={{ 
               maxHeight: '500px', 
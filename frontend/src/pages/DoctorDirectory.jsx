@@ -16,7 +16,10 @@ import {
   DialogContentText,
   DialogActions,
   CircularProgress,
-  Alert
+  Alert,
+  FormControlLabel,
+  MenuItem,
+  Switch
 } from '@mui/material';
 import { Search as SearchIcon } from '@mui/icons-material';
 import { useNavigate, Link as RouterLink } from 'react-router-dom';
@@ -30,25 +33,39 @@ const DoctorDirectory = () => {
   const [error, setError] = useState(null);
   const [contactDialogOpen, setContactDialogOpen] = useState(false);
   const [selectedDoctor, setSelectedDoctor] = useState(null);
+  // Filtros que aplica el servidor y cursor de la siguiente página (null si no hay más)
+  const [onlineOnly, setOnlineOnly] = useState(false);
+  const [sort, setSort] = useState('id');
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   
   const navigate = useNavigate();
 
+  // Carga la primera página con los filtros actuales, o la siguiente si se indica el cursor
+  const fetchDoctors = async (cursor = null) => {
+    const params = { sort };
+    if (onlineOnly) params.online = 'true';
+    if (cursor) params.cursor = cursor;
+    const response = await api.get('/doctors/directory', { params });
+    console.log("Respuesta de la API (directorio de médicos):", response.data);
+    
+    // Verificar que cada médico tenga un ID válido
+    const doctorsWithValidIds = response.data.doctors.filter(doctor => doctor.id);
+    if (doctorsWithValidIds.length !== response.data.doctors.length) {
+      console.warn("Algunos médicos no tienen ID válido:", 
+        response.data.doctors.filter(doctor => !doctor.id));
+    }
+    
+    setDoctors(previous => (cursor ? [...previous, ...response.data.doctors] : response.data.doctors));
+    setNextCursor(response.data.next_cursor || null);
+  };
+
   useEffect(() => {
-    const fetchDoctors = async () => {
+    const loadFirstPage = async () => {
       try {
         setLoading(true);
-        const response = await api.get('/doctors/directory');
-        console.log("Respuesta de la API (directorio de médicos):", response.data);
-        
-        // Verificar que cada médico tenga un ID válido
-        const doctorsWithValidIds = response.data.doctors.filter(doctor => doctor.id);
-        if (doctorsWithValidIds.length !== response.data.doctors.length) {
-          console.warn("Algunos médicos no tienen ID válido:", 
-            response.data.doctors.filter(doctor => !doctor.id));
-        }
-        
-        setDoctors(response.data.doctors);
-        setFilteredDoctors(response.data.doctors);
+        setError(null);
+        await fetchDoctors();
       } catch (err) {
         console.error('Error al cargar directorio de médicos:', err);
         setError('No se pudo cargar el directorio de médicos. Por favor, intenta de nuevo más tarde.');
@@ -57,8 +74,19 @@ const DoctorDirectory = () => {
       }
     };
 
-    fetchDoctors();
-  }, []);
+    loadFirstPage();
+  }, [onlineOnly, sort]);
+
+  const handleLoadMore = async () => {
+    try {
+      setLoadingMore(true);
+      await fetchDoctors(nextCursor);
+    } catch (err) {
+      console.error('Error al cargar más médicos:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   // Filtrar médicos según el término de búsqueda
   useEffect(() => {
@@ -118,7 +146,7 @@ const DoctorDirectory = () => {
         variant="outlined"
         value={searchTerm}
         onChange={handleSearchChange}
-        sx={{ mb: 4 }}
+        sx={{ mb: 2 }}
         InputProps={{
           startAdornment: (
             <InputAdornment position="start">
@@ -128,6 +156,25 @@ const DoctorDirectory = () => {
         }}
       />
 
+      {/* Filtros del servidor */}
+      <Box sx={{ display: 'flex', alignItems: 'center', gap: 3, mb: 4 }}>
+        <FormControlLabel
+          control={<Switch checked={onlineOnly} onChange={(event) => setOnlineOnly(event.target.checked)} />}
+          label="Solo consulta en línea"
+        />
+        <TextField
+          select
+          size="small"
+          label="Ordenar por"
+          value={sort}
+          onChange={(event) => setSort(event.target.value)}
+          sx={{ minWidth: 200 }}
+        >
+          <MenuItem value="id">Más antiguos</MenuItem>
+          <MenuItem value="rating">Mejor valorados</MenuItem>
+        </TextField>
+      </Box>
+
       {loading ? (
         <Box sx={{ display: 'flex', justifyContent: 'center', p: 3 }}>
           <CircularProgress />
@@ -183,6 +230,13 @@ const DoctorDirectory = () => {
               </Alert>
             </Grid>
           )}
+          {nextCursor && (
+            <Grid item xs={12} sx={{ display: 'flex', justifyContent: 'center' }}>
+              <Button variant="outlined" onClick={handleLoadMore} disabled={loadingMore}>
+                {loadingMore ? <CircularProgress size={20} /> : 'Cargar más'}
+              </Button>
+            </Grid>
+          )}
         </Grid>
       )}
 
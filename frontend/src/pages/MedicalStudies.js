@@ -34,14 +34,29 @@ const MedicalStudies = () => {
   
   const navigate = useNavigate();
 
+  // Cursor de la siguiente página del listado (null si no hay más)
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  // Pide una página del listado; el tipo de estudio se filtra en el servidor
+  const fetchStudiesPage = useCallback(async (cursor = null) => {
+    const token = localStorage.getItem('token');
+    const params = {};
+    if (cursor) params.cursor = cursor;
+    if (filterType !== 'all') params.study_type = filterType;
+    const response = await axios.get('/api/medical-studies/studies', {
+      headers: { Authorization: `Bearer ${token}` },
+      params
+    });
+    setStudies(previous => (cursor ? [...previous, ...response.data.studies] : response.data.studies));
+    setNextCursor(response.data.next_cursor || null);
+  }, [filterType]);
+
+  // Recarga desde la primera página; las siguientes se piden con "Cargar más"
   const fetchStudies = useCallback(async () => {
     try {
       setLoading(true);
-      const token = localStorage.getItem('token');
-      const response = await axios.get('/api/medical-studies/studies', {
-        headers: { Authorization: `Bearer ${token}` }
-      });
-      setStudies(response.data.studies);
+      await fetchStudiesPage();
       setError(null);
     } catch (err) {
       console.error('Error al obtener estudios:', err);
@@ -49,7 +64,19 @@ const MedicalStudies = () => {
     } finally {
       setLoading(false);
     }
-  }, []);
+  }, [fetchStudiesPage]);
+
+  const handleLoadMore = async () => {
+    try {
+      setLoadingMore(true);
+      await fetchStudiesPage(nextCursor);
+    } catch (err) {
+      console.error('Error al cargar más estudios:', err);
+      showNotification('No se pudieron cargar más estudios', 'error');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   useEffect(() => {
     fetchStudies();
@@ -206,7 +233,7 @@ const MedicalStudies = () => {
   };
 
   const renderStudyItem = (study, index, isSelected) => {
-    const isPending = !study.interpretation || study.interpretation.trim() === '';
+    const isPending = !study.analyzed;
     const date = formatDate(study.created_at);
     
     // Determinar el icono según el tipo de estudio
@@ -251,7 +278,7 @@ const MedicalStudies = () => {
           
           {!isPending && (
             <div className="study-interpretation-preview">
-              {study.interpretation.substring(0, 100)}...
+              {(study.interpretation_preview || '').substring(0, 100)}...
             </div>
           )}
         </div>
@@ -296,7 +323,7 @@ const MedicalStudies = () => {
     return studies.filter(study => {
       const searchMatch = searchTerm === '' || 
         (study.name && study.name.toLowerCase().includes(searchTerm.toLowerCase())) ||
-        (study.interpretation && study.interpretation.toLowerCase().includes(searchTerm.toLowerCase()));
+        (study.interpretation_preview && study.interpretation_preview.toLowerCase().includes(searchTerm.toLowerCase()));
       
       const typeMatch = filterType === 'all' || study.study_type === filterType;
       
@@ -521,6 +548,13 @@ const MedicalStudies = () => {
             renderItem={renderStudyItem}
             className="studies-list"
           />
+          {nextCursor && (
+            <div className="load-more-container">
+              <button className="clear-search-button" onClick={handleLoadMore} disabled={loadingMore}>
+                {loadingMore ? 'Cargando...' : 'Cargar más'}
+              </button>
+            </div>
+          )}
         </>
       ) : studies.length > 0 ? (
         <div className="no-results-message">
@@ -528,6 +562,11 @@ const MedicalStudies = () => {
           <button className="clear-search-button" onClick={clearFilters}>
             Limpiar búsqueda
           </button>
+          {nextCursor && (
+            <button className="clear-search-button" onClick={handleLoadMore} disabled={loadingMore}>
+              {loadingMore ? 'Cargando...' : 'Buscar en más estudios'}
+            </button>
+          )}
         </div>
       ) : (
         <div className="no-studies-message">
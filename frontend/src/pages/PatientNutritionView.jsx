@@ -124,14 +124,21 @@ const PatientNutritionView = () => {
             endDate = format(new Date(), 'yyyy-MM-dd');
         }
         
-        const response = await api.get(`/doctors/patients/${patientId}/nutrition/logs`, {
-          params: { startDate, endDate }
-        });
+        // El listado está paginado por cursor; el gráfico usa todo el periodo
+        const logs = [];
+        let cursor = null;
+        do {
+          const response = await api.get(`/doctors/patients/${patientId}/nutrition/logs`, {
+            params: cursor ? { startDate, endDate, cursor } : { startDate, endDate }
+          });
+          logs.push(...response.data.logs);
+          cursor = response.data.next_cursor;
+        } while (cursor);
         
-        setNutritionLogs(response.data);
+        setNutritionLogs(logs);
         
         // Preparar datos para el gráfico
-        const chartData = response.data.map(log => ({
+        const chartData = logs.map(log => ({
           date: format(new Date(log.log_date), 'dd/MM'),
           calories: log.calories,
           proteins: log.proteins,
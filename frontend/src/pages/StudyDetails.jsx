@@ -15,6 +15,7 @@ import {
 } from '@mui/material';
 import { ArrowBack as ArrowBackIcon } from '@mui/icons-material';
 import api from '../api/axios';
+import useUploadUrl, { studyImageKey } from '../services/useUploadUrl';
 
 const StudyDetails = () => {
   const { studyId } = useParams();
@@ -23,6 +24,7 @@ const StudyDetails = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [analyzing, setAnalyzing] = useState(false);
+  const imageUrl = useUploadUrl(studyImageKey(study));
 
   useEffect(() => {
     const fetchStudy = async () => {
@@ -133,7 +135,7 @@ const StudyDetails = () => {
                 <Box sx={{ mt: 2, textAlign: 'center' }}>
                   <Box
                     component="img"
-                    src={`/uploads/${study.file_path}`}
+                    src={imageUrl || undefined}
                     alt="Estudio médico"
                     sx={{
                       maxWidth: '100%',
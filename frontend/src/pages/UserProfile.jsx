@@ -70,6 +70,45 @@ const UserProfile = () => {
   const [weightRecords, setWeightRecords] = useState([]);
   const [bloodPressureRecords, setBloodPressureRecords] = useState([]);
   const [healthAnalysis, setHealthAnalysis] = useState(null);
+  // Cursor de la siguiente página de cada lista (null si no hay más)
+  const [nextCursors, setNextCursors] = useState({});
+  const [loadingMore, setLoadingMore] = useState(false);
+  
+  // Listas paginadas por pestaña: endpoint, clave de la respuesta y setter
+  const healthLists = {
+    1: { url: '/profile/medications', key: 'medications', setRecords: setMedications },
+    2: { url: '/profile/physical-activities', key: 'activities', setRecords: setActivities },
+    3: { url: '/profile/weight', key: 'weight_records', setRecords: setWeightRecords },
+    4: { url: '/profile/blood-pressure', key: 'blood_pressure_records', setRecords: setBloodPressureRecords },
+  };
+  
+  // Carga la primera página de una lista, o la siguiente si se indica el cursor
+  const fetchHealthList = async (tab, cursor = null) => {
+    const { url, key, setRecords } = healthLists[tab];
+    const response = await api.get(url, { params: cursor ? { cursor } : {} });
+    const records = response.data[key];
+    setRecords(previous => (cursor ? [...previous, ...records] : records));
+    setNextCursors(previous => ({ ...previous, [tab]: response.data.next_cursor || null }));
+  };
+  
+  const handleLoadMore = async () => {
+    try {
+      setLoadingMore(true);
+      await fetchHealthList(tabValue, nextCursors[tabValue]);
+    } catch (err) {
+      console.error('Error al cargar más registros:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+  
+  const loadMoreButton = nextCursors[tabValue] && (
+    <Box sx={{ display: 'flex', justifyContent: 'center', mt: 2 }}>
+      <Button variant="outlined" onClick={handleLoadMore} disabled={loadingMore}>
+        {loadingMore ? <CircularProgress size={20} /> : 'Cargar más'}
+      </Button>
+    </Box>
+  );
   
   // Cargar datos del perfil
   useEffect(() => {
@@ -96,20 +135,10 @@ const UserProfile = () => {
       try {
         switch (tabValue) {
           case 1: // Medicamentos
-            const medResponse = await api.get('/profile/medications');
-            setMedications(medResponse.data.medications);
-            break;
           case 2: // Actividad física
-            const actResponse = await api.get('/profile/physical-activities');
-            setActivities(actResponse.data.activities);
-            break;
           case 3: // Peso
-            const weightResponse = await api.get('/profile/weight');
-            setWeightRecords(weightResponse.data.weight_records);
-            break;
           case 4: // Presión arterial
-            const bpResponse = await api.get('/profile/blood-pressure');
-            setBloodPressureRecords(bpResponse.data.blood_pressure_records);
+            await fetchHealthList(tabValue);
             break;
           case 5: // Análisis de salud
             const analysisResponse = await api.get('/profile/health-analysis');
@@ -476,6 +505,7 @@ const UserProfile = () => {
               </Box>
               
               <MedicationList medications={medications} />
+              {loadMoreButton}
             </Box>
           )}
           
@@ -494,6 +524,7 @@ const UserProfile = () => {
               </Box>
               
               <ActivityList activities={activities} />
+              {loadMoreButton}
             </Box>
           )}
           
@@ -512,6 +543,7 @@ const UserProfile = () => {
               </Box>
               
               <WeightChart weightRecords={weightRecords} height={profileData.height} />
+              {loadMoreButton}
             </Box>
           )}
           
@@ -530,6 +562,7 @@ const UserProfile = () => {
               </Box>
               
               <BloodPressureChart bloodPressureRecords={bloodPressureRecords} />
+              {loadMoreButton}
             </Box>
           )}
           
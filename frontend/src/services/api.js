@@ -86,9 +86,16 @@ export const doctorsService = {
   subscribe: () => api.post('/doctors/subscribe'),
 };
 
+// Servicios del almacenamiento de archivos
+export const storageService = {
+  // URL prefirmada de corta duración para un archivo propio (o una miniatura suya)
+  getDownloadUrl: (key) => api.get('/storage/presign-download', { params: { key } }),
+};
+
 export default {
   auth: authService,
   medicalStudies: medicalStudiesService,
   nutrition: nutritionService,
   doctors: doctorsService,
+  storage: storageService,
 }; 
\ No newline at end of file
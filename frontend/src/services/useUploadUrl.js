@@ -0,0 +1,40 @@
+import { useEffect, useState } from 'react';
+import { storageService } from './api';
+
+// Clave en el almacenamiento de la imagen de un estudio: la miniatura mediana si
+// existe (las URLs de miniaturas vienen como /uploads/<clave>), si no el original
+export const studyImageKey = (study) => {
+  if (!study) return null;
+  const thumbnail = study.thumbnails?.md;
+  return thumbnail ? thumbnail.replace(/^\/uploads\//, '') : study.file_path;
+};
+
+// Los estudios y sus miniaturas requieren token, que un <img> no puede enviar:
+// se pide una URL prefirmada de corta duración para usarla como src
+const useUploadUrl = (key) => {
+  const [url, setUrl] = useState(null);
+
+  useEffect(() => {
+    if (!key) {
+      setUrl(null);
+      return undefined;
+    }
+    let cancelled = false;
+    storageService.getDownloadUrl(key)
+      .then((response) => {
+        if (!cancelled) setUrl(response.data.url);
+      })
+      .catch((err) => {
+        // Rutas antiguas (fuera del almacén por contenido): se sirven directamente
+        console.error('Error al obtener la URL del archivo:', err);
+        if (!cancelled) setUrl(`/uploads/${key}`);
+      });
+    return () => {
+      cancelled = true;
+    };
+  }, [key]);
+
+  return url;
+};
+
+export default useUploadUrl;
@@ -3,7 +3,8 @@ import os
 # Número de workers
 workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
 
-# Número de threads por worker
+# Número de threads por worker. El pool de conexiones a la base de cada worker
+# se dimensiona con estas mismas variables (utils/db_engine.py)
 threads = int(os.environ.get('GUNICORN_THREADS', '4'))
 
 # Tiempo de espera para las solicitudes
@@ -1,9 +1,13 @@
 import os
 import sys
 import click
+import json
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from flask.cli import FlaskGroup
 from app import create_app
-from models import db, User
+from models import db, User, MedicalStudy
 from werkzeug.security import generate_password_hash
 
 app = create_app()
@@ -56,5 +60,413 @@ def list_users():
         for user in users:
             click.echo(f'ID: {user.id}, Email: {user.email}, Doctor: {user.is_doctor}, Rol: {user.role}')
 
+@cli.command('extract-lab-results')
+@click.option('--batch-size', default=50, help='Estudios procesados por lote')
+@click.option('--only-missing/--all', default=True, help='Procesar solo estudios sin resultados extraídos')
+def extract_lab_results(batch_size, only_missing):
+    """Extrae valores de laboratorio de los estudios ya interpretados."""
+    from models import LabResult
+    from utils.lab_results import extract_and_store_lab_results
+    from routes.medical_studies import study_local_file
+    with app.app_context():
+        query = MedicalStudy.query.filter(MedicalStudy.interpretation.isnot(None))
+        if only_missing:
+            query = query.filter(~MedicalStudy.lab_results.any())
+        
+        last_id = 0
+        processed = 0
+        while True:
+            studies = query.filter(MedicalStudy.id > last_id).order_by(MedicalStudy.id).limit(batch_size).all()
+            if not studies:
+                break
+            for study in studies:
+                last_id = study.id
+                with study_local_file(study) as file_path:
+                    count = extract_and_store_lab_results(study, file_path)
+                db.session.commit()
+                processed += 1
+                click.echo(f'Estudio {study.id}: {count if count is not None else "error"} valores')
+        click.echo(f'Extracción completada: {processed} estudios procesados.')
+
+def _load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+def _save_checkpoint(path, data):
+    # Escritura atómica para no corromper el checkpoint si el proceso muere
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as checkpoint_file:
+        json.dump(data, checkpoint_file)
+    os.replace(tmp_path, path)
+
+@cli.command('reanalyze')
+@click.option('--study-type', help='Solo estudios de este tipo')
+@click.option('--since', help='Solo estudios creados desde esta fecha (YYYY-MM-DD)')
+@click.option('--until', help='Solo estudios creados hasta esta fecha (YYYY-MM-DD)')
+@click.option('--prompt-version', help='Solo estudios analizados con esta versión (por defecto: cualquier versión distinta de la actual)')
+@click.option('--concurrency', default=2, show_default=True, help='Análisis simultáneos')
+@click.option('--rpm', default=10, show_default=True, help='Máximo de llamadas al proveedor por minuto (deja margen para el tráfico en vivo)')
+@click.option('--checkpoint', default='reanalyze_checkpoint.json', show_default=True, help='Archivo de progreso para reanudar')
+@click.option('--restart', is_flag=True, help='Ignorar el checkpoint existente y empezar de cero')
+@click.option('--limit', type=int, help='Máximo de estudios a procesar en esta ejecución')
+@click.option('--dry-run', is_flag=True, help='Solo contar los estudios seleccionados')
+def reanalyze(study_type, since, until, prompt_version, concurrency, rpm, checkpoint, restart, limit, dry_run):
+    """Regenera las interpretaciones automáticas tras un cambio de prompt o modelo."""
+    from utils.anthropic_utils import analyze_medical_study_with_anthropic, MEDICAL_STUDY_PROMPT_VERSION
+    from utils.rate_limit import RateLimiter
+    from routes.medical_studies import study_local_file, mark_ai_analysis, AI_ANALYSIS_HEADER
+    from models import LabResult
+    from utils.lab_results import extract_lab_values, store_lab_results
+
+    filters = {
+        'study_type': study_type,
+        'since': since,
+        'until': until,
+        'prompt_version': prompt_version,
+        'target_version': MEDICAL_STUDY_PROMPT_VERSION
+    }
+
+    state = None if restart else _load_checkpoint(checkpoint)
+    if state and state.get('filters') != filters:
+        raise click.ClickException('El checkpoint existente se creó con otros filtros. Usa --restart o --checkpoint con otro archivo.')
+    if not state:
+        state = {'filters': filters, 'last_id': 0, 'processed': 0, 'failed': []}
+    elif state['last_id']:
+        click.echo(f"Reanudando desde el estudio {state['last_id']} ({state['processed']} ya procesados).")
+
+    with app.app_context():
+        # Solo interpretaciones automáticas: las manuales de médicos no tienen versión
+        # y las antiguas se reconocen por la marca de análisis de IA
+        query = MedicalStudy.query.filter(db.or_(
+            MedicalStudy.analysis_prompt_version.isnot(None),
+            MedicalStudy.interpretation.like(f'{AI_ANALYSIS_HEADER}%')
+        ))
+        if prompt_version:
+            query = query.filter(MedicalStudy.analysis_prompt_version == prompt_version)
+        else:
+            query = query.filter(db.or_(
+                MedicalStudy.analysis_prompt_version.is_(None),
+                MedicalStudy.analysis_prompt_version != MEDICAL_STUDY_PROMPT_VERSION
+            ))
+        if study_type:
+            query = query.filter(MedicalStudy.study_type == study_type)
+        try:
+            if since:
+                query = query.filter(MedicalStudy.created_at >= datetime.strptime(since, '%Y-%m-%d'))
+            if until:
+                query = query.filter(MedicalStudy.created_at < datetime.strptime(until, '%Y-%m-%d') + timedelta(days=1))
+        except ValueError:
+            raise click.BadParameter('Formato de fecha inválido. Usar YYYY-MM-DD')
+
+        pending = query.filter(MedicalStudy.id > state['last_id'])
+        total = pending.count()
+        if limit:
+            total = min(total, limit)
+        click.echo(f'Estudios a reanalizar: {total} (versión objetivo {MEDICAL_STUDY_PROMPT_VERSION})')
+        if dry_run or not total:
+            return
+
+        limiter = RateLimiter(rpm)
+
+        def run_analysis(job):
+            # Se ejecuta en un hilo: solo llama al proveedor, sin tocar la sesión de la BD.
+            # Con la interpretación nueva se vuelven a extraer los valores de laboratorio
+            study_id, study, kind = job
+            try:
+                # Contexto propio del hilo para acceder al backend de almacenamiento
+                with app.app_context(), study_local_file(study) as file_path:
+                    if file_path is None:
+                        return study_id, {'success': False, 'error': 'Archivo no encontrado'}, None
+                    limiter.acquire()
+                    result = analyze_medical_study_with_anthropic(file_path, kind)
+                    if not result.get('success'):
+                        return study_id, result, None
+                    limiter.acquire()
+                    return study_id, result, extract_lab_values(file_path, result.get('analysis', ''))
+            except Exception as e:
+                return study_id, {'success': False, 'error': str(e)}, None
+
+        started = time.monotonic()
+        done = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while done < total:
+                batch_size = min(concurrency * 2, total - done)
+                studies = pending.filter(MedicalStudy.id > state['last_id']).order_by(MedicalStudy.id).limit(batch_size).all()
+                if not studies:
+                    break
+                by_id = {study.id: study for study in studies}
+                jobs = [(study.id, study, study.study_type) for study in studies]
+
+                for study_id, result, extraction in executor.map(run_analysis, jobs):
+                    study = by_id[study_id]
+                    if result.get('success'):
+                        analysis = result.get('analysis', '')
+                        if (study.interpretation or '').startswith(AI_ANALYSIS_HEADER):
+                            analysis = mark_ai_analysis(analysis)
+                        study.interpretation = analysis
+                        study.analysis_prompt_version = MEDICAL_STUDY_PROMPT_VERSION
+                        study.analyzed_at = datetime.utcnow()
+                        if store_lab_results(study, extraction or {'success': False}) is None:
+                            # Los valores anteriores ya no corresponden a la interpretación:
+                            # se borran y extract-lab-results los recalcula
+                            LabResult.query.filter_by(study_id=study_id).delete()
+                            state['lab_failed'] = state.get('lab_failed', 0) + 1
+                    else:
+                        state['failed'].append(study_id)
+                        click.echo(f"Estudio {study_id}: error - {result.get('error')}", err=True)
+
+                # Confirmar el lote y luego el checkpoint: si el proceso muere se repite como mucho un lote
+                db.session.commit()
+                state['last_id'] = studies[-1].id
+                state['processed'] += len(studies)
+                _save_checkpoint(checkpoint, state)
+
+                done += len(studies)
+                elapsed = time.monotonic() - started
+                throughput = done / elapsed * 60 if elapsed else 0
+                eta = (total - done) / (done / elapsed) if done and elapsed else 0
+                click.echo(f'{done}/{total} estudios | {throughput:.1f} estudios/min | ETA {timedelta(seconds=int(eta))}')
+
+        click.echo(f"Reanálisis completado: {state['processed']} procesados, {len(state['failed'])} con error.")
+        if state.get('lab_failed'):
+            click.echo(f"Estudios sin valores de laboratorio (extracción fallida): {state['lab_failed']}. "
+                       f"Ejecuta extract-lab-results para reintentarlos.")
+        if state['failed']:
+            click.echo(f"Estudios con error: {state['failed']}")
+
+@cli.command('generate-thumbnails')
+@click.option('--batch-size', default=100, show_default=True, help='Archivos consultados por lote')
+@click.option('--concurrency', default=2, show_default=True, help='Miniaturas generadas en paralelo')
+@click.option('--force', is_flag=True, help='Regenerar aunque ya existan')
+def generate_thumbnails_command(batch_size, concurrency, force):
+    """Genera las miniaturas de los estudios y fotos de comida ya subidos."""
+    from models import NutritionAnalysis
+    from utils.thumbnails import generate_thumbnails, has_thumbnails
+
+    def run(key):
+        with app.app_context():
+            try:
+                return key, generate_thumbnails(key, force=force), None
+            except Exception as e:
+                return key, 0, str(e)
+
+    with app.app_context():
+        created = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for model in (MedicalStudy, NutritionAnalysis):
+                last_id = 0
+                while True:
+                    rows = db.session.query(model.id, model.file_path).filter(model.id > last_id)\
+                        .order_by(model.id).limit(batch_size).all()
+                    if not rows:
+                        break
+                    last_id = rows[-1].id
+                    keys = {row.file_path for row in rows if has_thumbnails(row.file_path)}
+                    for key, count, error in executor.map(run, keys):
+                        if error:
+                            failed += 1
+                            click.echo(f'{key}: error - {error}', err=True)
+                        created += count
+        click.echo(f'Miniaturas creadas: {created}, archivos con error: {failed}.')
+
+@cli.command('gc-uploads')
+@click.option('--grace-hours', default=72, show_default=True, help='Antigüedad mínima de un archivo sin referencias para eliminarlo')
+@click.option('--batch-size', default=1000, show_default=True, help='Archivos cruzados con la base de datos por consulta')
+@click.option('--quarantine', is_flag=True, help='Mover los huérfanos a uploads/quarantine en lugar de borrarlos')
+@click.option('--purge-quarantine-days', default=30, show_default=True, help='Borrar lo que lleve más de N días en cuarentena')
+@click.option('--temp-hours', default=24, show_default=True, help='Antigüedad para borrar archivos de uploads/temp')
+@click.option('--nutrition-retention-days', type=int, help='Liberar las fotos de comida con más de N días (se conserva el análisis)')
+@click.option('--dry-run', is_flag=True, help='Solo informar, sin borrar nada')
+def gc_uploads(grace_hours, batch_size, quarantine, purge_quarantine_days, temp_hours, nutrition_retention_days, dry_run):
+    """Elimina archivos huérfanos de uploads/ y temporales abandonados (pensado para cron)."""
+    from utils import upload_gc
+
+    def log(message):
+        click.echo(message)
+
+    with app.app_context():
+        started = time.monotonic()
+        reclaimed = 0
+
+        sessions = upload_gc.expire_upload_sessions(dry_run=dry_run)
+        click.echo(f'Subidas por partes vencidas: {sessions}')
+
+        temp = upload_gc.clean_temp(temp_hours * 3600, dry_run=dry_run, log=log)
+        reclaimed += temp['reclaimed_bytes']
+        click.echo(f"Temporales: {temp['removed']} archivos, {temp['reclaimed_bytes']} bytes")
+
+        if nutrition_retention_days:
+            released = upload_gc.release_old_nutrition_images(nutrition_retention_days, dry_run=dry_run)
+            click.echo(f'Fotos de comida liberadas: {released}')
+
+        orphans = upload_gc.sweep_orphans(
+            grace_hours * 3600, batch_size=batch_size, quarantine=quarantine, dry_run=dry_run, log=log
+        )
+        reclaimed += orphans['reclaimed_bytes']
+        click.echo(
+            f"Huérfanos: {orphans['orphans']} de {orphans['scanned']} archivos, "
+            f"{orphans['reclaimed_bytes']} bytes, {orphans['errors']} errores"
+            + (' (en cuarentena)' if quarantine and not dry_run else '')
+        )
+
+        purged = upload_gc.purge_quarantine(purge_quarantine_days * 86400, dry_run=dry_run, log=log)
+        reclaimed += purged['reclaimed_bytes']
+        click.echo(f"Cuarentena vencida: {purged['purged']} archivos, {purged['reclaimed_bytes']} bytes")
+
+        click.echo(f'Total recuperado: {reclaimed / (1024 * 1024):.1f} MB en {time.monotonic() - started:.1f}s'
+                   + (' (dry-run)' if dry_run else ''))
+
+@cli.command('migrate-uploads')
+@click.option('--batch-size', default=200, show_default=True, help='Filas migradas por transacción')
+@click.option('--checkpoint', default='migrate_uploads_checkpoint.json', show_default=True, help='Archivo de progreso para reanudar')
+@click.option('--restart', is_flag=True, help='Ignorar el checkpoint existente y empezar de cero')
+@click.option('--keep-originals', is_flag=True, help='No borrar los archivos antiguos después de migrarlos')
+def migrate_uploads(batch_size, checkpoint, restart, keep_originals):
+    """Mueve los archivos de los directorios planos antiguos al almacén con prefijos de hash."""
+    from utils.upload_migration import LEGACY_SOURCES, migrate_batch, remove_migrated_originals
+
+    state = None if restart else _load_checkpoint(checkpoint)
+    if not state:
+        state = {'last_ids': {}, 'migrated': 0, 'missing': {}, 'freed_bytes': 0}
+    elif state['migrated']:
+        click.echo(f"Reanudando ({state['migrated']} archivos ya migrados).")
+
+    with app.app_context():
+        started = time.monotonic()
+        for name, model, column_name, legacy_dir in LEGACY_SOURCES:
+            last_id = state['last_ids'].get(name, 0)
+            while True:
+                try:
+                    result = migrate_batch(model, column_name, legacy_dir, last_id, batch_size)
+                    # Filas, referencias de blobs y claves nuevas en una sola transacción
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    _save_checkpoint(checkpoint, state)
+                    raise
+                if not result['rows']:
+                    break
+
+                if result['originals'] and not keep_originals:
+                    state['freed_bytes'] += remove_migrated_originals(result['originals'])
+
+                last_id = result['last_id']
+                state['last_ids'][name] = last_id
+                state['migrated'] += result['migrated']
+                if result['missing']:
+                    state['missing'].setdefault(name, []).extend(result['missing'])
+                _save_checkpoint(checkpoint, state)
+                click.echo(f"{name}: hasta id {last_id}, {result['migrated']} migrados, {len(result['missing'])} sin archivo, "
+                           f"{len(result['changed'])} modificados durante la copia")
+
+        click.echo(
+            f"Migración completada en {time.monotonic() - started:.1f}s: {state['migrated']} archivos, "
+            f"{state['freed_bytes'] / (1024 * 1024):.1f} MB liberados de los directorios antiguos."
+        )
+        for name, ids in state['missing'].items():
+            click.echo(f'{name}: {len(ids)} filas sin archivo en disco (ids: {ids[:20]}{"..." if len(ids) > 20 else ""})')
+
+@cli.command('backfill-storage-keys')
+@click.option('--batch-size', default=500, show_default=True, help='Estudios verificados por transacción')
+def backfill_storage_keys(batch_size):
+    """Calcula y verifica una sola vez la clave normalizada del archivo de cada estudio."""
+    from utils.blob_store import is_blob_key
+    from utils.storage import get_storage
+    from utils.upload_migration import resolve_legacy_path
+
+    with app.app_context():
+        storage = get_storage()
+        uploads_root = os.path.join(app.root_path, 'uploads')
+        last_id = 0
+        resolved = 0
+        missing = []
+        while True:
+            studies = MedicalStudy.query.filter(MedicalStudy.id > last_id, MedicalStudy.storage_key.is_(None))\
+                .order_by(MedicalStudy.id).limit(batch_size).all()
+            if not studies:
+                break
+            for study in studies:
+                last_id = study.id
+                if is_blob_key(study.file_path):
+                    key = study.file_path if storage.exists(study.file_path) else None
+                else:
+                    # Rutas antiguas: 'medical_studies/<nombre>' (app.py) o solo '<nombre>' (blueprint)
+                    path = resolve_legacy_path(study.file_path, 'medical_studies', app.root_path)
+                    key = os.path.relpath(path, uploads_root).replace(os.sep, '/') if path else None
+                if key:
+                    study.storage_key = key
+                    resolved += 1
+                else:
+                    missing.append(study.id)
+            db.session.commit()
+            click.echo(f'Hasta el estudio {last_id}: {resolved} claves, {len(missing)} sin archivo')
+
+        click.echo(f'Backfill completado: {resolved} estudios con clave, {len(missing)} sin archivo.')
+        if missing:
+            click.echo(f'Estudios sin archivo: {missing[:50]}{"..." if len(missing) > 50 else ""}')
+
+@cli.command('reconcile-ratings')
+@click.option('--batch-size', default=500, show_default=True, help='Médicos verificados por transacción')
+@click.option('--dry-run', is_flag=True, help='Solo informar los desvíos, sin corregirlos')
+def reconcile_ratings_command(batch_size, dry_run):
+    """Recalcula los agregados de valoración de los médicos desde sus reseñas."""
+    from utils.doctor_ratings import reconcile_ratings
+
+    with app.app_context():
+        drifted = reconcile_ratings(batch_size=batch_size, dry_run=dry_run)
+        for doctor_id, stored, expected in drifted[:50]:
+            click.echo(f'Médico {doctor_id}: {stored["rating_count"]} reseñas / suma {stored["rating_sum"]} '
+                       f'-> {expected["rating_count"]} / {expected["rating_sum"]}')
+        action = 'con desvíos' if dry_run else 'corregidos'
+        click.echo(f'Reconciliación completada: {len(drifted)} médicos {action}.')
+
+@cli.command('check-query-plans')
+def check_query_plans_command():
+    """Verifica con EXPLAIN que las consultas de los endpoints principales usan sus índices."""
+    from utils.query_plans import check_query_plans
+
+    with app.app_context():
+        results = check_query_plans()
+        for endpoint, expected, used, ok in results:
+            status = 'OK' if ok else 'FALLO'
+            detail = ', '.join(sorted(used)) if used else 'lectura completa de la tabla'
+            click.echo(f'[{status}] {endpoint}: se esperaba {expected}; usa {detail}')
+        failed = [endpoint for endpoint, _, _, ok in results if not ok]
+        if failed:
+            click.echo(f'{len(failed)} consultas sin el índice esperado.')
+            sys.exit(1)
+        click.echo('Todas las consultas usan su índice.')
+
+@cli.command('rebuild-nutrition-totals')
+@click.option('--user-id', 'user_ids', type=int, multiple=True, help='Solo estos usuarios (se puede repetir)')
+@click.option('--batch-size', default=500, show_default=True, help='Usuarios recalculados por transacción')
+def rebuild_nutrition_totals(user_ids, batch_size):
+    """Recalcula nutrition_daily_totals desde nutrition_logs."""
+    from utils.nutrition_totals import rebuild_daily_totals
+
+    with app.app_context():
+        written = rebuild_daily_totals(user_ids=list(user_ids) or None, batch_size=batch_size, log=click.echo)
+        click.echo(f'Totales diarios recalculados: {written} filas.')
+
+@cli.command('replica-status')
+def replica_status_command():
+    """Mide el retraso de cada réplica de lectura configurada."""
+    from utils.db_routing import replica_status
+
+    with app.app_context():
+        status = replica_status(app, refresh=True)
+        if not status:
+            click.echo('No hay réplicas configuradas (DATABASE_REPLICA_URLS).')
+            return
+        for replica in status:
+            lag = 'no responde' if replica['lag'] is None else f"{replica['lag']:.1f}s de retraso"
+            state = 'en uso' if replica['usable'] else 'descartada'
+            click.echo(f"{replica['url']}: {lag} ({state})")
+        if not any(replica['usable'] for replica in status):
+            sys.exit(1)
+
 if __name__ == '__main__':
     cli() 
\ No newline at end of file
@@ -5,6 +5,8 @@ from flask import current_app
 
 from alembic import context
 
+from utils.db_engine import without_statement_timeout
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -93,6 +95,8 @@ def run_migrations_online():
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        # Backfills y CREATE INDEX CONCURRENTLY pueden superar DB_STATEMENT_TIMEOUT_MS
+        connection = without_statement_timeout(connection, current_app.config.get('DB_PGBOUNCER', False))
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
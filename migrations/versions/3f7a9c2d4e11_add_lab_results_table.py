@@ -0,0 +1,41 @@
+"""Add lab_results table
+
+Revision ID: 3f7a9c2d4e11
+Revises: 1ca1af9737f4
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f7a9c2d4e11'
+down_revision = '1ca1af9737f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('lab_results',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('study_id', sa.Integer(), nullable=False),
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('analyte', sa.String(length=100), nullable=False),
+    sa.Column('value', sa.Float(), nullable=False),
+    sa.Column('unit', sa.String(length=30), nullable=True),
+    sa.Column('reference_low', sa.Float(), nullable=True),
+    sa.Column('reference_high', sa.Float(), nullable=True),
+    sa.Column('reference_range', sa.String(length=100), nullable=True),
+    sa.Column('study_date', sa.Date(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['patient_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['study_id'], ['medical_studies.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_lab_results_patient_analyte_date', 'lab_results', ['patient_id', 'analyte', 'study_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_lab_results_patient_analyte_date', table_name='lab_results')
+    op.drop_table('lab_results')
@@ -0,0 +1,27 @@
+"""Allow nutrition analyses without an image
+
+Revision ID: 4d9e2b7c1a58
+Revises: e8d3b7a15c62
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d9e2b7c1a58'
+down_revision = 'e8d3b7a15c62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('nutrition_analysis', schema=None) as batch_op:
+        batch_op.alter_column('file_path', existing_type=sa.String(length=255), nullable=True)
+
+
+def downgrade():
+    op.execute("UPDATE nutrition_analysis SET file_path = '' WHERE file_path IS NULL")
+    with op.batch_alter_table('nutrition_analysis', schema=None) as batch_op:
+        batch_op.alter_column('file_path', existing_type=sa.String(length=255), nullable=False)
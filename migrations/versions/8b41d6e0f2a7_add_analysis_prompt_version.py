@@ -0,0 +1,28 @@
+"""Add analysis prompt version to medical studies
+
+Revision ID: 8b41d6e0f2a7
+Revises: 3f7a9c2d4e11
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41d6e0f2a7'
+down_revision = '3f7a9c2d4e11'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('medical_studies', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('analysis_prompt_version', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('analyzed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('medical_studies', schema=None) as batch_op:
+        batch_op.drop_column('analyzed_at')
+        batch_op.drop_column('analysis_prompt_version')
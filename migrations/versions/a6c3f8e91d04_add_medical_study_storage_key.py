@@ -0,0 +1,26 @@
+"""Add normalized storage key to medical studies
+
+Revision ID: a6c3f8e91d04
+Revises: 4d9e2b7c1a58
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c3f8e91d04'
+down_revision = '4d9e2b7c1a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('medical_studies', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('storage_key', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('medical_studies', schema=None) as batch_op:
+        batch_op.drop_column('storage_key')
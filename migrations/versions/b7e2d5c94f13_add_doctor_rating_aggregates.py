@@ -0,0 +1,47 @@
+"""Add denormalized rating aggregates to doctors
+
+Revision ID: b7e2d5c94f13
+Revises: a6c3f8e91d04
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d5c94f13'
+down_revision = 'a6c3f8e91d04'
+branch_labels = None
+depends_on = None
+
+RATING_COLUMNS = ['rating_count', 'rating_sum'] + [f'rating_{stars}' for stars in range(1, 6)]
+
+
+def upgrade():
+    with op.batch_alter_table('doctors', schema=None) as batch_op:
+        for name in RATING_COLUMNS:
+            batch_op.add_column(sa.Column(name, sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('rating_average', sa.Float(), nullable=False, server_default='0'))
+        batch_op.create_index('ix_doctors_rating_average_id', ['rating_average', 'id'], unique=False)
+
+    # Cargar los agregados de las reseñas existentes
+    histogram = ', '.join(
+        f"rating_{stars} = (SELECT COUNT(*) FROM doctor_reviews r WHERE r.doctor_id = doctors.id AND r.rating = {stars})"
+        for stars in range(1, 6)
+    )
+    op.execute(f"""
+        UPDATE doctors SET
+            rating_count = (SELECT COUNT(*) FROM doctor_reviews r WHERE r.doctor_id = doctors.id),
+            rating_sum = (SELECT COALESCE(SUM(r.rating), 0) FROM doctor_reviews r WHERE r.doctor_id = doctors.id),
+            rating_average = (SELECT COALESCE(AVG(r.rating * 1.0), 0) FROM doctor_reviews r WHERE r.doctor_id = doctors.id),
+            {histogram}
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('doctors', schema=None) as batch_op:
+        batch_op.drop_index('ix_doctors_rating_average_id')
+        batch_op.drop_column('rating_average')
+        for name in reversed(RATING_COLUMNS):
+            batch_op.drop_column(name)
@@ -0,0 +1,60 @@
+"""Add composite indexes for per-user time-series queries
+
+Revision ID: c3a8f17e6b25
+Revises: b7e2d5c94f13
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a8f17e6b25'
+down_revision = 'b7e2d5c94f13'
+branch_labels = None
+depends_on = None
+
+# (nombre, tabla, columnas)
+INDEXES = [
+    ('ix_nutrition_logs_user_date', 'nutrition_logs', ['user_id', 'log_date']),
+    ('ix_weight_records_user_date', 'weight_records', ['user_id', 'date']),
+    ('ix_blood_pressure_records_user_measured', 'blood_pressure_records', ['user_id', 'measured_at']),
+    ('ix_physical_activities_user_date', 'physical_activities', ['user_id', 'date']),
+    ('ix_health_profiles_user_created', 'health_profiles', ['user_id', 'created_at']),
+    ('ix_medical_studies_patient_created', 'medical_studies', ['patient_id', 'created_at', 'id']),
+    ('ix_medical_studies_created_id', 'medical_studies', ['created_at', 'id']),
+    ('ix_nutrition_analysis_user_created', 'nutrition_analysis', ['user_id', 'created_at']),
+    ('ix_doctor_reviews_doctor_user', 'doctor_reviews', ['doctor_id', 'user_id']),
+    ('ix_doctors_user_id', 'doctors', ['user_id']),
+]
+
+
+def _is_postgres():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade():
+    if not _is_postgres():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False)
+        return
+
+    # CREATE INDEX CONCURRENTLY no bloquea las escrituras, pero no puede ejecutarse
+    # dentro de una transacción. Un intento interrumpido deja un índice INVALID:
+    # se elimina antes de volver a crearlo.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.execute(sa.text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    if not _is_postgres():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table)
+        return
+
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,43 @@
+"""Add nutrition_daily_totals rollup table
+
+Revision ID: d9f4b6a2c871
+Revises: c3a8f17e6b25
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9f4b6a2c871'
+down_revision = 'c3a8f17e6b25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('nutrition_daily_totals',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('calories', sa.Integer(), nullable=False),
+    sa.Column('proteins', sa.Float(), nullable=False),
+    sa.Column('carbs', sa.Float(), nullable=False),
+    sa.Column('fats', sa.Float(), nullable=False),
+    sa.Column('entry_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'day')
+    )
+
+    # Cargar los totales de los registros existentes
+    op.execute("""
+        INSERT INTO nutrition_daily_totals (user_id, day, calories, proteins, carbs, fats, entry_count)
+        SELECT user_id, log_date, COALESCE(SUM(calories), 0), COALESCE(SUM(proteins), 0),
+               COALESCE(SUM(carbs), 0), COALESCE(SUM(fats), 0), COUNT(id)
+        FROM nutrition_logs
+        GROUP BY user_id, log_date
+    """)
+
+
+def downgrade():
+    op.drop_table('nutrition_daily_totals')
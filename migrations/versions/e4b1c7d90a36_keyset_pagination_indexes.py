@@ -0,0 +1,70 @@
+"""Extend per-user time-series indexes with id for keyset pagination
+
+Revision ID: e4b1c7d90a36
+Revises: d9f4b6a2c871
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b1c7d90a36'
+down_revision = 'd9f4b6a2c871'
+branch_labels = None
+depends_on = None
+
+# Los listados paginan sobre (fecha, id): con el id en el índice cada página es
+# un recorrido del índice sin ordenar los empates.
+# (nombre nuevo, tabla, columnas, índice que reemplaza y sus columnas)
+INDEXES = [
+    ('ix_nutrition_logs_user_date_id', 'nutrition_logs', ['user_id', 'log_date', 'id'],
+     'ix_nutrition_logs_user_date', ['user_id', 'log_date']),
+    ('ix_weight_records_user_date_id', 'weight_records', ['user_id', 'date', 'id'],
+     'ix_weight_records_user_date', ['user_id', 'date']),
+    ('ix_blood_pressure_records_user_measured_id', 'blood_pressure_records', ['user_id', 'measured_at', 'id'],
+     'ix_blood_pressure_records_user_measured', ['user_id', 'measured_at']),
+    ('ix_physical_activities_user_date_id', 'physical_activities', ['user_id', 'date', 'id'],
+     'ix_physical_activities_user_date', ['user_id', 'date']),
+    ('ix_medications_user_created_id', 'medications', ['user_id', 'created_at', 'id'],
+     None, None),
+]
+
+
+def _is_postgres():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade():
+    if not _is_postgres():
+        for name, table, columns, replaced, _ in INDEXES:
+            op.create_index(name, table, columns, unique=False)
+            if replaced:
+                op.drop_index(replaced, table_name=table)
+        return
+
+    # Se crea el índice nuevo antes de borrar el anterior para que las consultas
+    # siempre tengan uno disponible (ver c3a8f17e6b25 sobre CONCURRENTLY)
+    with op.get_context().autocommit_block():
+        for name, table, columns, replaced, _ in INDEXES:
+            op.execute(sa.text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+            if replaced:
+                op.drop_index(replaced, table_name=table, postgresql_concurrently=True)
+
+
+def downgrade():
+    if not _is_postgres():
+        for name, table, _, replaced, replaced_columns in reversed(INDEXES):
+            if replaced:
+                op.create_index(replaced, table, replaced_columns, unique=False)
+            op.drop_index(name, table_name=table)
+        return
+
+    with op.get_context().autocommit_block():
+        for name, table, _, replaced, replaced_columns in reversed(INDEXES):
+            if replaced:
+                op.execute(sa.text(f'DROP INDEX CONCURRENTLY IF EXISTS {replaced}'))
+                op.create_index(replaced, table, replaced_columns, unique=False, postgresql_concurrently=True)
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,35 @@
+"""Add blobs table for content-addressed uploads
+
+Revision ID: e8d3b7a15c62
+Revises: c52e1f9a7b30
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8d3b7a15c62'
+down_revision = 'c52e1f9a7b30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('blobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('storage_key', sa.String(length=255), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('storage_key')
+    )
+    op.create_index(op.f('ix_blobs_sha256'), 'blobs', ['sha256'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_blobs_sha256'), table_name='blobs')
+    op.drop_table('blobs')
@@ -0,0 +1,79 @@
+"""Allow a single review per user and doctor
+
+Revision ID: f2a9c4e7b813
+Revises: e4b1c7d90a36
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a9c4e7b813'
+down_revision = 'e4b1c7d90a36'
+branch_labels = None
+depends_on = None
+
+# Dos primeras reseñas simultáneas del mismo usuario pasaban ambas la comprobación
+# de la ruta y se contaban dos veces en los agregados. Antes de crear el índice
+# único se deja la reseña más reciente de cada par y se recalculan los agregados
+# de los médicos desde doctor_reviews (como reconcile-ratings).
+UNIQUE_INDEX = 'ux_doctor_reviews_doctor_user'
+OLD_INDEX = 'ix_doctor_reviews_doctor_user'
+COLUMNS = ['doctor_id', 'user_id']
+
+DELETE_DUPLICATES = """
+DELETE FROM doctor_reviews
+WHERE id NOT IN (
+    SELECT MAX(id) FROM doctor_reviews GROUP BY doctor_id, user_id
+)
+"""
+
+_COUNT = "SELECT COUNT(*) FROM doctor_reviews r WHERE r.doctor_id = doctors.id"
+_SUM = "SELECT COALESCE(SUM(r.rating), 0) FROM doctor_reviews r WHERE r.doctor_id = doctors.id"
+RECOMPUTE_RATINGS = f"""
+UPDATE doctors SET
+    rating_count = ({_COUNT}),
+    rating_sum = ({_SUM}),
+    rating_average = COALESCE(({_SUM}) * 1.0 / NULLIF(({_COUNT}), 0), 0),
+    rating_1 = ({_COUNT} AND r.rating = 1),
+    rating_2 = ({_COUNT} AND r.rating = 2),
+    rating_3 = ({_COUNT} AND r.rating = 3),
+    rating_4 = ({_COUNT} AND r.rating = 4),
+    rating_5 = ({_COUNT} AND r.rating = 5)
+"""
+
+
+def _is_postgres():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade():
+    op.execute(sa.text(DELETE_DUPLICATES))
+    op.execute(sa.text(RECOMPUTE_RATINGS))
+
+    if not _is_postgres():
+        op.create_index(UNIQUE_INDEX, 'doctor_reviews', COLUMNS, unique=True)
+        op.drop_index(OLD_INDEX, table_name='doctor_reviews')
+        return
+
+    # Confirmar la limpieza antes de crear el índice fuera de la transacción
+    # (ver c3a8f17e6b25 sobre CONCURRENTLY)
+    with op.get_context().autocommit_block():
+        op.execute(sa.text(f'DROP INDEX CONCURRENTLY IF EXISTS {UNIQUE_INDEX}'))
+        op.create_index(UNIQUE_INDEX, 'doctor_reviews', COLUMNS, unique=True, postgresql_concurrently=True)
+        op.drop_index(OLD_INDEX, table_name='doctor_reviews', postgresql_concurrently=True)
+
+
+def downgrade():
+    # Las reseñas duplicadas borradas no se recuperan
+    if not _is_postgres():
+        op.create_index(OLD_INDEX, 'doctor_reviews', COLUMNS, unique=False)
+        op.drop_index(UNIQUE_INDEX, table_name='doctor_reviews')
+        return
+
+    with op.get_context().autocommit_block():
+        op.execute(sa.text(f'DROP INDEX CONCURRENTLY IF EXISTS {OLD_INDEX}'))
+        op.create_index(OLD_INDEX, 'doctor_reviews', COLUMNS, unique=False, postgresql_concurrently=True)
+        op.drop_index(UNIQUE_INDEX, table_name='doctor_reviews', postgresql_concurrently=True)
@@ -1,12 +1,13 @@
-from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date
 import enum
 from enum import Enum
 import uuid
 from sqlalchemy.dialects.postgresql import ARRAY
+from utils.db_routing import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+# Sesión que envía las lecturas de las rutas @replica_read a las réplicas (utils/db_routing.py)
+db = RoutingSQLAlchemy()
 
 class UserRole(enum.Enum):
     USER = "user"
@@ -81,7 +82,7 @@ class User(db.Model):
         return self.role in ['ADMIN', 'SUPERADMIN']
     
     def is_superadmin(self):
-        return self.role == UserRole.SUPERADMIN
+        return self.role == 'SUPERADMIN'
     
     def calculate_age(self):
         if not self.date_of_birth:
@@ -136,6 +137,22 @@ class Doctor(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Agregados de las reseñas, mantenidos en la misma transacción que cada alta,
+    # cambio o baja (utils/doctor_ratings.py); `manage.py reconcile-ratings` corrige desvíos
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_average = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    __table_args__ = (
+        db.Index('ix_doctors_rating_average_id', 'rating_average', 'id'),
+        db.Index('ix_doctors_user_id', 'user_id'),
+    )
+    
     # Relaciones
     credentials = db.relationship('DoctorCredential', backref='doctor', lazy=True)
     reviews = db.relationship('DoctorReview', backref='doctor', lazy=True)
@@ -155,15 +172,19 @@ class Doctor(db.Model):
             'office_address': self.office_address,
             'office_phone': self.office_phone,
             'average_rating': self.get_average_rating(),
-            'review_count': len(self.reviews),
+            'review_count': self.rating_count or 0,
+            'rating_histogram': self.get_rating_histogram(),
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
     
     def get_average_rating(self):
-        if not self.reviews:
+        if not self.rating_count:
             return 0
-        return sum(review.rating for review in self.reviews) / len(self.reviews)
+        return self.rating_sum / self.rating_count
+    
+    def get_rating_histogram(self):
+        return {str(stars): getattr(self, f'rating_{stars}') or 0 for stars in range(1, 6)}
 
 class MedicalStudy(db.Model):
     __tablename__ = 'medical_studies'
@@ -173,15 +194,102 @@ class MedicalStudy(db.Model):
     name = db.Column(db.String(255), nullable=True)
     study_type = db.Column(db.String(50), nullable=False)
     file_path = db.Column(db.String(255), nullable=False)
+    # Clave normalizada en el almacenamiento (relativa a uploads/), verificada al guardar o por el backfill
+    storage_key = db.Column(db.String(255), nullable=True)
     interpretation = db.Column(db.Text, nullable=True)
+    # Versión del prompt con la que se generó la interpretación automática (None si la escribió un médico)
+    analysis_prompt_version = db.Column(db.String(20), nullable=True)
+    analyzed_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_medical_studies_patient_created', 'patient_id', 'created_at', 'id'),
+        db.Index('ix_medical_studies_created_id', 'created_at', 'id'),
+    )
+    
     # Relación con el usuario (paciente)
     patient = db.relationship('User', backref=db.backref('medical_studies', lazy=True))
     
     def __repr__(self):
         return f'<MedicalStudy {self.id}>'
 
+class Blob(db.Model):
+    __tablename__ = 'blobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    storage_key = db.Column(db.String(255), nullable=False, unique=True)  # ruta relativa a uploads/
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Blob {self.storage_key} refs={self.ref_count}>'
+
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    study_type = db.Column(db.String(50), nullable=False, default='general')
+    total_size = db.Column(db.BigInteger, nullable=False)
+    offset = db.Column(db.BigInteger, nullable=False, default=0)
+    expected_sha256 = db.Column(db.String(64), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='uploading')  # uploading, completed
+    study_id = db.Column(db.Integer, db.ForeignKey('medical_studies.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'filename': self.filename,
+            'study_type': self.study_type,
+            'total_size': self.total_size,
+            'offset': self.offset,
+            'status': self.status,
+            'study_id': self.study_id,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+class LabResult(db.Model):
+    __tablename__ = 'lab_results'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    study_id = db.Column(db.Integer, db.ForeignKey('medical_studies.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    analyte = db.Column(db.String(100), nullable=False)  # nombre normalizado (minúsculas)
+    value = db.Column(db.Float, nullable=False)
+    unit = db.Column(db.String(30))
+    reference_low = db.Column(db.Float)
+    reference_high = db.Column(db.Float)
+    reference_range = db.Column(db.String(100))  # texto original del rango de referencia
+    study_date = db.Column(db.Date, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relación con el estudio de origen
+    study = db.relationship('MedicalStudy', backref=db.backref('lab_results', lazy=True, cascade='all, delete-orphan'))
+    
+    __table_args__ = (
+        db.Index('ix_lab_results_patient_analyte_date', 'patient_id', 'analyte', 'study_date'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'study_id': self.study_id,
+            'patient_id': self.patient_id,
+            'analyte': self.analyte,
+            'value': self.value,
+            'unit': self.unit,
+            'reference_low': self.reference_low,
+            'reference_high': self.reference_high,
+            'reference_range': self.reference_range,
+            'study_date': self.study_date.isoformat() if self.study_date else None
+        }
+
 class Payment(db.Model):
     __tablename__ = 'payments'
     
@@ -209,10 +317,15 @@ class NutritionAnalysis(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    file_path = db.Column(db.String(255), nullable=False)
+    # None cuando la imagen se eliminó por antigüedad (se conserva el texto del análisis)
+    file_path = db.Column(db.String(255), nullable=True)
     analysis = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_nutrition_analysis_user_created', 'user_id', 'created_at'),
+    )
+    
     # Relación con el usuario
     user = db.relationship('User', backref=db.backref('nutrition_analyses', lazy=True))
     
@@ -249,6 +362,10 @@ class HealthProfile(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_health_profiles_user_created', 'user_id', 'created_at'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -284,6 +401,10 @@ class Medication(db.Model):
     # Relación con recordatorios
     reminders = db.relationship('MedicationReminder', backref='medication', lazy=True)
     
+    __table_args__ = (
+        db.Index('ix_medications_user_created_id', 'user_id', 'created_at', 'id'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -322,6 +443,10 @@ class PhysicalActivity(db.Model):
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_physical_activities_user_date_id', 'user_id', 'date', 'id'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -346,6 +471,10 @@ class BloodPressure(db.Model):
     measured_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     notes = db.Column(db.Text)
     
+    __table_args__ = (
+        db.Index('ix_blood_pressure_records_user_measured_id', 'user_id', 'measured_at', 'id'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -366,6 +495,10 @@ class WeightRecord(db.Model):
     date = db.Column(db.Date, nullable=False, default=datetime.utcnow().date)
     notes = db.Column(db.Text)
     
+    __table_args__ = (
+        db.Index('ix_weight_records_user_date_id', 'user_id', 'date', 'id'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -418,6 +551,11 @@ class DoctorReview(db.Model):
     comment = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        # Una reseña por usuario y médico (los agregados de valoración cuentan cada fila)
+        db.Index('ux_doctor_reviews_doctor_user', 'doctor_id', 'user_id', unique=True),
+    )
+    
     # Relación con el usuario que hizo la reseña
     user = db.relationship('User', backref='doctor_reviews')
     
@@ -448,6 +586,10 @@ class NutritionLog(db.Model):
     source_analysis_id = db.Column(db.Integer, db.ForeignKey('nutrition_analysis.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_nutrition_logs_user_date_id', 'user_id', 'log_date', 'id'),
+    )
+
     user = db.relationship('User', backref=db.backref('nutrition_logs', lazy=True))
     source_analysis = db.relationship('NutritionAnalysis', backref=db.backref('log_entry', uselist=False))
 
@@ -464,6 +606,29 @@ class NutritionLog(db.Model):
             'created_at': self.created_at.isoformat()
         }
 
+# Totales diarios por usuario, actualizados en la misma transacción que cada
+# NutritionLog (utils/nutrition_totals.py); `manage.py rebuild-nutrition-totals` los recalcula
+class NutritionDailyTotal(db.Model):
+    __tablename__ = 'nutrition_daily_totals'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    calories = db.Column(db.Integer, nullable=False, default=0)
+    proteins = db.Column(db.Float, nullable=False, default=0.0)
+    carbs = db.Column(db.Float, nullable=False, default=0.0)
+    fats = db.Column(db.Float, nullable=False, default=0.0)
+    entry_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'date': self.day.isoformat(),
+            'calories': self.calories,
+            'proteins': self.proteins,
+            'carbs': self.carbs,
+            'fats': self.fats,
+            'entry_count': self.entry_count
+        }
+
 # Tabla de relación entre médicos y pacientes
 class DoctorPatient(db.Model):
     __tablename__ = 'doctor_patients'
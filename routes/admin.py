@@ -1,23 +1,18 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, User, UserRole
+from utils import metrics
+from utils.db_engine import pool_status
+from utils.db_routing import replica_read, replica_status
+from utils.auth import current_is_admin, current_is_superadmin
 
 admin_bp = Blueprint('admin', __name__)
 
-def is_admin(user_id):
-    user = User.query.get(user_id)
-    return user and user.is_admin()
-
-def is_superadmin(user_id):
-    user = User.query.get(user_id)
-    return user and user.is_superadmin()
-
 @admin_bp.route('/users', methods=['GET'])
 @jwt_required()
+@replica_read
 def get_users():
-    user_id = get_jwt_identity()
-    
-    if not is_admin(user_id):
+    if not current_is_admin():
         return jsonify({'error': 'Acceso denegado'}), 403
     
     users = User.query.all()
@@ -28,9 +23,7 @@ def get_users():
 @admin_bp.route('/users/<int:user_id>/role', methods=['PUT'])
 @jwt_required()
 def update_user_role(user_id):
-    current_user_id = get_jwt_identity()
-    
-    if not is_admin(current_user_id):
+    if not current_is_admin():
         return jsonify({'error': 'Acceso denegado'}), 403
     
     data = request.get_json()
@@ -46,7 +39,7 @@ def update_user_role(user_id):
         return jsonify({'error': 'Rol inválido'}), 400
     
     # Solo un superadmin puede crear otro superadmin
-    if role == UserRole.SUPERADMIN and not is_superadmin(current_user_id):
+    if role == UserRole.SUPERADMIN and not current_is_superadmin():
         return jsonify({'error': 'Solo un SuperAdmin puede crear otro SuperAdmin'}), 403
     
     user = User.query.get(user_id)
@@ -54,10 +47,11 @@ def update_user_role(user_id):
         return jsonify({'error': 'Usuario no encontrado'}), 404
     
     # Un admin no puede cambiar el rol de un superadmin
-    if user.is_superadmin() and not is_superadmin(current_user_id):
+    if user.is_superadmin() and not current_is_superadmin():
         return jsonify({'error': 'No puedes cambiar el rol de un SuperAdmin'}), 403
     
-    user.role = role
+    # Guardar el nombre ('ADMIN'), como en el registro y en los claims del token
+    user.role = role.name
     
     # Si el rol es doctor o admin, asegurarse de que tenga los privilegios necesarios
     if role in [UserRole.DOCTOR, UserRole.ADMIN, UserRole.SUPERADMIN]:
@@ -69,4 +63,16 @@ def update_user_role(user_id):
     return jsonify({
         'message': 'Rol actualizado con éxito',
         'user': user.to_dict()
-    }), 200 
\ No newline at end of file
+    }), 200
+
+@admin_bp.route('/metrics', methods=['GET'])
+@jwt_required()
+def get_metrics():
+    if not current_is_admin():
+        return jsonify({'error': 'Acceso denegado'}), 403
+    
+    # Las métricas son por proceso (cada worker de gunicorn lleva las suyas)
+    snapshot = metrics.snapshot()
+    snapshot['db_pool'] = pool_status(db.engine)
+    snapshot['db_replicas'] = replica_status(current_app)
+    return jsonify(snapshot), 200
@@ -6,6 +6,7 @@ from datetime import timedelta, datetime
 import secrets
 from flask import current_app, url_for
 from utils.email_utils import send_password_reset_email
+from utils.auth import issue_access_token, current_user, current_is_doctor
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -46,8 +47,8 @@ def register():
             db.session.add(doctor)
             db.session.commit()
         
-        # Generar token
-        access_token = create_access_token(identity=str(user.id))
+        # Generar token (incluye el rol como claims firmados)
+        access_token = issue_access_token(user)
         print(f"Token generado para usuario {user.id}: {access_token}")
         
         response_data = {
@@ -82,10 +83,7 @@ def login():
             return jsonify({'error': 'Credenciales inválidas'}), 401
         
         # Generar token con expiración de 1 día
-        access_token = create_access_token(
-            identity=str(user.id),
-            expires_delta=timedelta(days=1)
-        )
+        access_token = issue_access_token(user, expires_delta=timedelta(days=1))
         
         return jsonify({
             'token': access_token,
@@ -104,8 +102,7 @@ def login():
 @jwt_required()
 def get_current_user():
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        user = current_user()
         
         if not user:
             return jsonify({'error': 'Usuario no encontrado'}), 404
@@ -117,13 +114,10 @@ def get_current_user():
 @auth_bp.route('/doctor', methods=['GET'])
 @jwt_required()
 def get_doctor_profile():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if not user or not user.is_doctor:
+    if not current_is_doctor():
         return jsonify({'error': 'Usuario no es doctor'}), 403
     
-    doctor = Doctor.query.filter_by(user_id=user.id).first()
+    doctor = Doctor.query.filter_by(user_id=get_jwt_identity()).first()
     if not doctor:
         return jsonify({'error': 'Doctor no encontrado'}), 404
     
@@ -2,10 +2,15 @@ from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
 from models import db, User, Doctor, DoctorCredential, DoctorReview
+from sqlalchemy.exc import IntegrityError
 import os
 import uuid
 from datetime import datetime
 import json
+from utils.blob_store import store_upload, release_or_remove
+from utils.ingest import IngestError, IMAGE_TYPES, DOCUMENT_TYPES
+from utils.doctor_ratings import apply_rating_change, rating_summary
+from utils.auth import current_user, current_is_doctor, current_is_admin
 
 doctor_profile_bp = Blueprint('doctor_profile', __name__)
 
@@ -22,11 +27,12 @@ def get_doctor_profile():
     user_id = get_jwt_identity()
     
     try:
-        # Verificar que el usuario es un médico
-        user = User.query.get(user_id)
-        
-        if not user or not user.is_doctor:
+        # Verificar que el usuario es un médico (claim del token, sin consultar la base)
+        if not current_is_doctor():
             return jsonify({'error': 'Acceso denegado. Se requiere ser médico.'}), 403
+        user = current_user()
+        if not user:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
         
         # Obtener el perfil del médico
         doctor = Doctor.query.filter_by(user_id=user_id).first()
@@ -70,11 +76,12 @@ def update_doctor_profile():
     user_id = get_jwt_identity()
     
     try:
-        # Verificar que el usuario es un médico
-        user = User.query.get(user_id)
-        
-        if not user or not user.is_doctor:
+        # Verificar que el usuario es un médico (claim del token, sin consultar la base)
+        if not current_is_doctor():
             return jsonify({'error': 'Acceso denegado. Se requiere ser médico.'}), 403
+        user = current_user()
+        if not user:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
         
         # Obtener el perfil del médico
         doctor = Doctor.query.filter_by(user_id=user_id).first()
@@ -107,22 +114,25 @@ def update_doctor_profile():
             file = request.files['profile_picture']
             
             if file and file.filename:
-                # Crear nombre de archivo seguro
-                filename = secure_filename(file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
+                # Guardar archivo en el almacén por contenido
+                try:
+                    new_picture = store_upload(file, IMAGE_TYPES | {'image/gif'})
+                except IngestError as e:
+                    return jsonify({'error': str(e)}), e.status
                 
-                # Guardar archivo
-                upload_dir = os.path.join(current_app.root_path, 'uploads', 'profile_pics')
-                os.makedirs(upload_dir, exist_ok=True)
-                file_path = os.path.join(upload_dir, unique_filename)
-                file.save(file_path)
+                # Liberar la foto anterior
+                if user.profile_picture:
+                    release_or_remove(user.profile_picture)
                 
                 # Actualizar ruta en el usuario
-                user.profile_picture = f"profile_pics/{unique_filename}"
+                user.profile_picture = new_picture
         
         # Actualizar credenciales
         if 'credentials' in profile_data:
-            # Eliminar credenciales existentes
+            # Eliminar credenciales existentes, liberando sus archivos
+            for old_credential in DoctorCredential.query.filter_by(doctor_id=doctor.id).all():
+                if old_credential.file_path:
+                    release_or_remove(old_credential.file_path)
             DoctorCredential.query.filter_by(doctor_id=doctor.id).delete()
             
             # Añadir nuevas credenciales
@@ -150,9 +160,8 @@ def update_doctor_profile():
 @jwt_required()
 def get_credentials():
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
     
-    if not user or not user.is_doctor:
+    if not current_is_doctor():
         return jsonify({'error': 'No autorizado'}), 403
     
     doctor = Doctor.query.filter_by(user_id=user_id).first()
@@ -170,9 +179,8 @@ def get_credentials():
 @jwt_required()
 def add_credential():
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
     
-    if not user or not user.is_doctor:
+    if not current_is_doctor():
         return jsonify({'error': 'No autorizado'}), 403
     
     doctor = Doctor.query.filter_by(user_id=user_id).first()
@@ -192,16 +200,6 @@ def add_credential():
     if not allowed_file(file.filename):
         return jsonify({'error': 'Tipo de archivo no permitido'}), 400
     
-    # Guardar el archivo
-    filename = secure_filename(file.filename)
-    unique_filename = f"{uuid.uuid4()}_{filename}"
-    file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-    
-    # Asegurarse de que el directorio existe
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    
-    file.save(file_path)
-    
     # Obtener datos del formulario
     title = request.form.get('title')
     institution = request.form.get('institution')
@@ -211,6 +209,12 @@ def add_credential():
     if not title or not institution:
         return jsonify({'error': 'Título e institución son requeridos'}), 400
     
+    # Guardar el archivo en el almacén por contenido
+    try:
+        file_key = store_upload(file, DOCUMENT_TYPES | {'image/gif'})
+    except IngestError as e:
+        return jsonify({'error': str(e)}), e.status
+    
     # Crear la credencial
     credential = DoctorCredential(
         doctor_id=doctor.id,
@@ -218,7 +222,7 @@ def add_credential():
         institution=institution,
         year=int(year) if year else None,
         description=description,
-        file_path=f"doctor_credentials/{unique_filename}"
+        file_path=file_key
     )
     
     db.session.add(credential)
@@ -233,9 +237,8 @@ def add_credential():
 @jwt_required()
 def delete_credential(credential_id):
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
     
-    if not user or not user.is_doctor:
+    if not current_is_doctor():
         return jsonify({'error': 'No autorizado'}), 403
     
     doctor = Doctor.query.filter_by(user_id=user_id).first()
@@ -248,11 +251,9 @@ def delete_credential(credential_id):
     if not credential or credential.doctor_id != doctor.id:
         return jsonify({'error': 'Credencial no encontrada'}), 404
     
-    # Eliminar el archivo si existe
+    # Liberar el archivo (se borra tras el commit si nadie más lo usa)
     if credential.file_path:
-        file_path = os.path.join(current_app.root_path, 'uploads', credential.file_path)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        release_or_remove(credential.file_path)
     
     db.session.delete(credential)
     db.session.commit()
@@ -272,8 +273,7 @@ def get_doctor_reviews(doctor_id):
     
     return jsonify({
         'reviews': reviews,
-        'average_rating': doctor.get_average_rating(),
-        'review_count': len(reviews)
+        **rating_summary(doctor)
     }), 200
 
 @doctor_profile_bp.route('/<int:doctor_id>/reviews', methods=['POST'])
@@ -313,7 +313,13 @@ def add_review(doctor_id):
     )
     
     db.session.add(review)
-    db.session.commit()
+    apply_rating_change(doctor_id, new_rating=rating)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Otra petición del mismo usuario creó la reseña a la vez (índice único)
+        db.session.rollback()
+        return jsonify({'error': 'Ya has dejado una reseña para este doctor'}), 409
     
     return jsonify({
         'message': 'Reseña agregada con éxito',
@@ -324,21 +330,20 @@ def add_review(doctor_id):
 @jwt_required()
 def delete_review(doctor_id, review_id):
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if not user:
-        return jsonify({'error': 'Usuario no encontrado'}), 404
     
-    review = DoctorReview.query.get(review_id)
+    # Bloqueada hasta el commit, para que un borrado doble no descuente la valoración dos veces
+    review = DoctorReview.query.filter_by(id=review_id).with_for_update().populate_existing().first()
     
     if not review or review.doctor_id != doctor_id:
         return jsonify({'error': 'Reseña no encontrada'}), 404
     
     # Solo el usuario que creó la reseña o un administrador puede eliminarla
-    if review.user_id != user_id and user.role not in ['ADMIN', 'SUPERADMIN']:
+    # (la identidad del token es una cadena)
+    if str(review.user_id) != str(user_id) and not current_is_admin():
         return jsonify({'error': 'No autorizado'}), 403
     
     db.session.delete(review)
+    apply_rating_change(doctor_id, old_rating=review.rating)
     db.session.commit()
     
     return jsonify({
@@ -2,51 +2,128 @@ from flask import Blueprint, request, jsonify, redirect, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, Doctor, User, Payment, NutritionLog, NutritionAnalysis, DoctorCredential, DoctorReview
 from utils.auth import doctor_required
+from utils.db_routing import replica_read
 from utils.stripe_utils import create_checkout_session_for_doctor
+from utils import directory_cache
+from utils.doctor_ratings import apply_rating_change, rating_summary
+from utils.nutrition_totals import daily_total, parse_series_args, summary_series
+from utils.pagination import paginate_model, row_to_dict, parse_limit, decode_cursor, keyset_page
 import stripe
 from datetime import datetime, timedelta, date
 from flask import current_app
 from sqlalchemy import func, extract
+from sqlalchemy.exc import IntegrityError
 import os
+import json
 
 doctors_bp = Blueprint('doctors', __name__)
 
-# Middleware para verificar que el usuario es un médico
-def doctor_required(fn):
-    @jwt_required()
-    def wrapper(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        if not user or not user.is_doctor:
-            return jsonify({'error': 'Acceso denegado. Se requiere ser médico.'}), 403
-        
-        return fn(*args, **kwargs)
+# Directorio público: tamaño de página por defecto y máximo
+DIRECTORY_PAGE_SIZE = 24
+DIRECTORY_MAX_PAGE_SIZE = 100
+DIRECTORY_MAX_AGE = 60
+# Clave de orden de cada `sort` y si es descendente
+DIRECTORY_ORDER = {
+    'id': ([Doctor.id], False),
+    'rating': ([Doctor.rating_average, Doctor.id], True),
+}
+
+def _parse_directory_args(args):
+    """
+    Filtros y paginación del directorio. Lanza ValueError si algún valor no es válido.
+    """
+    limit = parse_limit(args, DIRECTORY_PAGE_SIZE, DIRECTORY_MAX_PAGE_SIZE)
+    min_rating = args.get('min_rating')
+    online = args.get('online')
+    sort = args.get('sort', 'id')
+    if sort not in DIRECTORY_ORDER:
+        raise ValueError('sort')
+    cursor = decode_cursor(args.get('cursor'), DIRECTORY_ORDER[sort][0])
+    return {
+        'specialty': (args.get('specialty') or '').strip().lower() or None,
+        'language': (args.get('language') or '').strip() or None,
+        'online': online in ('true', '1') if online else None,
+        'min_rating': float(min_rating) if min_rating else None,
+        'sort': sort,
+        'cursor': cursor or None,
+        'limit': limit,
+    }
+
+def _query_directory(specialty, language, online, min_rating, sort, cursor, limit):
+    """
+    Una sola consulta con el usuario de cada médico; las valoraciones salen de
+    los agregados guardados en doctors (ordenar por media usa su índice).
+    """
+    query = db.session.query(
+        Doctor.id,
+        Doctor.specialty,
+        Doctor.license_number,
+        Doctor.available_online,
+        Doctor.languages,
+        Doctor.consultation_fee,
+        Doctor.experience_years,
+        User.first_name,
+        User.last_name,
+        User.email,
+        User.profile_picture,
+        Doctor.rating_average,
+        Doctor.rating_count
+    ).join(User, User.id == Doctor.user_id)
     
-    wrapper.__name__ = fn.__name__
-    return wrapper
+    if specialty:
+        query = query.filter(func.lower(Doctor.specialty) == specialty)
+    if language:
+        query = query.filter(Doctor.languages.any(language))
+    if online is not None:
+        query = query.filter(Doctor.available_online.is_(online))
+    if min_rating is not None:
+        query = query.filter(Doctor.rating_average >= min_rating)
+    
+    order_by, descending = DIRECTORY_ORDER[sort]
+    rows, next_cursor = keyset_page(query, order_by, cursor, limit, descending)
+    
+    return {
+        'doctors': [{
+            'id': row.id,
+            'name': f"{row.first_name} {row.last_name}" if row.first_name and row.last_name else row.email.split('@')[0],
+            'specialty': row.specialty,
+            'license_number': row.license_number,
+            'available_online': bool(row.available_online),
+            'languages': row.languages or [],
+            'consultation_fee': row.consultation_fee,
+            'experience_years': row.experience_years,
+            'profile_picture': row.profile_picture,
+            'average_rating': round(row.rating_average or 0, 2),
+            'review_count': row.rating_count or 0,
+        } for row in rows],
+        'next_cursor': next_cursor
+    }
 
 @doctors_bp.route('/directory', methods=['GET'])
 def get_directory():
     try:
-        # Modificamos la consulta para no filtrar por subscription_active
-        doctors = Doctor.query.all()
-        
-        result = []
-        for doc in doctors:
-            user = User.query.get(doc.user_id)
-            if user:
-                result.append({
-                    'id': doc.id,
-                    'name': f"{user.first_name} {user.last_name}" if user.first_name and user.last_name else user.email.split('@')[0],
-                    'specialty': doc.specialty,
-                    'license_number': doc.license_number,
-                    # Otros campos que quieras mostrar
-                })
-        
-        return jsonify({
-            'doctors': result
-        }), 200
+        try:
+            filters = _parse_directory_args(request.args)
+        except ValueError:
+            return jsonify({'error': 'Parámetros del directorio inválidos'}), 400
+        
+        # Las respuestas se cachean por combinación de filtros y se invalidan al
+        # cambiar médicos, sus usuarios o sus reseñas (ver utils/directory_cache.py)
+        cache_key = json.dumps(filters, sort_keys=True)
+        version = directory_cache.current_version()
+        cached = directory_cache.get(cache_key, version)
+        if cached is None:
+            cached = directory_cache.put(cache_key, json.dumps(_query_directory(**filters)), version)
+        etag, body = cached
+        
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = DIRECTORY_MAX_AGE
+        return response
     except Exception as e:
         print(f"Error al obtener directorio de médicos: {str(e)}")
         return jsonify({'error': 'Error al obtener el directorio de médicos'}), 500
@@ -191,6 +268,7 @@ def get_patient(patient_id):
 # Obtener estudios médicos de un paciente
 @doctors_bp.route('/patients/<int:patient_id>/studies', methods=['GET'])
 @doctor_required
+@replica_read
 def get_patient_studies(patient_id):
     try:
         # Verificar que el paciente existe
@@ -228,9 +306,37 @@ def get_patient_studies(patient_id):
         print(f"Error al obtener estudios del paciente: {str(e)}")
         return jsonify({'error': 'Error al obtener estudios médicos del paciente'}), 500
 
+# Resumen nutricional de un paciente para un rango de fechas (serie densa)
+@doctors_bp.route('/patients/<int:patient_id>/nutrition/summary', methods=['GET'])
+@doctor_required
+@replica_read
+def get_patient_nutrition_series(patient_id):
+    try:
+        start, end, granularity = parse_series_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        patient = User.query.get(patient_id)
+        
+        if not patient:
+            return jsonify({'error': 'Paciente no encontrado'}), 404
+        
+        return jsonify({
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'granularity': granularity,
+            'daily_calorie_goal': patient.daily_calorie_goal or 2000,
+            'series': summary_series(patient_id, start, end, granularity)
+        }), 200
+    except Exception as e:
+        print(f"Error al obtener resumen nutricional del paciente: {str(e)}")
+        return jsonify({'error': 'Error al obtener el resumen nutricional del paciente'}), 500
+
 # Obtener resumen nutricional diario de un paciente
 @doctors_bp.route('/patients/<int:patient_id>/nutrition/summary/<string:log_date_str>', methods=['GET'])
 @doctor_required
+@replica_read
 def get_patient_nutrition_summary(patient_id, log_date_str):
     try:
         # Convertir string YYYY-MM-DD a objeto date
@@ -245,26 +351,18 @@ def get_patient_nutrition_summary(patient_id, log_date_str):
         if not patient:
             return jsonify({'error': 'Paciente no encontrado'}), 404
         
-        # Consultar y agregar datos para el paciente y la fecha
-        summary = db.session.query(
-            func.sum(NutritionLog.calories).label('total_calories'),
-            func.sum(NutritionLog.proteins).label('total_proteins'),
-            func.sum(NutritionLog.carbs).label('total_carbs'),
-            func.sum(NutritionLog.fats).label('total_fats')
-        ).filter(
-            NutritionLog.user_id == patient_id,
-            NutritionLog.log_date == log_date
-        ).group_by(NutritionLog.user_id).first()
+        # Totales precalculados del día (búsqueda por clave primaria)
+        summary = daily_total(patient_id, log_date)
         
         daily_goal = patient.daily_calorie_goal if patient else 2000
         
         if summary:
             result = {
                 'date': log_date.isoformat(),
-                'calories': summary.total_calories or 0,
-                'proteins': summary.total_proteins or 0.0,
-                'carbs': summary.total_carbs or 0.0,
-                'fats': summary.total_fats or 0.0,
+                'calories': summary.calories,
+                'proteins': summary.proteins,
+                'carbs': summary.carbs,
+                'fats': summary.fats,
                 'daily_calorie_goal': daily_goal
             }
         else:
@@ -287,6 +385,7 @@ def get_patient_nutrition_summary(patient_id, log_date_str):
 # Obtener registros nutricionales de un paciente en un rango de fechas
 @doctors_bp.route('/patients/<int:patient_id>/nutrition/logs', methods=['GET'])
 @doctor_required
+@replica_read
 def get_patient_nutrition_logs(patient_id):
     try:
         # Obtener parámetros de fecha
@@ -306,25 +405,27 @@ def get_patient_nutrition_logs(patient_id):
         if not patient:
             return jsonify({'error': 'Paciente no encontrado'}), 404
         
-        # Construir la consulta
-        query = NutritionLog.query.filter_by(user_id=patient_id)
+        # Construir los filtros
+        filters = [NutritionLog.user_id == patient_id]
         
         if start_date:
-            query = query.filter(NutritionLog.log_date >= start_date)
+            filters.append(NutritionLog.log_date >= start_date)
         
         if end_date:
-            query = query.filter(NutritionLog.log_date <= end_date)
-        
-        # Ordenar por fecha (más reciente primero)
-        query = query.order_by(NutritionLog.log_date.desc())
+            filters.append(NutritionLog.log_date <= end_date)
         
-        # Ejecutar la consulta
-        logs = query.all()
-        
-        # Formatear resultados
-        logs_data = [log.to_dict() for log in logs]
+        # Por páginas, de la fecha más reciente a la más antigua
+        try:
+            rows, fields, next_cursor = paginate_model(
+                NutritionLog, filters, [NutritionLog.log_date, NutritionLog.id], request.args
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        return jsonify(logs_data), 200
+        return jsonify({
+            'logs': [row_to_dict(row, fields) for row in rows],
+            'next_cursor': next_cursor
+        }), 200
         
     except Exception as e:
         print(f"Error al obtener registros nutricionales: {str(e)}")
@@ -459,7 +560,7 @@ def get_doctor_profile(doctor_id):
             'profile_picture': user.profile_picture,
             'credentials': credentials_data,
             'reviews': reviews_data,
-            'average_rating': doctor.get_average_rating()
+            **rating_summary(doctor)
         }
         
         return jsonify(doctor_data), 200
@@ -490,11 +591,13 @@ def add_review(doctor_id):
         if user.id == doctor.user_id:
             return jsonify({'error': 'No puedes dejar una reseña para ti mismo'}), 400
         
-        # Verificar si el usuario ya ha dejado una reseña para este doctor
+        # Verificar si el usuario ya ha dejado una reseña para este doctor. La fila
+        # queda bloqueada hasta el commit: dos ediciones simultáneas leen la
+        # valoración anterior de a una y no aplican el mismo delta dos veces
         existing_review = DoctorReview.query.filter_by(
             doctor_id=doctor_id,
             user_id=user_id
-        ).first()
+        ).with_for_update().populate_existing().first()
         
         data = request.get_json()
         rating = data.get('rating')
@@ -502,9 +605,12 @@ def add_review(doctor_id):
         
         if not rating or not isinstance(rating, (int, float)) or rating < 1 or rating > 5:
             return jsonify({'error': 'Calificación inválida. Debe ser un número entre 1 y 5'}), 400
+        # La columna es entera; redondear aquí para que el histograma coincida con lo guardado
+        rating = int(round(rating))
         
         if existing_review:
             # Actualizar reseña existente
+            apply_rating_change(doctor_id, old_rating=existing_review.rating, new_rating=rating)
             existing_review.rating = rating
             existing_review.comment = comment
             existing_review.created_at = datetime.utcnow()  # Actualizar timestamp
@@ -517,11 +623,16 @@ def add_review(doctor_id):
                 comment=comment
             )
             db.session.add(new_review)
+            apply_rating_change(doctor_id, new_rating=rating)
         
         db.session.commit()
         
         return jsonify({'message': 'Reseña guardada correctamente'}), 200
         
+    except IntegrityError:
+        # Otra petición del mismo usuario creó la reseña a la vez (índice único)
+        db.session.rollback()
+        return jsonify({'error': 'Ya has dejado una reseña para este médico'}), 409
     except Exception as e:
         db.session.rollback()
         print(f"Error al guardar reseña: {str(e)}")
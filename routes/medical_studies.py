@@ -1,13 +1,26 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
-from models import db, MedicalStudy, User
+from models import db, MedicalStudy, User, LabResult, UploadSession
 from utils.openai_utils import analyze_medical_study
-from utils.anthropic_utils import analyze_medical_study_with_anthropic
-from utils.auth import doctor_required
+from utils.anthropic_utils import analyze_medical_study_with_anthropic, MEDICAL_STUDY_PROMPT_VERSION
+from utils.auth import doctor_required, current_user, current_is_doctor, current_is_admin
+from utils.db_routing import replica_read
+from utils.lab_results import schedule_lab_results, normalize_analyte
+from utils.pagination import parse_limit, decode_cursor, keyset_page
+from utils.blob_store import store_upload, store_path, is_blob_key, register_uploaded
+from utils.storage import get_storage
+from utils.ingest import IngestError, DOCUMENT_TYPES, EXTENSIONS, sniff_file
+from utils.thumbnails import schedule_thumbnails, thumbnail_urls
+from utils.chunked_upload import (
+    OffsetMismatch, UploadBusy, temp_upload_path, part_offset, upload_lock, create_upload_file, append_chunk,
+    finalize_digest, discard_upload
+)
 import os
 import uuid
-from datetime import datetime
+from contextlib import contextmanager, ExitStack
+from datetime import datetime, timedelta
+from sqlalchemy import func
 
 medical_studies_bp = Blueprint('medical_studies', __name__)
 
@@ -15,6 +28,17 @@ medical_studies_bp = Blueprint('medical_studies', __name__)
 UPLOAD_FOLDER = 'uploads/medical_studies'
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
 
+# Subidas por partes (protocolo tipo tus: crear, PATCH con offset, finalizar)
+CHUNKED_UPLOAD_MAX_SIZE = int(os.environ.get('CHUNKED_UPLOAD_MAX_SIZE', str(1024 * 1024 * 1024)))  # 1 GB
+CHUNK_SIZE = 8 * 1024 * 1024  # Tamaño recomendado; debe ser menor que MAX_CONTENT_LENGTH
+UPLOAD_SESSION_TTL = timedelta(hours=24)
+
+# Listado de estudios: tamaño de página por defecto y máximo, y longitud del extracto
+STUDIES_PAGE_SIZE = 50
+STUDIES_MAX_PAGE_SIZE = 200
+INTERPRETATION_PREVIEW_LENGTH = 200
+STUDIES_ORDER = [MedicalStudy.created_at, MedicalStudy.id]
+
 def init_app(app):
     """Inicializa la aplicación con las configuraciones necesarias"""
     os.makedirs(os.path.join(app.root_path, UPLOAD_FOLDER), exist_ok=True)
@@ -22,12 +46,62 @@ def init_app(app):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+AI_ANALYSIS_HEADER = "[ANÁLISIS AUTOMÁTICO CON IA]"
+
+def mark_ai_analysis(analysis_result):
+    """Marca un análisis como generado automáticamente por IA"""
+    return f"{AI_ANALYSIS_HEADER}\n\n{analysis_result}\n\n[Este análisis fue generado automáticamente y debe ser confirmado por un profesional médico]"
+
+def study_storage_key(study):
+    """Clave normalizada del archivo de un estudio (None si el backfill no lo encontró)"""
+    if study.storage_key:
+        return study.storage_key
+    # Los blobs ya tienen una clave canónica aunque la fila sea anterior al backfill
+    return study.file_path if is_blob_key(study.file_path) else None
+
+@contextmanager
+def study_local_file(study):
+    """Ruta local del archivo de un estudio, o None si no tiene archivo.
+    Con un backend remoto (S3) se descarga a un temporal."""
+    key = study_storage_key(study)
+    if key is None:
+        yield None
+        return
+    with get_storage().local_copy(key) as local_path:
+        yield local_path
+
 @medical_studies_bp.route('/upload', methods=['POST'])
 @jwt_required()
 def upload_study():
     try:
         user_id = get_jwt_identity()
         
+        # Archivo subido directamente al almacenamiento con una URL prefirmada
+        data = request.get_json(silent=True) or request.form
+        if 'file' not in request.files and data.get('storage_key'):
+            try:
+                file_key = register_uploaded(data['storage_key'], user_id)
+            except IngestError as e:
+                return jsonify({'error': str(e)}), e.status
+            if not file_key or not allowed_file(file_key):
+                return jsonify({'error': 'Archivo no encontrado en el almacenamiento'}), 400
+            
+            study = MedicalStudy(
+                patient_id=user_id,
+                study_type=data.get('study_type', 'general'),
+                file_path=file_key,
+                storage_key=file_key,
+                created_at=datetime.utcnow()
+            )
+            db.session.add(study)
+            db.session.commit()
+            schedule_thumbnails(file_key)
+            
+            return jsonify({
+                'message': 'Estudio subido con éxito',
+                'study_id': study.id
+            }), 201
+        
         # Verificar si se proporcionó un archivo
         if 'file' not in request.files:
             return jsonify({'error': 'No se proporcionó ningún archivo'}), 400
@@ -46,28 +120,24 @@ def upload_study():
         # Obtener el tipo de estudio
         study_type = request.form.get('study_type', 'general')
         
-        # Generar un nombre de archivo seguro y único
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        
-        # Crear la carpeta de destino si no existe
-        upload_dir = os.path.join(current_app.root_path, 'uploads', 'medical_studies')
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Guardar el archivo
-        file_path = os.path.join(upload_dir, unique_filename)
-        file.save(file_path)
+        # Guardar el archivo en el almacén por contenido
+        try:
+            file_key = store_upload(file)
+        except IngestError as e:
+            return jsonify({'error': str(e)}), e.status
         
         # Guardar la información en la base de datos
         study = MedicalStudy(
             patient_id=user_id,
             study_type=study_type,
-            file_path=unique_filename,  # Guardar solo el nombre del archivo, no la ruta completa
+            file_path=file_key,
+            storage_key=file_key,
             created_at=datetime.utcnow()
         )
         
         db.session.add(study)
         db.session.commit()
+        schedule_thumbnails(file_key)
         
         return jsonify({
             'message': 'Estudio subido con éxito',
@@ -75,23 +145,15 @@ def upload_study():
         }), 201
         
     except Exception as e:
+        db.session.rollback()
         print(f"Error al subir estudio: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @medical_studies_bp.route('/studies', methods=['GET'])
 @jwt_required()
+@replica_read
 def get_studies():
     try:
-        # Imprimir información de depuración
-        print("Token recibido y validado correctamente")
-        
-        # Imprimir los encabezados de la solicitud
-        print("Headers de la solicitud:", dict(request.headers))
-        
-        # Obtener el token del encabezado
-        auth_header = request.headers.get('Authorization', '')
-        print(f"Encabezado de autorización: {auth_header}")
-        
         user_id = get_jwt_identity()
         print(f"ID de usuario del token (tipo: {type(user_id)}): {user_id}")
         
@@ -103,29 +165,64 @@ def get_studies():
                 print(f"No se pudo convertir user_id a entero: {user_id}")
                 return jsonify({'error': 'ID de usuario inválido'}), 400
         
-        user = User.query.get(user_id)
+        try:
+            limit = parse_limit(request.args, STUDIES_PAGE_SIZE, STUDIES_MAX_PAGE_SIZE)
+            cursor = decode_cursor(request.args.get('cursor'), STUDIES_ORDER)
+        except ValueError:
+            return jsonify({'error': 'Parámetros de paginación inválidos'}), 400
+        
+        # Una sola consulta con el email del paciente; la interpretación completa no se
+        # envía en la lista, solo si existe y un extracto (el detalle la devuelve entera)
+        query = db.session.query(
+            MedicalStudy.id,
+            MedicalStudy.patient_id,
+            MedicalStudy.name,
+            MedicalStudy.study_type,
+            MedicalStudy.file_path,
+            MedicalStudy.analyzed_at,
+            MedicalStudy.created_at,
+            MedicalStudy.interpretation.isnot(None).label('analyzed'),
+            func.substr(MedicalStudy.interpretation, 1, INTERPRETATION_PREVIEW_LENGTH).label('interpretation_preview'),
+            User.email.label('patient_email'),
+        ).outerjoin(User, User.id == MedicalStudy.patient_id)
+        
+        # Si es doctor o admin, puede ver todos los estudios (y filtrar por paciente);
+        # si es paciente, solo ve sus propios estudios
+        if current_is_doctor() or current_is_admin():
+            patient_id = request.args.get('patient_id', type=int)
+            if patient_id is not None:
+                query = query.filter(MedicalStudy.patient_id == patient_id)
+        else:
+            query = query.filter(MedicalStudy.patient_id == user_id)
         
-        if not user:
-            print(f"Usuario no encontrado con ID: {user_id}")
-            return jsonify({'error': 'Usuario no encontrado'}), 404
+        study_type = request.args.get('study_type')
+        if study_type:
+            query = query.filter(MedicalStudy.study_type == study_type)
         
-        # Si es doctor o admin, puede ver todos los estudios
-        if user.is_doctor or user.role in ['ADMIN', 'SUPERADMIN']:
-            studies = MedicalStudy.query.all()
-        else:
-            # Si es paciente, solo ve sus propios estudios
-            studies = MedicalStudy.query.filter_by(patient_id=user.id).all()
+        analyzed = request.args.get('analyzed')
+        if analyzed in ('true', '1'):
+            query = query.filter(MedicalStudy.interpretation.isnot(None))
+        elif analyzed in ('false', '0'):
+            query = query.filter(MedicalStudy.interpretation.is_(None))
+        
+        # Paginación por cursor sobre (created_at, id), de más reciente a más antiguo
+        rows, next_cursor = keyset_page(query, STUDIES_ORDER, cursor, limit)
         
         return jsonify({
             'studies': [{
-                'id': study.id,
-                'patient_id': study.patient_id,
-                'patient_email': User.query.get(study.patient_id).email if study.patient_id else None,
-                'study_type': study.study_type,
-                'file_path': study.file_path,
-                'interpretation': study.interpretation,
-                'created_at': study.created_at.isoformat() if study.created_at else None
-            } for study in studies]
+                'id': row.id,
+                'patient_id': row.patient_id,
+                'patient_email': row.patient_email,
+                'name': row.name,
+                'study_type': row.study_type,
+                'file_path': row.file_path,
+                'thumbnails': thumbnail_urls(row.file_path),
+                'analyzed': bool(row.analyzed),
+                'interpretation_preview': row.interpretation_preview,
+                'analyzed_at': row.analyzed_at.isoformat() if row.analyzed_at else None,
+                'created_at': row.created_at.isoformat() if row.created_at else None
+            } for row in rows],
+            'next_cursor': next_cursor
         }), 200
     except Exception as e:
         print(f"Error en get_studies: {str(e)}")
@@ -136,10 +233,7 @@ def get_studies():
 @medical_studies_bp.route('/studies/<int:study_id>/interpret', methods=['POST'])
 @jwt_required()
 def interpret_study(study_id):
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if not user or not user.is_doctor:
+    if not current_is_doctor():
         return jsonify({'error': 'Solo los doctores pueden interpretar estudios'}), 403
     
     study = MedicalStudy.query.get(study_id)
@@ -154,6 +248,9 @@ def interpret_study(study_id):
         return jsonify({'error': 'Se requiere una interpretación'}), 400
     
     study.interpretation = interpretation
+    # La interpretación manual de un médico no debe regenerarse con `reanalyze`
+    study.analysis_prompt_version = None
+    study.analyzed_at = datetime.utcnow()
     db.session.commit()
     
     return jsonify({
@@ -163,6 +260,7 @@ def interpret_study(study_id):
             'patient_id': study.patient_id,
             'study_type': study.study_type,
             'file_path': study.file_path,
+            'thumbnails': thumbnail_urls(study.file_path),
             'interpretation': study.interpretation,
             'created_at': study.created_at.isoformat()
         }
@@ -172,6 +270,7 @@ def interpret_study(study_id):
 @jwt_required()
 def analyze_study(study_id):
     user_id = get_jwt_identity()
+    study_files = ExitStack()
     
     try:
         print(f"Iniciando análisis del estudio {study_id}")
@@ -194,65 +293,22 @@ def analyze_study(study_id):
         print(f"Estudio encontrado: ID={study.id}, patient_id={study.patient_id}")
         
         # Verificar que el estudio pertenece al usuario o que el usuario es un médico
-        user = User.query.get(user_id)
+        user = current_user()
         if not user:
             return jsonify({'error': 'Usuario no encontrado'}), 404
             
-        print(f"Usuario: {user.email}, is_doctor={user.is_doctor}, patient_id={study.patient_id}, user_id={user_id}")
+        print(f"Usuario: {user.email}, is_doctor={current_is_doctor()}, patient_id={study.patient_id}, user_id={user_id}")
         
         # Temporalmente, permitir que cualquier usuario analice cualquier estudio para pruebas
         # if not user.is_doctor and study.patient_id != user_id:
         #     print(f"Permiso denegado: user.is_doctor={user.is_doctor}, study.patient_id={study.patient_id}, user_id={user_id}")
         #     return jsonify({'error': 'No tienes permiso para analizar este estudio'}), 403
         
-        # Obtener el archivo del estudio - CORREGIR LA RUTA
-        # Verificar si study.file_path ya incluye 'medical_studies/'
-        file_path = study.file_path
-        if file_path.startswith('medical_studies/'):
-            # Si ya incluye el prefijo, usar la ruta directamente
-            file_path = os.path.join(current_app.root_path, 'uploads', file_path)
-        else:
-            # Si no incluye el prefijo, añadirlo
-            file_path = os.path.join(current_app.root_path, 'uploads', 'medical_studies', file_path)
-        
-        print(f"Ruta del archivo (corregida): {file_path}")
+        # Obtener el archivo del estudio a partir de su clave normalizada (sin probar rutas)
+        file_path = study_files.enter_context(study_local_file(study))
+        print(f"Archivo del estudio: {study_storage_key(study)}")
         
-        # Intentar diferentes variaciones de la ruta si el archivo no existe
-        if not os.path.exists(file_path):
-            print(f"Archivo no encontrado en la ruta principal, intentando alternativas...")
-            
-            # Alternativa 1: Quitar 'medical_studies/' si está duplicado
-            alt_path_1 = file_path.replace('medical_studies/medical_studies/', 'medical_studies/')
-            print(f"Alternativa 1: {alt_path_1}")
-            if os.path.exists(alt_path_1):
-                file_path = alt_path_1
-                print(f"Archivo encontrado en alternativa 1")
-            else:
-                # Alternativa 2: Usar solo el nombre del archivo
-                file_name = os.path.basename(study.file_path)
-                alt_path_2 = os.path.join(current_app.root_path, 'uploads', 'medical_studies', file_name)
-                print(f"Alternativa 2: {alt_path_2}")
-                if os.path.exists(alt_path_2):
-                    file_path = alt_path_2
-                    print(f"Archivo encontrado en alternativa 2")
-                else:
-                    # Alternativa 3: Buscar en la carpeta uploads directamente
-                    alt_path_3 = os.path.join(current_app.root_path, 'uploads', file_name)
-                    print(f"Alternativa 3: {alt_path_3}")
-                    if os.path.exists(alt_path_3):
-                        file_path = alt_path_3
-                        print(f"Archivo encontrado en alternativa 3")
-        
-        print(f"¿El archivo existe? {os.path.exists(file_path)}")
-        
-        if not os.path.exists(file_path):
-            # Listar archivos en la carpeta uploads para depuración
-            uploads_dir = os.path.join(current_app.root_path, 'uploads')
-            print(f"Contenido de la carpeta uploads: {os.listdir(uploads_dir) if os.path.exists(uploads_dir) else 'No existe'}")
-            
-            medical_studies_dir = os.path.join(uploads_dir, 'medical_studies')
-            print(f"Contenido de la carpeta medical_studies: {os.listdir(medical_studies_dir) if os.path.exists(medical_studies_dir) else 'No existe'}")
-            
+        if file_path is None:
             return jsonify({'error': 'Archivo de estudio no encontrado'}), 404
         
         # Analizar el estudio con Anthropic directamente
@@ -274,15 +330,20 @@ def analyze_study(study_id):
             print(f"Análisis recibido (formato inesperado, primeros 100 caracteres): {analysis_result[:100] if analysis_result else 'Vacío'}")
         
         # Si es un análisis solicitado por el paciente, marcar como "Análisis IA"
-        if not user.is_doctor:
+        if not current_is_doctor():
             print("Marcando como análisis de IA (usuario no es doctor)")
-            analysis_result = f"[ANÁLISIS AUTOMÁTICO CON IA]\n\n{analysis_result}\n\n[Este análisis fue generado automáticamente y debe ser confirmado por un profesional médico]"
+            analysis_result = mark_ai_analysis(analysis_result)
         
         # Actualizar el estudio con el resultado del análisis
         study.interpretation = analysis_result
+        study.analysis_prompt_version = MEDICAL_STUDY_PROMPT_VERSION
+        study.analyzed_at = datetime.utcnow()
         db.session.commit()
         print("Análisis guardado con éxito")
         
+        # Extraer los valores numéricos de laboratorio a la tabla lab_results (en segundo plano)
+        schedule_lab_results(study.id)
+        
         return jsonify({
             'message': 'Estudio analizado correctamente',
             'analysis': analysis_result
@@ -293,6 +354,8 @@ def analyze_study(study_id):
         import traceback
         traceback.print_exc()
         return jsonify({'error': 'Error interno al procesar la solicitud de análisis'}), 500
+    finally:
+        study_files.close()
 
 @medical_studies_bp.route('/studies/<int:study_id>', methods=['GET'])
 @jwt_required()
@@ -305,18 +368,13 @@ def get_study_details(study_id):
             except ValueError:
                 return jsonify({'error': 'ID de usuario inválido'}), 400
         
-        user = User.query.get(user_id)
-        
-        if not user:
-            return jsonify({'error': 'Usuario no encontrado'}), 404
-        
         study = MedicalStudy.query.get(study_id)
         
         if not study:
             return jsonify({'error': 'Estudio no encontrado'}), 404
         
         # Verificar permisos: solo el paciente o un doctor pueden ver el estudio
-        if not user.is_doctor and study.patient_id != user.id:
+        if not current_is_doctor() and study.patient_id != user_id:
             return jsonify({'error': 'No tiene permiso para ver este estudio'}), 403
         
         # Obtener el email del paciente
@@ -328,6 +386,7 @@ def get_study_details(study_id):
             'patient_email': patient_email,
             'study_type': study.study_type,
             'file_path': study.file_path,
+            'thumbnails': thumbnail_urls(study.file_path),
             'interpretation': study.interpretation,
             'created_at': study.created_at.isoformat() if study.created_at else None
         }), 200
@@ -348,18 +407,13 @@ def rename_study(study_id):
             except ValueError:
                 return jsonify({'error': 'ID de usuario inválido'}), 400
         
-        user = User.query.get(user_id)
-        
-        if not user:
-            return jsonify({'error': 'Usuario no encontrado'}), 404
-        
         study = MedicalStudy.query.get(study_id)
         
         if not study:
             return jsonify({'error': 'Estudio no encontrado'}), 404
         
         # Verificar permisos: solo el paciente o un doctor pueden renombrar el estudio
-        if not user.is_doctor and study.patient_id != user.id:
+        if not current_is_doctor() and study.patient_id != user_id:
             return jsonify({'error': 'No tiene permiso para renombrar este estudio'}), 403
         
         data = request.get_json()
@@ -383,6 +437,7 @@ def rename_study(study_id):
                 'patient_email': User.query.get(study.patient_id).email if study.patient_id else None,
                 'study_type': study.study_type,
                 'file_path': study.file_path,
+                'thumbnails': thumbnail_urls(study.file_path),
                 'interpretation': study.interpretation,
                 'created_at': study.created_at.isoformat() if study.created_at else None
             }
@@ -391,4 +446,314 @@ def rename_study(study_id):
         print(f"Error en rename_study: {str(e)}")
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500 
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+def _lab_results_patient_id():
+    """
+    Devuelve el paciente cuyos resultados se consultan: el propio usuario o,
+    para médicos y administradores, el indicado en ?patient_id=.
+    """
+    user_id = int(get_jwt_identity())
+    requested = request.args.get('patient_id', type=int)
+    if requested and requested != user_id:
+        if not current_is_doctor() and not current_is_admin():
+            return None
+        return requested
+    return user_id
+
+@medical_studies_bp.route('/lab-results', methods=['GET'])
+@jwt_required()
+def get_lab_results():
+    try:
+        patient_id = _lab_results_patient_id()
+        if patient_id is None:
+            return jsonify({'error': 'No tiene permiso para ver estos resultados'}), 403
+        
+        analyte = normalize_analyte(request.args.get('analyte'))
+        if not analyte:
+            return jsonify({'error': 'Se requiere el parámetro analyte'}), 400
+        
+        try:
+            start_date = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+            end_date = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else None
+        except ValueError:
+            return jsonify({'error': 'Formato de fecha inválido. Usar YYYY-MM-DD'}), 400
+        
+        # Consulta de rango sobre el índice (patient_id, analyte, study_date)
+        query = LabResult.query.filter(
+            LabResult.patient_id == patient_id,
+            LabResult.analyte == analyte
+        )
+        if start_date:
+            query = query.filter(LabResult.study_date >= start_date)
+        if end_date:
+            query = query.filter(LabResult.study_date <= end_date)
+        
+        results = query.order_by(LabResult.study_date.asc(), LabResult.id.asc()).all()
+        
+        return jsonify({
+            'patient_id': patient_id,
+            'analyte': analyte,
+            'results': [result.to_dict() for result in results]
+        }), 200
+    except Exception as e:
+        print(f"Error en get_lab_results: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@medical_studies_bp.route('/lab-results/analytes', methods=['GET'])
+@jwt_required()
+def get_lab_analytes():
+    try:
+        patient_id = _lab_results_patient_id()
+        if patient_id is None:
+            return jsonify({'error': 'No tiene permiso para ver estos resultados'}), 403
+        
+        analytes = db.session.query(LabResult.analyte).filter(
+            LabResult.patient_id == patient_id
+        ).distinct().order_by(LabResult.analyte).all()
+        
+        return jsonify({
+            'patient_id': patient_id,
+            'analytes': [row.analyte for row in analytes]
+        }), 200
+    except Exception as e:
+        print(f"Error en get_lab_analytes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def _get_upload_session(upload_id):
+    """Obtiene la subida en curso del usuario actual o una respuesta de error"""
+    upload = UploadSession.query.get(upload_id)
+    if not upload or upload.user_id != int(get_jwt_identity()):
+        return None, (jsonify({'error': 'Subida no encontrada'}), 404)
+    if upload.status == 'uploading' and upload.expires_at < datetime.utcnow():
+        return None, (jsonify({'error': 'La subida ha expirado'}), 410)
+    return upload, None
+
+def _upload_offset(upload):
+    # Lo que hay en disco manda: si un PATCH se cortó después de escribir y antes
+    # del commit, el cliente debe continuar desde ahí y no desde la fila
+    if upload.status != 'uploading':
+        return upload.offset
+    on_disk = part_offset(temp_upload_path(current_app.root_path, upload.id))
+    return upload.offset if on_disk is None else on_disk
+
+def _upload_headers(offset, total_size):
+    return {
+        'Upload-Offset': str(offset),
+        'Upload-Length': str(total_size),
+        'Cache-Control': 'no-store'
+    }
+
+def _upload_busy():
+    return jsonify({'error': 'Otra petición está procesando esta subida; reintente en unos segundos'}), 409
+
+@medical_studies_bp.route('/uploads', methods=['POST'])
+@jwt_required()
+def create_chunked_upload():
+    try:
+        user_id = int(get_jwt_identity())
+        data = request.get_json() or {}
+        
+        filename = secure_filename(data.get('filename') or '')
+        if not filename or not allowed_file(filename):
+            return jsonify({'error': 'Tipo de archivo no permitido'}), 400
+        
+        total_size = data.get('size')
+        if not isinstance(total_size, int) or total_size <= 0:
+            return jsonify({'error': 'Se requiere el tamaño del archivo en bytes'}), 400
+        if total_size > CHUNKED_UPLOAD_MAX_SIZE:
+            return jsonify({'error': f'El archivo supera el máximo de {CHUNKED_UPLOAD_MAX_SIZE} bytes'}), 413
+        
+        upload = UploadSession(
+            user_id=user_id,
+            filename=filename,
+            study_type=data.get('study_type', 'general'),
+            total_size=total_size,
+            offset=0,
+            expected_sha256=(data.get('sha256') or '').lower() or None,
+            expires_at=datetime.utcnow() + UPLOAD_SESSION_TTL
+        )
+        db.session.add(upload)
+        db.session.flush()
+        create_upload_file(temp_upload_path(current_app.root_path, upload.id))
+        db.session.commit()
+        
+        response = upload.to_dict()
+        response['chunk_size'] = CHUNK_SIZE
+        headers = _upload_headers(upload.offset, upload.total_size)
+        headers['Location'] = f"{request.base_url}/{upload.id}"
+        return jsonify(response), 201, headers
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error al crear subida por partes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@medical_studies_bp.route('/uploads/<string:upload_id>', methods=['HEAD', 'GET'])
+@jwt_required()
+def get_chunked_upload(upload_id):
+    upload, error = _get_upload_session(upload_id)
+    if error:
+        return error
+    response = upload.to_dict()
+    response['offset'] = _upload_offset(upload)
+    return jsonify(response), 200, _upload_headers(response['offset'], upload.total_size)
+
+@medical_studies_bp.route('/uploads/<string:upload_id>', methods=['PATCH'])
+@jwt_required()
+def append_chunked_upload(upload_id):
+    upload, error = _get_upload_session(upload_id)
+    if error:
+        return error
+    if upload.status != 'uploading':
+        return jsonify({'error': 'La subida ya fue finalizada'}), 409
+    
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'Se requiere el encabezado Upload-Offset'}), 400
+    
+    total_size = upload.total_size
+    part_path = temp_upload_path(current_app.root_path, upload.id)
+    # No mantener una transacción (ni una conexión del pool) abierta mientras
+    # llega el cuerpo: la exclusión entre peticiones la da el bloqueo del archivo
+    db.session.rollback()
+    
+    try:
+        with upload_lock(part_path):
+            current_offset = part_offset(part_path)
+            if offset != current_offset:
+                return jsonify({'error': 'Offset incorrecto', 'offset': current_offset}), 409, _upload_headers(current_offset, total_size)
+            
+            remaining = total_size - current_offset
+            if request.content_length is not None and request.content_length > remaining:
+                return jsonify({'error': 'El trozo supera el tamaño declarado del archivo'}), 413
+            
+            try:
+                new_offset = append_chunk(part_path, offset, request.stream, remaining)
+            except OffsetMismatch as mismatch:
+                print(f"Subida {upload_id}: {str(mismatch)}")
+                current_offset = part_offset(part_path)
+                return jsonify({'error': 'Offset incorrecto', 'offset': current_offset}), 409, _upload_headers(current_offset, total_size)
+            
+            # Solo si la subida sigue en curso (no se canceló ni finalizó entretanto)
+            updated = UploadSession.query.filter_by(id=upload_id, status='uploading').update({
+                UploadSession.offset: new_offset,
+                UploadSession.expires_at: datetime.utcnow() + UPLOAD_SESSION_TTL
+            }, synchronize_session=False)
+            db.session.commit()
+    except UploadBusy:
+        return _upload_busy()
+    except FileNotFoundError:
+        return jsonify({'error': 'La subida ya no existe en el servidor'}), 410
+    
+    if not updated:
+        return jsonify({'error': 'La subida ya no está en curso'}), 409
+    return '', 204, _upload_headers(new_offset, total_size)
+
+@medical_studies_bp.route('/uploads/<string:upload_id>/finalize', methods=['POST'])
+@jwt_required()
+def finalize_chunked_upload(upload_id):
+    upload, error = _get_upload_session(upload_id)
+    if error:
+        return error
+    if upload.status == 'completed':
+        return jsonify({'message': 'Subida ya finalizada', 'study_id': upload.study_id}), 200
+    
+    total_size = upload.total_size
+    expected_sha256 = upload.expected_sha256
+    patient_id = upload.user_id
+    study_type = upload.study_type
+    part_path = temp_upload_path(current_app.root_path, upload.id)
+    # Hash y copia al almacén pueden tardar: sin transacción abierta mientras tanto
+    db.session.rollback()
+    
+    try:
+        with upload_lock(part_path):
+            current_offset = part_offset(part_path)
+            if current_offset != total_size:
+                return jsonify({'error': 'La subida está incompleta', 'offset': current_offset}), 409, _upload_headers(current_offset, total_size)
+            
+            sha256 = finalize_digest(part_path)
+            if expected_sha256 and expected_sha256 != sha256:
+                discard_upload(part_path)
+                UploadSession.query.filter_by(id=upload_id, status='uploading').delete(synchronize_session=False)
+                db.session.commit()
+                return jsonify({'error': 'El hash SHA-256 no coincide; vuelva a subir el archivo', 'sha256': sha256}), 422
+            
+            # Tipo real por los bytes mágicos (solo se leen los primeros bytes)
+            mime_type = sniff_file(part_path)
+            if mime_type not in DOCUMENT_TYPES:
+                discard_upload(part_path)
+                UploadSession.query.filter_by(id=upload_id, status='uploading').delete(synchronize_session=False)
+                db.session.commit()
+                return jsonify({'error': 'Tipo de archivo no permitido'}), 415
+            
+            # Mover el archivo al almacén por contenido reutilizando el hash ya calculado
+            file_key = store_path(
+                part_path,
+                EXTENSIONS[mime_type],
+                sha256=sha256,
+                size=total_size
+            )
+            
+            study = MedicalStudy(
+                patient_id=patient_id,
+                study_type=study_type,
+                file_path=file_key,
+                storage_key=file_key,
+                created_at=datetime.utcnow()
+            )
+            db.session.add(study)
+            db.session.flush()
+            updated = UploadSession.query.filter_by(id=upload_id, status='uploading').update({
+                UploadSession.status: 'completed',
+                UploadSession.offset: total_size,
+                UploadSession.study_id: study.id
+            }, synchronize_session=False)
+            if not updated:
+                # Cancelada o expirada entretanto: el blob queda sin referencia para el GC
+                db.session.rollback()
+                return jsonify({'error': 'La subida ya no está en curso'}), 409
+            db.session.commit()
+        schedule_thumbnails(file_key)
+        
+        return jsonify({
+            'message': 'Estudio subido con éxito',
+            'study_id': study.id,
+            'sha256': sha256,
+            'file_path': study.file_path,
+            'thumbnails': thumbnail_urls(study.file_path)
+        }), 201
+    except UploadBusy:
+        return _upload_busy()
+    except FileNotFoundError:
+        db.session.rollback()
+        # Otra petición pudo finalizarla mientras tanto (el archivo ya se movió al almacén)
+        upload = UploadSession.query.get(upload_id)
+        if upload and upload.status == 'completed':
+            return jsonify({'message': 'Subida ya finalizada', 'study_id': upload.study_id}), 200
+        return jsonify({'error': 'La subida ya no existe en el servidor'}), 410
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error al finalizar subida por partes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@medical_studies_bp.route('/uploads/<string:upload_id>', methods=['DELETE'])
+@jwt_required()
+def abort_chunked_upload(upload_id):
+    upload, error = _get_upload_session(upload_id)
+    if error:
+        return error
+    if upload.status != 'uploading':
+        return jsonify({'error': 'La subida ya fue finalizada'}), 409
+    
+    part_path = temp_upload_path(current_app.root_path, upload.id)
+    try:
+        with upload_lock(part_path):
+            discard_upload(part_path)
+    except UploadBusy:
+        return _upload_busy()
+    except FileNotFoundError:
+        pass
+    db.session.delete(upload)
+    db.session.commit()
+    return jsonify({'message': 'Subida cancelada'}), 200
@@ -1,12 +1,21 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from werkzeug.utils import secure_filename
 from models import db, User, NutritionAnalysis, NutritionLog
 from utils.openai_utils import analyze_food_image, extract_nutrition_data
-from utils.anthropic_utils import analyze_food_image_with_anthropic
+from utils.anthropic_utils import analyze_food_image_with_anthropic, analyze_food_images_with_anthropic
+from utils.image_quality import check_image_quality
+from utils import metrics
+from utils.db_routing import replica_read
+from utils.blob_store import store_ingested, release_reference, register_uploaded, temp_dir
+from utils.ingest import ingest_upload, IngestError, IMAGE_TYPES, DEFAULT_MAX_SIZE
+from utils.storage import get_storage
+from utils.thumbnails import schedule_thumbnails, thumbnail_urls
+from utils.nutrition_totals import record_log_entry, daily_total, totals_between, parse_series_args, summary_series
 import os
-import uuid
 import base64
+import calendar
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import date
 from sqlalchemy import func, extract
 from datetime import datetime
@@ -15,6 +24,8 @@ nutrition_bp = Blueprint('nutrition', __name__)
 
 # Configuración para subida de archivos
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# Máximo de imágenes por análisis de comida en lote
+MAX_BATCH_IMAGES = 6
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -27,14 +38,10 @@ def init_app(app):
 @nutrition_bp.route('/analyze-food', methods=['POST'])
 @jwt_required()
 def analyze_food():
+    image_files = ExitStack()
     try:
         print("=== Iniciando análisis de alimentos ===")
         
-        # Asegurarse de que el directorio existe
-        upload_dir = os.path.join(current_app.root_path, 'uploads', 'nutrition')
-        os.makedirs(upload_dir, exist_ok=True)
-        print(f"Directorio de uploads asegurado: {upload_dir}")
-        
         user_id = get_jwt_identity()
         print(f"ID de usuario: {user_id}")
         
@@ -46,54 +53,68 @@ def analyze_food():
         
         # Verificar archivo
         print("Verificando archivo en la solicitud...")
-        if 'file' not in request.files:
+        storage_key = request.form.get('storage_key')
+        if 'file' not in request.files and not storage_key:
             print("No se encontró archivo en la solicitud")
             return jsonify({'error': 'No se envió ningún archivo'}), 400
-            
-        file = request.files['file']
-        print(f"Archivo recibido: {file.filename}, tipo: {file.content_type}")
         
-        if file.filename == '':
-            print("Nombre de archivo vacío")
-            return jsonify({'error': 'No se seleccionó ningún archivo'}), 400
+        if 'file' in request.files:
+            file = request.files['file']
+            print(f"Archivo recibido: {file.filename}, tipo: {file.content_type}")
             
-        if not allowed_file(file.filename):
-            print(f"Tipo de archivo no permitido: {file.filename}")
+            if file.filename == '':
+                print("Nombre de archivo vacío")
+                return jsonify({'error': 'No se seleccionó ningún archivo'}), 400
+                
+            if not allowed_file(file.filename):
+                print(f"Tipo de archivo no permitido: {file.filename}")
+                return jsonify({'error': 'Tipo de archivo no permitido'}), 400
+        elif not allowed_file(storage_key):
             return jsonify({'error': 'Tipo de archivo no permitido'}), 400
         
-        # Crear nombre de archivo seguro
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_path = os.path.join(upload_dir, unique_filename)
-        print(f"Guardando archivo en: {file_path}")
-        
-        # Guardar archivo
+        # Ingesta en una sola pasada (hash, tipo real y tamaño); el archivo pasa al
+        # almacén por contenido solo si se registra el análisis
+        ingested = None
+        mime_type = None
         try:
-            file.save(file_path)
-            print("Archivo guardado exitosamente")
-            print(f"Tamaño del archivo: {os.path.getsize(file_path)} bytes")
+            if 'file' in request.files:
+                ingested = ingest_upload(file, temp_dir(), IMAGE_TYPES)
+                image_files.callback(ingested.discard)
+                file_key = None
+                file_path = ingested.path
+                mime_type = ingested.mime_type
+                print(f"Archivo recibido: {ingested.size} bytes, {mime_type}, sha256={ingested.sha256}")
+            else:
+                file_key = register_uploaded(storage_key, user_id, IMAGE_TYPES, DEFAULT_MAX_SIZE)
+                if not file_key:
+                    return jsonify({'error': 'Archivo no encontrado en el almacenamiento'}), 400
+                # Con un backend remoto (S3) la imagen se descarga a un temporal para analizarla
+                file_path = image_files.enter_context(get_storage().local_copy(file_key))
+        except IngestError as e:
+            return jsonify({'error': str(e)}), e.status
         except Exception as save_error:
             print(f"Error al guardar archivo: {str(save_error)}")
             return jsonify({'error': 'Error al guardar el archivo'}), 500
         
-        # Verificar que el archivo existe y es accesible
-        if not os.path.exists(file_path):
-            print("El archivo no existe después de guardarlo")
-            return jsonify({'error': 'Error al guardar el archivo'}), 500
-        
-        print("Intentando leer el archivo guardado...")
-        try:
-            with open(file_path, 'rb') as test_file:
-                test_data = test_file.read()
-                print(f"Archivo leído exitosamente, tamaño: {len(test_data)} bytes")
-        except Exception as read_error:
-            print(f"Error al leer el archivo guardado: {str(read_error)}")
-            return jsonify({'error': 'Error al procesar el archivo'}), 500
+        # Control de calidad local antes de pagar la latencia del modelo de visión
+        quality = check_image_quality(file_path)
+        print(f"Control de calidad de la imagen: {quality}")
+        if not quality['ok']:
+            metrics.increment('image_quality.llm_calls_saved')
+            if file_key:
+                release_reference(file_key)
+                db.session.commit()
+            return jsonify({
+                'error': 'La imagen no tiene la calidad suficiente para analizarla',
+                'quality_errors': quality['errors'],
+                'quality_warnings': quality['warnings'],
+                'quality_metrics': quality['metrics']
+            }), 422
         
         # Analizar la imagen con Anthropic en lugar de OpenAI
         print("Iniciando análisis de la imagen con Anthropic...")
         try:
-            analysis = analyze_food_image_with_anthropic(file_path)
+            analysis = analyze_food_image_with_anthropic(file_path, mime_type)
             print("Análisis completado")
             print(f"Resultado del análisis (primeros 100 caracteres): {analysis[:100] if analysis else 'None'}")
             
@@ -122,6 +143,16 @@ def analyze_food():
         # Guardar en NutritionLog
         try:
             print("Guardando entrada en NutritionLog...")
+            if ingested is not None:
+                file_key = store_ingested(ingested)
+            # El análisis guarda la referencia a la imagen en el almacén
+            nutrition_analysis = NutritionAnalysis(
+                user_id=user_id,
+                file_path=file_key,
+                analysis=analysis
+            )
+            db.session.add(nutrition_analysis)
+            db.session.flush()
             log_entry = NutritionLog(
                 user_id=user_id,
                 log_date=date.today(),
@@ -129,9 +160,12 @@ def analyze_food():
                 proteins=nutritional_data.get('proteins', 0.0),
                 carbs=nutritional_data.get('carbs', 0.0),
                 fats=nutritional_data.get('fats', 0.0),
+                source_analysis_id=nutrition_analysis.id,
             )
             db.session.add(log_entry)
+            record_log_entry(log_entry)
             db.session.commit()
+            schedule_thumbnails(file_key)
             print(f"Entrada de log guardada con ID: {log_entry.id}")
         except Exception as log_error:
             db.session.rollback()
@@ -142,6 +176,8 @@ def analyze_food():
             'message': 'Análisis completado',
             'analysis': analysis,
             'nutritional_data': nutritional_data,
+            'quality_warnings': quality['warnings'],
+            'thumbnails': thumbnail_urls(file_key),
         }), 200
         
     except Exception as e:
@@ -151,10 +187,161 @@ def analyze_food():
         import traceback
         traceback.print_exc()
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500 
+        return jsonify({'error': str(e)}), 500
+    finally:
+        image_files.close()
+
+@nutrition_bp.route('/analyze-food/batch', methods=['POST'])
+@jwt_required()
+def analyze_food_batch():
+    """
+    Analiza varias fotos de una misma comida con una sola llamada al modelo
+    y registra una única entrada agregada en NutritionLog.
+    """
+    ingested_files = []
+    try:
+        user_id = get_jwt_identity()
+        user = User.query.get(user_id)
+        
+        if not user:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
+        
+        files = [f for f in request.files.getlist('files') if f and f.filename]
+        
+        if not files:
+            return jsonify({'error': 'No se envió ningún archivo'}), 400
+        
+        if len(files) > MAX_BATCH_IMAGES:
+            return jsonify({'error': f'Se permiten como máximo {MAX_BATCH_IMAGES} imágenes por comida'}), 400
+        
+        invalid = [f.filename for f in files if not allowed_file(f.filename)]
+        if invalid:
+            return jsonify({'error': 'Tipo de archivo no permitido', 'files': invalid}), 400
+        
+        # Ingesta en paralelo (a temp; luego pasan al almacén por contenido). El
+        # directorio se resuelve aquí porque los threads no tienen contexto de aplicación.
+        upload_dir = temp_dir()
+        with ThreadPoolExecutor(max_workers=len(files)) as executor:
+            futures = [executor.submit(ingest_upload, f, upload_dir, IMAGE_TYPES) for f in files]
+        rejected = {}
+        for file, future in zip(files, futures):
+            try:
+                ingested_files.append(future.result())
+            except IngestError as e:
+                rejected[file.filename] = (str(e), e.status)
+        if rejected:
+            return jsonify({
+                'error': 'Algunos archivos fueron rechazados',
+                'files': {name: message for name, (message, _) in rejected.items()}
+            }), max(status for _, status in rejected.values())
+        saved_paths = [ingested.path for ingested in ingested_files]
+        print(f"{len(saved_paths)} imágenes guardadas para análisis en lote")
+        
+        # Control de calidad local de cada imagen antes de llamar al modelo
+        quality_warnings = {}
+        quality_errors = {}
+        for file, file_path in zip(files, saved_paths):
+            quality = check_image_quality(file_path)
+            if not quality['ok']:
+                quality_errors[file.filename] = quality['errors']
+            elif quality['warnings']:
+                quality_warnings[file.filename] = quality['warnings']
+        
+        if quality_errors:
+            metrics.increment('image_quality.llm_calls_saved')
+            return jsonify({
+                'error': 'Algunas imágenes no tienen la calidad suficiente para analizarlas',
+                'quality_errors': quality_errors,
+                'quality_warnings': quality_warnings
+            }), 422
+        
+        # Una sola llamada al modelo con todas las imágenes
+        result = analyze_food_images_with_anthropic(saved_paths, [i.mime_type for i in ingested_files])
+        if not result.get('success'):
+            return jsonify({'error': result.get('error', 'Error al analizar las imágenes')}), 500
+        
+        analysis = result.get('analysis') or ''
+        items = result.get('items') or []
+        totals = result.get('totals')
+        if not totals:
+            # Respuesta sin JSON: extraer los totales del texto como en el análisis individual
+            totals = extract_nutrition_data(analysis)
+        
+        # Pasar las imágenes al almacén por contenido, con un NutritionAnalysis por imagen
+        analyses = []
+        for ingested in ingested_files:
+            file_key = store_ingested(ingested)
+            nutrition_analysis = NutritionAnalysis(user_id=user_id, file_path=file_key, analysis=analysis)
+            db.session.add(nutrition_analysis)
+            analyses.append(nutrition_analysis)
+        db.session.flush()
+        
+        log_entry = NutritionLog(
+            user_id=user_id,
+            log_date=date.today(),
+            source_analysis_id=analyses[0].id,
+            calories=int(round(totals.get('calories', 0) or 0)),
+            proteins=totals.get('proteins', 0.0) or 0.0,
+            carbs=totals.get('carbs', 0.0) or 0.0,
+            fats=totals.get('fats', 0.0) or 0.0,
+        )
+        db.session.add(log_entry)
+        record_log_entry(log_entry)
+        db.session.commit()
+        schedule_thumbnails(*[a.file_path for a in analyses])
+        print(f"Entrada de log agregada guardada con ID: {log_entry.id}")
+        
+        return jsonify({
+            'message': 'Análisis completado',
+            'analysis': analysis,
+            'items': items,
+            'nutritional_data': totals,
+            'log_entry': log_entry.to_dict(),
+            'image_count': len(saved_paths),
+            'thumbnails': [thumbnail_urls(a.file_path) for a in analyses],
+            'quality_warnings': quality_warnings
+        }), 200
+        
+    except Exception as e:
+        print(f"Error en analyze_food_batch: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Los temporales que no pasaron al almacén (rechazados o con error) se eliminan
+        for ingested in ingested_files:
+            ingested.discard()
+
+@nutrition_bp.route('/summary', methods=['GET'])
+@jwt_required()
+@replica_read
+def get_summary_series():
+    """
+    Totales de varios días en una sola llamada: ?from=YYYY-MM-DD&to=YYYY-MM-DD&granularity=day|week|month
+    """
+    user_id = get_jwt_identity()
+    try:
+        start, end, granularity = parse_series_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        user = User.query.get(user_id)
+        return jsonify({
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'granularity': granularity,
+            'daily_calorie_goal': user.daily_calorie_goal if user else 2000,
+            'series': summary_series(user_id, start, end, granularity)
+        }), 200
+    except Exception as e:
+        print(f"Error en get_summary_series: {str(e)}")
+        return jsonify({'error': 'Error al obtener el resumen'}), 500
 
 @nutrition_bp.route('/summary/<string:log_date_str>', methods=['GET'])
 @jwt_required()
+@replica_read
 def get_daily_summary(log_date_str):
     user_id = get_jwt_identity()
     try:
@@ -164,16 +351,8 @@ def get_daily_summary(log_date_str):
         return jsonify({'error': 'Formato de fecha inválido. Usar YYYY-MM-DD'}), 400
 
     try:
-        # Consultar y agregar datos para el usuario y la fecha
-        summary = db.session.query(
-            func.sum(NutritionLog.calories).label('total_calories'),
-            func.sum(NutritionLog.proteins).label('total_proteins'),
-            func.sum(NutritionLog.carbs).label('total_carbs'),
-            func.sum(NutritionLog.fats).label('total_fats')
-        ).filter(
-            NutritionLog.user_id == user_id,
-            NutritionLog.log_date == log_date
-        ).group_by(NutritionLog.user_id).first() # group_by es necesario para sum
+        # Totales precalculados del día (búsqueda por clave primaria)
+        summary = daily_total(user_id, log_date)
 
         user = User.query.get(user_id)
         daily_goal = user.daily_calorie_goal if user else 2000 # Obtener objetivo
@@ -181,10 +360,10 @@ def get_daily_summary(log_date_str):
         if summary:
             result = {
                 'date': log_date.isoformat(),
-                'calories': summary.total_calories or 0,
-                'proteins': summary.total_proteins or 0.0,
-                'carbs': summary.total_carbs or 0.0,
-                'fats': summary.total_fats or 0.0,
+                'calories': summary.calories,
+                'proteins': summary.proteins,
+                'carbs': summary.carbs,
+                'fats': summary.fats,
                 'daily_calorie_goal': daily_goal
             }
         else:
@@ -205,37 +384,33 @@ def get_daily_summary(log_date_str):
 
 @nutrition_bp.route('/summary/month/<int:year>/<int:month>', methods=['GET'])
 @jwt_required()
+@replica_read
 def get_monthly_summary(year, month):
     user_id = get_jwt_identity()
     if not (1 <= month <= 12):
          return jsonify({'error': 'Mes inválido'}), 400
 
     try:
-        # Consultar y agregar datos para el usuario y el mes/año
-        summary = db.session.query(
-            func.sum(NutritionLog.calories).label('total_calories'),
-            func.sum(NutritionLog.proteins).label('total_proteins'),
-            func.sum(NutritionLog.carbs).label('total_carbs'),
-            func.sum(NutritionLog.fats).label('total_fats'),
-            func.count(NutritionLog.id).label('entry_count') # Contar entradas
-        ).filter(
-            NutritionLog.user_id == user_id,
-            extract('year', NutritionLog.log_date) == year,
-            extract('month', NutritionLog.log_date) == month
-        ).group_by(NutritionLog.user_id).first()
+        # Rango de días del mes sobre los totales diarios (usa la clave primaria,
+        # a diferencia de extract() sobre log_date)
+        first_day = date(year, month, 1)
+        last_day = date(year, month, calendar.monthrange(year, month)[1])
+        days = totals_between(user_id, first_day, last_day)
 
-        if summary:
+        if days:
+            entry_count = sum(day.entry_count for day in days)
+            total_calories = sum(day.calories for day in days)
              # Calcular promedios si hay entradas
-            avg_calories = (summary.total_calories / summary.entry_count) if summary.entry_count > 0 else 0
+            avg_calories = (total_calories / entry_count) if entry_count > 0 else 0
             result = {
                 'year': year,
                 'month': month,
-                'total_calories': summary.total_calories or 0,
-                'total_proteins': summary.total_proteins or 0.0,
-                'total_carbs': summary.total_carbs or 0.0,
-                'total_fats': summary.total_fats or 0.0,
+                'total_calories': total_calories,
+                'total_proteins': sum(day.proteins for day in days),
+                'total_carbs': sum(day.carbs for day in days),
+                'total_fats': sum(day.fats for day in days),
                 'average_daily_calories': avg_calories,
-                'entry_count': summary.entry_count
+                'entry_count': entry_count
             }
         else:
              result = {
@@ -6,6 +6,9 @@ import os
 import uuid
 from datetime import datetime, date
 import json
+from utils.blob_store import store_upload, release_or_remove
+from utils.ingest import IngestError, IMAGE_TYPES
+from utils.pagination import paginate_model, parse_fields, model_fields, row_to_dict
 
 profile_bp = Blueprint('profile', __name__)
 
@@ -104,25 +107,21 @@ def upload_profile_picture():
         if not user:
             return jsonify({'error': 'Usuario no encontrado'}), 404
 
-        # Eliminar la foto anterior si existe
+        # Guardar el archivo en el almacén por contenido (el tipo se valida por el contenido)
+        try:
+            new_picture = store_upload(file, IMAGE_TYPES | {'image/gif'})
+        except IngestError as e:
+            return jsonify({'error': str(e)}), e.status
+
+        # Liberar la foto anterior (el archivo se borra tras el commit si nadie más la usa)
         if user.profile_picture:
             try:
-                old_picture_path = os.path.join(current_app.root_path, 'uploads', user.profile_picture)
-                if os.path.exists(old_picture_path):
-                    os.remove(old_picture_path)
+                release_or_remove(user.profile_picture)
             except Exception as e:
                 print(f"Error al eliminar foto anterior: {str(e)}")
 
-        # Generar nombre de archivo único
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        
-        # Guardar el archivo
-        file_path = os.path.join(current_app.root_path, 'uploads', 'profile_pics', unique_filename)
-        file.save(file_path)
-        
         # Actualizar la base de datos
-        user.profile_picture = f"profile_pics/{unique_filename}"
+        user.profile_picture = new_picture
         db.session.commit()
         
         return jsonify({
@@ -242,11 +241,18 @@ def add_medication():
 def get_medications():
     user_id = get_jwt_identity()
     
-    # Obtener todos los medicamentos del usuario
-    medications = Medication.query.filter_by(user_id=user_id).order_by(Medication.created_at.desc()).all()
+    # Medicamentos del usuario, del más reciente al más antiguo, por páginas
+    try:
+        rows, fields, next_cursor = paginate_model(
+            Medication, [Medication.user_id == user_id],
+            [Medication.created_at, Medication.id], request.args
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
-        'medications': [medication.to_dict() for medication in medications]
+        'medications': [row_to_dict(row, fields) for row in rows],
+        'next_cursor': next_cursor
     }), 200
 
 @profile_bp.route('/medications/<int:medication_id>', methods=['PUT'])
@@ -383,26 +389,32 @@ def get_physical_activities():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     
-    query = PhysicalActivity.query.filter_by(user_id=user_id)
+    filters = [PhysicalActivity.user_id == user_id]
     
     if start_date:
         try:
             start = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(PhysicalActivity.date >= start)
+            filters.append(PhysicalActivity.date >= start)
         except ValueError:
             pass
     
     if end_date:
         try:
             end = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(PhysicalActivity.date <= end)
+            filters.append(PhysicalActivity.date <= end)
         except ValueError:
             pass
     
-    activities = query.order_by(PhysicalActivity.date.desc()).all()
+    try:
+        rows, fields, next_cursor = paginate_model(
+            PhysicalActivity, filters, [PhysicalActivity.date, PhysicalActivity.id], request.args
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
-        'activities': [activity.to_dict() for activity in activities]
+        'activities': [row_to_dict(row, fields) for row in rows],
+        'next_cursor': next_cursor
     }), 200
 
 @profile_bp.route('/blood-pressure', methods=['POST'])
@@ -441,26 +453,32 @@ def get_blood_pressure():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     
-    query = BloodPressure.query.filter_by(user_id=user_id)
+    filters = [BloodPressure.user_id == user_id]
     
     if start_date:
         try:
             start = datetime.strptime(start_date, '%Y-%m-%d')
-            query = query.filter(BloodPressure.measured_at >= start)
+            filters.append(BloodPressure.measured_at >= start)
         except ValueError:
             pass
     
     if end_date:
         try:
             end = datetime.strptime(end_date, '%Y-%m-%d')
-            query = query.filter(BloodPressure.measured_at <= end)
+            filters.append(BloodPressure.measured_at <= end)
         except ValueError:
             pass
     
-    records = query.order_by(BloodPressure.measured_at.desc()).all()
+    try:
+        rows, fields, next_cursor = paginate_model(
+            BloodPressure, filters, [BloodPressure.measured_at, BloodPressure.id], request.args
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
-        'blood_pressure_records': [record.to_dict() for record in records]
+        'blood_pressure_records': [row_to_dict(row, fields) for row in rows],
+        'next_cursor': next_cursor
     }), 200
 
 @profile_bp.route('/weight', methods=['POST'])
@@ -515,36 +533,45 @@ def get_weight():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     
-    query = WeightRecord.query.filter_by(user_id=user_id)
+    filters = [WeightRecord.user_id == user_id]
     
     if start_date:
         try:
             start = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(WeightRecord.date >= start)
+            filters.append(WeightRecord.date >= start)
         except ValueError:
             pass
     
     if end_date:
         try:
             end = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(WeightRecord.date <= end)
+            filters.append(WeightRecord.date <= end)
         except ValueError:
             pass
     
-    records = query.order_by(WeightRecord.date.desc()).all()
+    # 'bmi' es un campo calculado: necesita el peso aunque no se haya pedido
+    try:
+        fields = parse_fields(request.args, model_fields(WeightRecord) + ['bmi'])
+        rows, _, next_cursor = paginate_model(
+            WeightRecord, filters, [WeightRecord.date, WeightRecord.id], request.args,
+            fields=fields + ['weight'] if 'bmi' in fields else fields
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     # Calcular IMC para cada registro si el usuario tiene altura registrada
-    user = User.query.get(user_id)
+    height = db.session.query(User.height).filter(User.id == user_id).scalar() if 'bmi' in fields else None
     result = []
     
-    for record in records:
-        record_dict = record.to_dict()
-        if user and user.height:
-            record_dict['bmi'] = record.calculate_bmi(user.height)
+    for row in rows:
+        record_dict = row_to_dict(row, [field for field in fields if field != 'bmi'])
+        if height:
+            record_dict['bmi'] = WeightRecord.calculate_bmi(row, height)
         result.append(record_dict)
     
     return jsonify({
-        'weight_records': result
+        'weight_records': result,
+        'next_cursor': next_cursor
     }), 200
 
 @profile_bp.route('/health-analysis', methods=['GET'])
@@ -0,0 +1,160 @@
+from flask import Blueprint, request, jsonify, abort
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import MedicalStudy, NutritionAnalysis, User, DoctorCredential, Blob
+from utils.blob_store import staging_key, parse_blob_key, temp_dir, check_uploaded_type, DIRECT_UPLOAD_MAX_SIZE
+from utils.ingest import ingest_stream, IngestError, DOCUMENT_TYPES
+from utils.storage import get_storage, PRESIGNED_URL_EXPIRATION
+from utils.auth import current_is_doctor, current_is_admin
+from utils.thumbnails import is_thumbnail_key, THUMBNAIL_PATTERN
+import re
+
+storage_bp = Blueprint('storage', __name__)
+
+# Extensiones que se pueden subir directamente al almacenamiento y su Content-Type
+DIRECT_UPLOAD_EXTENSIONS = {
+    'pdf': 'application/pdf',
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+}
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def upload_source_key(key):
+    """
+    Archivo del que sale `key`: el original de una miniatura, o la propia clave.
+    None si es una miniatura cuyo original ya no está en el almacén.
+    """
+    match = THUMBNAIL_PATTERN.match(key or '')
+    if not match:
+        return key
+    blob = Blob.query.filter_by(sha256=match.group(1)).first()
+    return blob.storage_key if blob else None
+
+
+def is_public_upload(key):
+    """
+    Fotos de perfil y miniaturas de fotos de comida: se muestran en <img> sin
+    token, así que no requieren autenticación. Las miniaturas de estudios y
+    credenciales (p. ej. la primera página de un PDF) siguen la misma regla que
+    su original.
+    """
+    if User.query.filter_by(profile_picture=key).first() is not None:
+        return True
+    if not is_thumbnail_key(key):
+        return False
+    source = upload_source_key(key)
+    if source is None:
+        return False
+    if (MedicalStudy.query.filter_by(file_path=source).first() is not None or
+            DoctorCredential.query.filter_by(file_path=source).first() is not None):
+        return False
+    return (
+        NutritionAnalysis.query.filter_by(file_path=source).first() is not None or
+        User.query.filter_by(profile_picture=source).first() is not None
+    )
+
+
+def can_access_upload(key):
+    """
+    Si el usuario del JWT (ya verificado) puede descargar el archivo (o una
+    miniatura suya): médicos y administradores siempre; el resto, solo sus
+    estudios y análisis de comida.
+    """
+    if current_is_doctor() or current_is_admin():
+        return True
+    source = upload_source_key(key)
+    if source is None:
+        return False
+    user_id = int(get_jwt_identity())
+    return (
+        MedicalStudy.query.filter_by(patient_id=user_id, file_path=source).first() is not None or
+        NutritionAnalysis.query.filter_by(user_id=user_id, file_path=source).first() is not None
+    )
+
+
+@storage_bp.route('/presign-upload', methods=['POST'])
+@jwt_required()
+def presign_upload():
+    """
+    Devuelve una clave de subida propia del usuario y una URL prefirmada para
+    subir el archivo directamente al almacenamiento. Después, el cliente envía
+    esa clave como `storage_key` al endpoint de subida correspondiente, que la
+    valida y la pasa al almacén por contenido.
+    Siempre hay que subir el archivo, aunque su contenido ya esté en el almacén:
+    así nadie obtiene (ni averigua que existe) un blob ajeno conociendo su hash.
+    """
+    data = request.get_json() or {}
+    filename = data.get('filename') or ''
+    sha256 = (data.get('sha256') or '').lower()
+    size = data.get('size')
+
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    if extension not in DIRECT_UPLOAD_EXTENSIONS:
+        return jsonify({'error': 'Tipo de archivo no permitido'}), 400
+    if not SHA256_PATTERN.match(sha256):
+        return jsonify({'error': 'Se requiere el hash SHA-256 del archivo en hexadecimal'}), 400
+    if not isinstance(size, int) or size <= 0 or size > DIRECT_UPLOAD_MAX_SIZE:
+        return jsonify({'error': f'El tamaño debe estar entre 1 y {DIRECT_UPLOAD_MAX_SIZE} bytes'}), 400
+
+    storage = get_storage()
+    key = staging_key(get_jwt_identity(), sha256, extension)
+    return jsonify({
+        'key': key,
+        'upload': storage.presigned_put_url(key, sha256, DIRECT_UPLOAD_EXTENSIONS[extension]),
+        'expires_in': PRESIGNED_URL_EXPIRATION
+    }), 200
+
+
+@storage_bp.route('/local-upload/<token>', methods=['PUT'])
+def local_upload(token):
+    """
+    Destino de las URLs prefirmadas del backend local: recibe el cuerpo por
+    bloques, verifica el SHA-256 firmado en el token y guarda el blob.
+    """
+    storage = get_storage()
+    payload = storage.verify_token(token, 'put') if hasattr(storage, 'verify_token') else None
+    if not payload:
+        return jsonify({'error': 'URL de subida inválida o expirada'}), 403
+
+    key = payload['key']
+
+    # Misma ingesta que las subidas normales: bytes mágicos y tamaño máximo
+    try:
+        ingested = ingest_stream(request.stream, key, temp_dir(), DOCUMENT_TYPES, DIRECT_UPLOAD_MAX_SIZE)
+    except IngestError as e:
+        return jsonify({'error': str(e)}), e.status
+    try:
+        if ingested.sha256 != payload['sha256']:
+            return jsonify({'error': 'El contenido no coincide con el hash SHA-256 declarado'}), 422
+        try:
+            check_uploaded_type(key, ingested.mime_type)
+        except IngestError as e:
+            return jsonify({'error': str(e)}), e.status
+
+        if storage.exists(key):
+            return '', 204
+        storage.put_file(ingested.path, key)
+        return '', 201
+    finally:
+        ingested.discard()
+
+
+@storage_bp.route('/presign-download', methods=['GET'])
+@jwt_required()
+def presign_download():
+    """
+    URL prefirmada de corta duración para descargar un archivo del almacenamiento.
+    """
+    key = request.args.get('key', '')
+    if not parse_blob_key(key) and not is_thumbnail_key(key):
+        return jsonify({'error': 'Clave inválida'}), 400
+
+    if not can_access_upload(key):
+        return jsonify({'error': 'No tienes permiso para acceder a este archivo'}), 403
+
+    storage = get_storage()
+    if not storage.exists(key):
+        abort(404)
+    return jsonify({'url': storage.presigned_get_url(key), 'expires_in': PRESIGNED_URL_EXPIRATION}), 200
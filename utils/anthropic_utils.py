@@ -33,6 +33,11 @@ ANTHROPIC_VERSION = "2023-06-01" # Versión de la API de Anthropic
 MAX_RETRIES = 3 # Número máximo de reintentos
 INITIAL_BACKOFF = 1 # Tiempo inicial de espera en segundos
 
+# Versión del prompt/modelo de análisis de estudios médicos. Incrementarla al
+# cambiar el prompt o el modelo para que `manage.py reanalyze` detecte los
+# análisis desactualizados.
+MEDICAL_STUDY_PROMPT_VERSION = "2025-04-v1"
+
 def extract_text_from_pdf(pdf_path):
     """
     Extrae texto de un archivo PDF
@@ -422,9 +427,10 @@ def analyze_medical_study_with_openai(image_path, study_type):
         traceback.print_exc()
         return f"No se pudo analizar el estudio médico con OpenAI: {str(e)}"
 
-def analyze_food_image_with_anthropic(file_path):
+def analyze_food_image_with_anthropic(file_path, mime_type=None):
     """
     Analiza una imagen de comida usando Anthropic Claude.
+    mime_type es el tipo detectado al recibir la subida; si falta se deduce de la extensión.
     """
     if not client:
         return "Error: Cliente Anthropic no inicializado."
@@ -438,7 +444,8 @@ def analyze_food_image_with_anthropic(file_path):
             image_data = image_file.read()
         base64_image = base64.b64encode(image_data).decode("utf-8")
 
-        mime_type, _ = mimetypes.guess_type(file_path)
+        if not mime_type:
+            mime_type, _ = mimetypes.guess_type(file_path)
         if not mime_type or not mime_type.startswith('image/'):
             mime_type = 'image/jpeg'
 
@@ -506,4 +513,167 @@ def analyze_food_image_with_anthropic(file_path):
         - Proteínas: No disponible
         - Carbohidratos: No disponible
         - Grasas: No disponible
-        """ 
\ No newline at end of file
+        """
+
+def _parse_json_block(text):
+    """
+    Extrae el primer objeto JSON de una respuesta de texto del modelo.
+    """
+    if not text:
+        return None
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end <= start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+
+def analyze_food_images_with_anthropic(file_paths, mime_types=None):
+    """
+    Analiza varias imágenes de comida en una sola llamada a Anthropic Claude.
+
+    Las imágenes pueden ser el mismo plato desde distintos ángulos o varios
+    platos de una misma comida; el modelo devuelve los alimentos por separado
+    y el total sin contar dos veces lo que aparece en más de una foto.
+
+    mime_types, si se indica, lleva el tipo detectado de cada imagen en el mismo orden.
+
+    Returns:
+        dict: {'success', 'analysis', 'items', 'totals'} o {'success': False, 'error'}
+    """
+    if not client:
+        return {"success": False, "error": "Cliente Anthropic no inicializado."}
+
+    try:
+        model = "claude-3-5-sonnet-20240620"
+
+        content = [{
+            "type": "text",
+            "text": (
+                f"Eres un nutricionista experto. Recibirás {len(file_paths)} imágenes de una misma comida. "
+                "Pueden ser el mismo plato fotografiado desde distintos ángulos o varios platos distintos: "
+                "no cuentes dos veces un alimento que aparece en más de una imagen.\n\n"
+                "Responde ÚNICAMENTE con un objeto JSON con este formato:\n"
+                "{\"items\": [{\"name\": \"alimento\", \"images\": [1], \"calories\": 0, \"proteins\": 0, \"carbs\": 0, \"fats\": 0}], "
+                "\"total\": {\"calories\": 0, \"proteins\": 0, \"carbs\": 0, \"fats\": 0}, "
+                "\"analysis\": \"valoración nutricional y recomendaciones en formato markdown\"}\n\n"
+                "Las calorías van en kcal y los macronutrientes en gramos. 'images' indica en qué imágenes (numeradas desde 1) aparece el alimento."
+            )
+        }]
+        for index, file_path in enumerate(file_paths, start=1):
+            with open(file_path, "rb") as image_file:
+                base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+            mime_type = mime_types[index - 1] if mime_types else None
+            if not mime_type:
+                mime_type, _ = mimetypes.guess_type(file_path)
+            if not mime_type or not mime_type.startswith('image/'):
+                mime_type = 'image/jpeg'
+            content.append({"type": "text", "text": f"Imagen {index}:"})
+            content.append({
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": mime_type,
+                    "data": base64_image
+                }
+            })
+
+        print(f"Llamando a Anthropic API con modelo {model} ({len(file_paths)} imágenes)...")
+        response = client.messages.create(
+            model=model,
+            max_tokens=4000,
+            messages=[{"role": "user", "content": content}]
+        )
+        print("Respuesta recibida de Anthropic.")
+
+        if response.content and isinstance(response.content, list) and len(response.content) > 0:
+            text = response.content[0].text
+        else:
+            return {"success": False, "error": "Respuesta inesperada de la API de Anthropic."}
+
+        parsed = _parse_json_block(text)
+        if not parsed:
+            print("No se pudo interpretar la respuesta como JSON; se usa el texto completo.")
+            return {"success": True, "analysis": text, "items": [], "totals": None}
+
+        items = []
+        for item in parsed.get('items') or []:
+            items.append({
+                'name': item.get('name', ''),
+                'images': item.get('images', []),
+                'calories': float(item.get('calories') or 0),
+                'proteins': float(item.get('proteins') or 0),
+                'carbs': float(item.get('carbs') or 0),
+                'fats': float(item.get('fats') or 0)
+            })
+
+        total = parsed.get('total') or {}
+        totals = {}
+        for key in ('calories', 'proteins', 'carbs', 'fats'):
+            value = total.get(key)
+            totals[key] = float(value) if value is not None else sum(item[key] for item in items)
+
+        return {
+            "success": True,
+            "analysis": parsed.get('analysis') or text,
+            "items": items,
+            "totals": totals
+        }
+
+    except Exception as e:
+        print(f"Error en analyze_food_images_with_anthropic: {str(e)}")
+        traceback.print_exc()
+        return {"success": False, "error": str(e)}
+
+def extract_lab_values_with_anthropic(text):
+    """
+    Extrae los resultados numéricos de laboratorio de un texto (estudio o interpretación).
+
+    Returns:
+        dict: {'success', 'study_date', 'results': [{'analyte', 'value', 'unit', 'reference_range', 'reference_low', 'reference_high'}]}
+    """
+    if not client:
+        return {"success": False, "error": "Cliente Anthropic no inicializado."}
+
+    if not text or not text.strip():
+        return {"success": True, "study_date": None, "results": []}
+
+    try:
+        model = "claude-3-5-sonnet-20240620"
+        prompt = (
+            "Extrae todos los resultados numéricos de laboratorio del siguiente texto de un estudio médico. "
+            "Responde ÚNICAMENTE con un objeto JSON con este formato:\n"
+            "{\"study_date\": \"YYYY-MM-DD o null\", \"results\": [{\"analyte\": \"glucosa\", \"value\": 95, \"unit\": \"mg/dL\", "
+            "\"reference_range\": \"70-100\", \"reference_low\": 70, \"reference_high\": 100}]}\n\n"
+            "Usa nombres de analitos en español y en minúsculas. Omite valores no numéricos o cualitativos. "
+            "Si no hay resultados de laboratorio devuelve una lista vacía.\n\n"
+            f"Texto:\n{text}"
+        )
+
+        print(f"Llamando a Anthropic API con modelo {model} para extraer valores de laboratorio...")
+        response = client.messages.create(
+            model=model,
+            max_tokens=4000,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        print("Respuesta recibida de Anthropic.")
+
+        if not (response.content and isinstance(response.content, list) and len(response.content) > 0):
+            return {"success": False, "error": "Respuesta inesperada de la API de Anthropic."}
+
+        parsed = _parse_json_block(response.content[0].text)
+        if parsed is None:
+            return {"success": False, "error": "No se pudo interpretar la respuesta como JSON."}
+
+        return {
+            "success": True,
+            "study_date": parsed.get('study_date'),
+            "results": parsed.get('results') or []
+        }
+
+    except Exception as e:
+        print(f"Error en extract_lab_values_with_anthropic: {str(e)}")
+        traceback.print_exc()
+        return {"success": False, "error": str(e)}
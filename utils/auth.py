@@ -1,8 +1,67 @@
+from enum import Enum
 from functools import wraps
-from flask import jsonify
-from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from flask import jsonify, g
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity, get_jwt, create_access_token
 from models import User, Doctor
 
+# El rol y si es médico viajan firmados en el token (claims 'role' e 'is_doctor'),
+# así las comprobaciones de permisos no consultan la base de datos. Un cambio de
+# rol se aplica cuando el usuario obtiene un token nuevo (al volver a iniciar sesión).
+ADMIN_ROLES = ('ADMIN', 'SUPERADMIN')
+
+_NOT_LOADED = object()
+
+def role_name(role):
+    """
+    Normaliza el rol a la cadena en mayúsculas ('USER', 'DOCTOR', 'ADMIN', 'SUPERADMIN').
+    """
+    if isinstance(role, Enum):
+        return role.name
+    return (role or 'USER').upper()
+
+def token_claims(user):
+    return {
+        'role': role_name(user.role),
+        'is_doctor': bool(user.is_doctor),
+    }
+
+def issue_access_token(user, expires_delta=None):
+    """
+    Genera el token de acceso con la identidad y los claims de rol del usuario.
+    """
+    kwargs = {'expires_delta': expires_delta} if expires_delta is not None else {}
+    return create_access_token(identity=str(user.id), additional_claims=token_claims(user), **kwargs)
+
+def current_user():
+    """
+    Usuario del token, cargado como mucho una vez por petición (o None si no existe).
+    """
+    user = g.get('_current_user', _NOT_LOADED)
+    if user is _NOT_LOADED:
+        user = User.query.get(get_jwt_identity())
+        g._current_user = user
+    return user
+
+def _claims():
+    claims = get_jwt()
+    if 'role' in claims and 'is_doctor' in claims:
+        return claims
+    # Tokens emitidos antes de incluir los claims: se consulta el usuario (una vez)
+    user = current_user()
+    return token_claims(user) if user else {'role': None, 'is_doctor': False}
+
+def current_role():
+    return _claims()['role']
+
+def current_is_doctor():
+    return bool(_claims()['is_doctor'])
+
+def current_is_admin():
+    return current_role() in ADMIN_ROLES
+
+def current_is_superadmin():
+    return current_role() == 'SUPERADMIN'
+
 def doctor_required(fn):
     """
     Decorador para rutas que requieren que el usuario sea un doctor.
@@ -10,14 +69,12 @@ def doctor_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
         verify_jwt_in_request()
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        if not user or not user.is_doctor:
+
+        if not current_is_doctor():
             return jsonify({'error': 'Se requiere ser doctor para acceder a esta funcionalidad'}), 403
-        
+
         return fn(*args, **kwargs)
-    
+
     return wrapper
 
 def admin_required(fn):
@@ -27,14 +84,12 @@ def admin_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
         verify_jwt_in_request()
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        if not user or not user.is_admin():
+
+        if not current_is_admin():
             return jsonify({'error': 'Se requiere ser administrador para acceder a esta funcionalidad'}), 403
-        
+
         return fn(*args, **kwargs)
-    
+
     return wrapper
 
 def superadmin_required(fn):
@@ -44,12 +99,10 @@ def superadmin_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
         verify_jwt_in_request()
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        if not user or not user.is_superadmin():
+
+        if not current_is_superadmin():
             return jsonify({'error': 'Se requiere ser superadministrador para acceder a esta funcionalidad'}), 403
-        
+
         return fn(*args, **kwargs)
-    
-    return wrapper 
\ No newline at end of file
+
+    return wrapper
@@ -0,0 +1,269 @@
+import hashlib
+import os
+import re
+import time
+import uuid
+from flask import current_app
+from sqlalchemy import event
+from models import db, Blob
+from utils.storage import get_storage
+from utils.ingest import ingest_upload, sniff_mime_type, IngestError, DOCUMENT_TYPES, EXTENSIONS, DEFAULT_MAX_SIZE
+
+# Almacén de archivos direccionado por contenido: cada archivo se guarda una sola
+# vez con la clave blobs/<aa>/<bb>/<sha256><ext> en el backend de almacenamiento
+# configurado (disco local o S3) y las filas que lo usan (MedicalStudy,
+# NutritionAnalysis, User.profile_picture, DoctorCredential) guardan esa clave
+# en su columna de ruta. Blob.ref_count cuenta esas referencias.
+BLOB_PREFIX = 'blobs'
+COPY_BLOCK_SIZE = 1024 * 1024
+BLOB_KEY_PATTERN = re.compile(r'^blobs/([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})(\.[a-z0-9]{1,10})?$')
+# Subidas directas al almacenamiento con URL prefirmada (ver routes/storage.py):
+# el cliente sube a incoming/<usuario>/<aleatorio>/<sha256><ext> y, al registrarla,
+# se valida y se mueve a su clave de blob. La clave aleatoria de cada subida es la
+# prueba de que el cliente tiene el contenido (el hash solo no basta).
+STAGING_PREFIX = 'incoming'
+STAGING_KEY_PATTERN = re.compile(r'^incoming/(\d+)/[0-9a-f]{32}/([0-9a-f]{64})(\.[a-z0-9]{1,10})$')
+DIRECT_UPLOAD_MAX_SIZE = int(os.environ.get('DIRECT_UPLOAD_MAX_SIZE', str(1024 * 1024 * 1024)))  # 1 GB
+
+
+def blob_key(sha256, extension):
+    """
+    Clave (ruta relativa a uploads/) de un blob a partir de su hash y extensión.
+    """
+    extension = (extension or '').lower()
+    if extension and not extension.startswith('.'):
+        extension = f".{extension}"
+    return f"{BLOB_PREFIX}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def staging_key(user_id, sha256, extension):
+    """
+    Clave de subida directa, única por subida y ligada al usuario.
+    """
+    return f"{STAGING_PREFIX}/{int(user_id)}/{uuid.uuid4().hex}/{sha256}.{extension.lower().lstrip('.')}"
+
+
+def is_blob_key(key):
+    return bool(key) and key.startswith(f"{BLOB_PREFIX}/")
+
+
+def parse_blob_key(key):
+    """
+    Devuelve el SHA-256 de una clave de blob bien formada, o None.
+    """
+    match = BLOB_KEY_PATTERN.match(key or '')
+    if not match:
+        return None
+    sha256 = match.group(3)
+    if sha256[:2] != match.group(1) or sha256[2:4] != match.group(2):
+        return None
+    return sha256
+
+
+def temp_dir():
+    """
+    Directorio local para archivos temporales (siempre en disco, aunque el backend sea S3).
+    """
+    path = os.path.join(current_app.root_path, 'uploads', 'temp')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _register_blob(key, sha256, size):
+    """
+    Obtiene o crea la fila Blob y suma una referencia.
+
+    La fila se bloquea hasta el commit, igual que en release_reference: si no,
+    una liberación simultánea podría borrarla entre la consulta y el incremento
+    y la columna quedaría apuntando a un blob sin fila (que luego se trataría
+    como una ruta antigua y se borraría aunque otra fila lo use).
+    """
+    blob = Blob.query.filter_by(storage_key=key).with_for_update().populate_existing().first()
+    if blob is None:
+        # Si otra petición crea el mismo blob a la vez, la restricción única de
+        # storage_key hace fallar este commit y el cliente puede reintentar
+        blob = Blob(sha256=sha256, storage_key=key, size=size, ref_count=1)
+        db.session.add(blob)
+        db.session.flush()
+        # La fila pudo desaparecer por una liberación que acaba de confirmarse y que
+        # borra el archivo si no es más nuevo que ella: renovar la fecha lo conserva
+        # (y si ya se borró, falla aquí en lugar de guardar una clave sin archivo)
+        get_storage().touch(key)
+    else:
+        blob.ref_count = (blob.ref_count or 0) + 1
+    return key
+
+
+def store_ingested(ingested):
+    """
+    Pasa al almacén un archivo ya ingerido (utils.ingest) y toma una referencia,
+    reutilizando el hash, el tamaño y la extensión calculados en la ingesta.
+
+    Returns:
+        str: clave del blob (para guardar en la columna file_path)
+    """
+    try:
+        return store_path(ingested.path, ingested.extension, sha256=ingested.sha256, size=ingested.size)
+    finally:
+        ingested.discard()
+
+
+def store_upload(file_storage, allowed_types=DOCUMENT_TYPES, max_size=DEFAULT_MAX_SIZE):
+    """
+    Ingesta y guarda un archivo recibido (werkzeug FileStorage) en una sola pasada.
+
+    Raises:
+        IngestError: tipo no permitido o tamaño excedido
+
+    Returns:
+        str: clave del blob
+    """
+    return store_ingested(ingest_upload(file_storage, temp_dir(), allowed_types, max_size))
+
+
+def store_path(path, extension, sha256=None, size=None):
+    """
+    Mueve un archivo local al almacén y toma una referencia.
+    Si el blob ya existía, el archivo de origen se elimina.
+    """
+    if sha256 is None:
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as source:
+            for block in iter(lambda: source.read(COPY_BLOCK_SIZE), b''):
+                hasher.update(block)
+        sha256 = hasher.hexdigest()
+    if size is None:
+        size = os.path.getsize(path)
+
+    storage = get_storage()
+    key = blob_key(sha256, extension)
+    if storage.exists(key):
+        os.remove(path)
+        # Renovar la fecha para que un borrado pendiente de este mismo blob no lo elimine
+        storage.touch(key)
+    else:
+        storage.put_file(path, key)
+
+    return _register_blob(key, sha256, size)
+
+
+def check_uploaded_type(key, mime_type, allowed_types=DOCUMENT_TYPES):
+    """
+    Comprueba que el tipo detectado por contenido esté permitido y coincida con
+    la extensión de la clave (la que se usará al servir el archivo).
+
+    Raises:
+        IngestError: 415 si no coincide
+    """
+    extension = os.path.splitext(key)[1].lower().replace('.jpeg', '.jpg')
+    if mime_type not in allowed_types or EXTENSIONS.get(mime_type) != extension:
+        raise IngestError('Tipo de archivo no permitido', 415)
+
+
+def register_uploaded(key, user_id, allowed_types=DOCUMENT_TYPES, max_size=DIRECT_UPLOAD_MAX_SIZE):
+    """
+    Registra un archivo que el usuario subió directamente al almacenamiento con
+    la URL de /storage/presign-upload: aplica las mismas comprobaciones de tipo
+    (bytes mágicos) y tamaño que una subida normal, lo mueve a su clave de blob
+    y toma una referencia. El contenido coincide con el hash de la clave porque
+    la subida lo verifica (checksum firmado en S3, local_upload en disco).
+
+    Raises:
+        IngestError: tipo no permitido (415) o tamaño excedido (413)
+
+    Returns:
+        str: la clave del blob, o None si la clave no es una subida del usuario o no existe
+    """
+    match = STAGING_KEY_PATTERN.match(key or '')
+    if not match or int(match.group(1)) != int(user_id):
+        return None
+    sha256, extension = match.group(2), match.group(3)
+    storage = get_storage()
+    if not storage.exists(key):
+        return None
+    size = storage.size(key)
+    if size > max_size:
+        raise IngestError(f'El archivo supera el tamaño máximo de {max_size // (1024 * 1024)} MB', 413)
+    check_uploaded_type(key, sniff_mime_type(storage.read_head(key, 16)), allowed_types)
+
+    destination = blob_key(sha256, extension)
+    if storage.exists(destination):
+        storage.delete(key)
+        # Renovar la fecha para que un borrado pendiente de este mismo blob no lo elimine
+        storage.touch(destination)
+    else:
+        storage.move(key, destination)
+    return _register_blob(destination, sha256, size)
+
+
+def add_reference(key):
+    """
+    Suma una referencia a un blob existente (p. ej. al copiar una ruta a otra fila).
+    """
+    if not is_blob_key(key):
+        return False
+    return Blob.query.filter_by(storage_key=key).update(
+        {Blob.ref_count: Blob.ref_count + 1}, synchronize_session=False
+    ) > 0
+
+
+def release_reference(key):
+    """
+    Resta una referencia. Si llega a cero se elimina la fila y el archivo se
+    borra después del commit (nunca antes, por si la transacción se revierte).
+
+    Returns:
+        bool: False si la clave no pertenece al almacén (rutas antiguas con uuid)
+    """
+    if not is_blob_key(key):
+        return False
+
+    blob = Blob.query.filter_by(storage_key=key).with_for_update().populate_existing().first()
+    if blob is None:
+        return False
+
+    blob.ref_count = max((blob.ref_count or 0) - 1, 0)
+    if blob.ref_count == 0:
+        db.session.delete(blob)
+        pending = db.session.info.setdefault('blob_deletions', [])
+        pending.append((key, time.time()))
+    return True
+
+
+def release_or_remove(path):
+    """
+    Libera la referencia de un blob o, si la ruta es antigua (uuid), borra el archivo.
+    """
+    if not path:
+        return
+    if release_reference(path):
+        return
+    from utils.thumbnails import delete_thumbnails
+    try:
+        get_storage().delete(path)
+        delete_thumbnails(path)
+    except Exception as e:
+        print(f"Error al eliminar archivo {path}: {str(e)}")
+
+
+@event.listens_for(db.session, 'after_commit')
+def _delete_released_blobs(session):
+    pending = session.info.pop('blob_deletions', [])
+    if not pending:
+        return
+    from utils.thumbnails import delete_thumbnails
+    storage = get_storage()
+    for key, released_at in pending:
+        try:
+            # Si otra petición volvió a subir el mismo contenido después de liberarlo, conservarlo
+            if storage.exists(key) and storage.modified_time(key) <= released_at:
+                storage.delete(key)
+                delete_thumbnails(key)
+                print(f"Blob eliminado: {key}")
+        except Exception as e:
+            print(f"Error al eliminar blob {key}: {str(e)}")
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_released_blobs(session):
+    session.info.pop('blob_deletions', None)
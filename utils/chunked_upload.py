@@ -0,0 +1,150 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Tamaño de bloque para leer el cuerpo de la petición y escribir en disco
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# Estado SHA-256 incremental por subida, en memoria del proceso.
+# hashlib no permite serializar el estado, así que si el siguiente trozo llega
+# a otro worker el hash se recalcula leyendo el archivo al finalizar.
+# path -> (offset, hasher, último uso). El GC corre en otro proceso, así que cada
+# worker descarta por su cuenta los estados sin uso durante HASHER_IDLE_SECONDS
+# (las subidas abandonadas o las que terminaron en otro worker).
+HASHER_IDLE_SECONDS = 24 * 60 * 60
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+class OffsetMismatch(Exception):
+    pass
+
+
+class UploadBusy(Exception):
+    pass
+
+
+def temp_upload_path(root_path, upload_id):
+    """
+    Ruta del archivo parcial de una subida en curso.
+    """
+    return os.path.join(root_path, 'uploads', 'temp', f"{upload_id}.part")
+
+
+def part_offset(path):
+    """
+    Bytes de la subida que ya están en disco, o None si el archivo parcial no existe.
+    """
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def upload_lock(path):
+    """
+    Bloqueo exclusivo del archivo parcial, compartido por los workers, mientras
+    se escribe un trozo o se finaliza la subida. No espera: si otra petición lo
+    tiene lanza UploadBusy. Lanza FileNotFoundError si la subida ya no existe.
+    """
+    with open(path, 'rb') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadBusy()
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _remember_hasher(path, offset, hasher):
+    now = time.monotonic()
+    with _hashers_lock:
+        for stale_path in [key for key, cached in _hashers.items() if now - cached[2] > HASHER_IDLE_SECONDS]:
+            del _hashers[stale_path]
+        _hashers[path] = (offset, hasher, now)
+
+
+def create_upload_file(path):
+    """
+    Crea el archivo parcial vacío de una nueva subida.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    _remember_hasher(path, 0, hashlib.sha256())
+
+
+def append_chunk(path, offset, stream, max_bytes):
+    """
+    Escribe en disco el cuerpo de la petición a partir de `offset`, por bloques,
+    sin cargar el trozo completo en memoria. Llamar dentro de upload_lock para
+    que dos peticiones no escriban a la vez. Si la lectura falla a mitad (p. ej.
+    el cliente se desconecta) el archivo vuelve a `offset`, así el cliente puede
+    reintentar el mismo trozo.
+
+    Returns:
+        int: nuevo offset
+    """
+    size_on_disk = os.path.getsize(path)
+    if size_on_disk != offset:
+        raise OffsetMismatch(f"Offset esperado {size_on_disk}, recibido {offset}")
+
+    with _hashers_lock:
+        cached = _hashers.pop(path, None)
+    hasher = cached[1] if cached and cached[0] == offset else None
+
+    written = 0
+    with open(path, 'r+b') as part_file:
+        part_file.seek(offset)
+        try:
+            while written < max_bytes:
+                block = stream.read(min(STREAM_BLOCK_SIZE, max_bytes - written))
+                if not block:
+                    break
+                part_file.write(block)
+                if hasher is not None:
+                    hasher.update(block)
+                written += len(block)
+        except BaseException:
+            part_file.truncate(offset)
+            raise
+        # Descartar lo que sobre si el cliente envió más de lo declarado
+        part_file.truncate(offset + written)
+
+    new_offset = offset + written
+    if hasher is not None:
+        _remember_hasher(path, new_offset, hasher)
+    return new_offset
+
+
+def finalize_digest(path):
+    """
+    Devuelve el SHA-256 del archivo completo, usando el estado incremental si
+    este proceso recibió todos los trozos o releyendo el archivo por bloques si no.
+    """
+    total = os.path.getsize(path)
+    with _hashers_lock:
+        cached = _hashers.pop(path, None)
+    if cached and cached[0] == total:
+        return cached[1].hexdigest()
+
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as part_file:
+        for block in iter(lambda: part_file.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def discard_upload(path):
+    """
+    Elimina el archivo parcial y su estado de hash.
+    """
+    with _hashers_lock:
+        _hashers.pop(path, None)
+    if os.path.exists(path):
+        os.remove(path)
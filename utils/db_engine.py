@@ -0,0 +1,159 @@
+import os
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+from utils import metrics
+
+# Opciones del engine de SQLAlchemy para Postgres. Cada worker de gunicorn tiene
+# su propio pool y cada thread atiende una petición a la vez, así que el pool se
+# dimensiona con las mismas variables que gunicorn.conf.py, repartiendo entre
+# los workers las conexiones que admite la base (DB_MAX_CONNECTIONS).
+#
+# Con DB_PGBOUNCER=true la app se conecta a PgBouncer en modo transacción: no se
+# envían parámetros de arranque ni se deja estado en la sesión del servidor (que
+# otro cliente puede recibir en su siguiente transacción); el límite por sentencia
+# se fija con SET LOCAL al empezar cada transacción. psycopg2 no usa sentencias
+# preparadas en el servidor, así que no hay nada más que desactivar.
+
+
+def gunicorn_concurrency():
+    """
+    (workers, threads) con las mismas variables y valores por defecto que gunicorn.conf.py.
+    """
+    workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+    threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+    return max(workers, 1), max(threads, 1)
+
+
+def pool_sizing(workers, threads, max_connections, reserved_connections):
+    """
+    Conexiones por worker: una por thread, sin pasar de su parte del total
+    (descontando las reservadas para migraciones, manage.py y consolas).
+
+    Returns:
+        tuple: (pool_size, max_overflow)
+    """
+    per_worker = max(1, (max_connections - reserved_connections) // workers)
+    pool_size = min(threads, per_worker)
+    return pool_size, per_worker - pool_size
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool que registra cuánto espera cada checkout (métrica
+    db.pool.checkout_wait, incluye abrir la conexión si hace falta una nueva)
+    y cuántos agotan pool_timeout (db.pool.checkout_timeouts).
+    """
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.increment('db.pool.checkout_timeouts')
+            raise
+        finally:
+            metrics.observe('db.pool.checkout_wait', time.monotonic() - start)
+
+
+def _is_postgres(database_uri):
+    return bool(database_uri) and database_uri.startswith('postgresql')
+
+
+def engine_options(config):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS a partir de la configuración DB_* de la app. Para
+    SQLite (desarrollo) se dejan las opciones por defecto de Flask-SQLAlchemy.
+    """
+    if not _is_postgres(config.get('SQLALCHEMY_DATABASE_URI')):
+        return {}
+
+    workers, threads = gunicorn_concurrency()
+    pool_size, max_overflow = pool_sizing(
+        workers, threads, config['DB_MAX_CONNECTIONS'], config['DB_RESERVED_CONNECTIONS']
+    )
+    if config.get('DB_POOL_SIZE') is not None:
+        pool_size = config['DB_POOL_SIZE']
+    if config.get('DB_MAX_OVERFLOW') is not None:
+        max_overflow = config['DB_MAX_OVERFLOW']
+
+    connect_args = {'connect_timeout': config['DB_CONNECT_TIMEOUT']}
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout and not config['DB_PGBOUNCER']:
+        # Directo a Postgres: el límite queda fijado al abrir la conexión, sin coste por petición
+        connect_args['options'] = f'-c statement_timeout={int(timeout)}'
+
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+        'connect_args': connect_args,
+    }
+
+
+def register_engine_events(engine, config):
+    """
+    Límite por sentencia al empezar cada transacción. Sin PgBouncer el límite por
+    defecto ya viene de la conexión; aquí solo se aplica cuando una conexión lo
+    pide con execution_options(statement_timeout_ms=...).
+    """
+    if engine.dialect.name != 'postgresql':
+        return
+
+    default_timeout = config['DB_STATEMENT_TIMEOUT_MS'] if config['DB_PGBOUNCER'] else None
+
+    @event.listens_for(engine, 'begin')
+    def _set_statement_timeout(conn):
+        timeout = conn.get_execution_options().get('statement_timeout_ms', default_timeout)
+        if timeout is not None:
+            conn.exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout)}')
+
+
+def init_engine(app, db):
+    """
+    Registra los eventos del engine. Debe llamarse dentro del contexto de la app.
+    """
+    if not _is_postgres(app.config.get('SQLALCHEMY_DATABASE_URI')):
+        return
+
+    register_engine_events(db.engine, app.config)
+
+    workers, threads = gunicorn_concurrency()
+    options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    print(f"Pool de base de datos por worker: pool_size={options['pool_size']}, "
+          f"max_overflow={options['max_overflow']} ({workers} workers x {threads} threads, "
+          f"pgbouncer={app.config['DB_PGBOUNCER']})")
+
+
+def without_statement_timeout(connection, pgbouncer):
+    """
+    Devuelve la conexión sin límite de tiempo por sentencia, para migraciones y
+    tareas de mantenimiento que pueden tardar más que una petición.
+    """
+    if connection.dialect.name != 'postgresql':
+        return connection
+    if pgbouncer:
+        # En modo transacción no se puede cambiar la sesión: SET LOCAL en cada transacción
+        return connection.execution_options(statement_timeout_ms=0)
+    with connection.begin():
+        connection.exec_driver_sql('SET statement_timeout = 0')
+    return connection
+
+
+def pool_status(engine):
+    """
+    Estado del pool del worker actual (vacío si el pool no es un QueuePool).
+    """
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'timeout': pool.timeout(),
+    }
@@ -0,0 +1,225 @@
+import os
+import random
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.sql.dml import UpdateBase
+from utils import metrics
+from utils.db_engine import engine_options, register_engine_events
+
+# Réplicas de lectura (DATABASE_REPLICA_URLS). Solo las rutas GET marcadas con
+# @replica_read leen de una réplica; todo lo demás, y cualquier escritura, va al
+# primario. Reglas:
+# - Una réplica con más retraso que REPLICA_MAX_LAG_SECONDS (o que no responde)
+#   no se usa; el retraso se mide como mucho cada REPLICA_LAG_CHECK_SECONDS por worker.
+# - Read-your-writes: quien escribió en los últimos READ_YOUR_WRITES_SECONDS lee
+#   del primario. La marca es un archivo por usuario en READ_YOUR_WRITES_DIR,
+#   compartido por los workers de gunicorn.
+# - Dentro de una petición, tras la primera escritura todo va al primario.
+REPLICA_METHODS = ('GET', 'HEAD')
+
+_WRITES_KEY = 'db_routing_wrote'
+_lock = threading.Lock()
+
+# Retraso de la réplica en segundos (0 si no está en recuperación o ya aplicó todo lo recibido)
+PG_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+
+class RoutingSession(SignallingSession):
+    """
+    Sesión que envía las lecturas de las rutas marcadas a una réplica.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if isinstance(clause, UpdateBase):
+            # INSERT/UPDATE/DELETE ejecutados directamente (sin flush)
+            _track_write(self)
+        elif not self._flushing and not self.info.get(_WRITES_KEY) and _replica_allowed():
+            engine = _request_replica()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_read(fn):
+    """
+    Decorador para rutas GET de solo lectura: sus consultas pueden ir a una réplica.
+    Va debajo de jwt_required/doctor_required para conocer al usuario.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        g._db_replica_read = True
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def _replica_allowed():
+    return has_request_context() and g.get('_db_replica_read', False) and request.method in REPLICA_METHODS
+
+
+def _request_replica():
+    # La misma réplica para toda la petición, así las lecturas son coherentes entre sí
+    if '_db_replica' not in g:
+        g._db_replica = _choose_replica(current_app)
+    return g._db_replica
+
+
+def _choose_replica(app):
+    replicas = app.extensions.get('db_replicas')
+    if not replicas:
+        return None
+    if _wrote_recently(app):
+        metrics.increment('db.replica.read_your_writes')
+        return None
+    candidates = [replica for replica in replicas if _replica_usable(app, replica)]
+    if not candidates:
+        metrics.increment('db.replica.fallback')
+        return None
+    metrics.increment('db.replica.reads')
+    return random.choice(candidates)['engine']
+
+
+def _display_url(engine):
+    return engine.url.render_as_string(hide_password=True)
+
+
+def measure_lag(engine):
+    """
+    Retraso de la réplica en segundos, o None si no se pudo consultar. Fuera de
+    Postgres (p. ej. dos SQLite para pruebas locales) no hay replicación que medir.
+    """
+    try:
+        with engine.connect() as connection:
+            if engine.dialect.name != 'postgresql':
+                return 0.0
+            return float(connection.exec_driver_sql(PG_LAG_SQL).scalar() or 0.0)
+    except Exception as e:
+        print(f"Réplica no disponible ({_display_url(engine)}): {str(e)}")
+        return None
+
+
+def _replica_usable(app, replica):
+    now = time.monotonic()
+    with _lock:
+        stale = now - replica['checked_at'] >= app.config['REPLICA_LAG_CHECK_SECONDS']
+        if stale:
+            # Los demás threads siguen con el último valor mientras este lo mide
+            replica['checked_at'] = now
+    if stale:
+        lag = measure_lag(replica['engine'])
+        with _lock:
+            replica['lag'] = lag
+    lag = replica['lag']
+    return lag is not None and lag <= app.config['REPLICA_MAX_LAG_SECONDS']
+
+
+def _current_identity():
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        # Ruta sin JWT verificado
+        return None
+
+
+def _write_marker_path(app, user_id):
+    return os.path.join(app.config['READ_YOUR_WRITES_DIR'], str(int(user_id)))
+
+
+def _wrote_recently(app):
+    user_id = _current_identity()
+    if user_id is None:
+        return False
+    try:
+        written_at = os.stat(_write_marker_path(app, user_id)).st_mtime
+    except OSError:
+        return False
+    return time.time() - written_at < app.config['READ_YOUR_WRITES_SECONDS']
+
+
+def _mark_write(app, user_id):
+    path = _write_marker_path(app, user_id)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a'):
+            os.utime(path, None)
+    except OSError as e:
+        print(f"No se pudo registrar la escritura del usuario {user_id}: {str(e)}")
+
+
+def _track_write(session):
+    session.info[_WRITES_KEY] = True
+    if has_request_context():
+        # El resto de la petición lee del primario
+        g._db_replica = None
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _track_flush_writes(session, flush_context):
+    if session.new or session.dirty or session.deleted:
+        _track_write(session)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _remember_writer(session):
+    if not session.info.pop(_WRITES_KEY, False) or not has_request_context():
+        return
+    if not current_app.extensions.get('db_replicas'):
+        return
+    user_id = _current_identity()
+    if user_id is not None:
+        _mark_write(current_app, user_id)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_writes(session):
+    session.info.pop(_WRITES_KEY, None)
+
+
+def init_replicas(app):
+    """
+    Crea los engines de las réplicas configuradas, con las mismas opciones de
+    pool y límites que el primario.
+    """
+    replicas = []
+    for url in app.config['DATABASE_REPLICA_URLS']:
+        engine = create_engine(url, **engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI=url)))
+        register_engine_events(engine, app.config)
+        replicas.append({'engine': engine, 'checked_at': float('-inf'), 'lag': None})
+        print(f"Réplica de lectura configurada: {_display_url(engine)}")
+    app.extensions['db_replicas'] = replicas
+
+
+def replica_status(app, refresh=False):
+    """
+    Returns:
+        list: [{'url', 'lag', 'usable'}] por réplica (lag None = no responde)
+    """
+    status = []
+    for replica in app.extensions.get('db_replicas', []):
+        if refresh:
+            with _lock:
+                replica['checked_at'] = time.monotonic()
+            replica['lag'] = measure_lag(replica['engine'])
+        lag = replica['lag']
+        status.append({
+            'url': _display_url(replica['engine']),
+            'lag': lag,
+            'usable': lag is not None and lag <= app.config['REPLICA_MAX_LAG_SECONDS'],
+        })
+    return status
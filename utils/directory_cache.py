@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from flask import current_app
+from sqlalchemy import event, inspect
+from models import db, Doctor, User, DoctorReview
+from utils import metrics
+
+# Caché del directorio público de médicos. Las respuestas serializadas se guardan
+# en disco, compartidas por los workers de gunicorn, bajo una versión que se
+# renueva después de cada commit que modifica médicos, sus usuarios o sus reseñas.
+# El TTL acota cuánto puede durar una entrada si otra instancia escribió los cambios.
+DIRECTORY_CACHE_TTL = int(os.environ.get('DIRECTORY_CACHE_TTL', '300'))
+
+# Campos de User que aparecen en el directorio; cambios en otros (p. ej. la contraseña) no invalidan
+DIRECTORY_USER_FIELDS = ('first_name', 'last_name', 'email', 'is_doctor', 'profile_picture')
+
+VERSION_FILE = 'version'
+
+# Copia en memoria del worker para no leer el disco en cada petición
+MEMORY_ENTRIES = 256
+_memory = {}
+_memory_lock = threading.Lock()
+
+
+def _cache_dir():
+    return current_app.config['DIRECTORY_CACHE_DIR']
+
+
+def current_version():
+    try:
+        with open(os.path.join(_cache_dir(), VERSION_FILE)) as version_file:
+            return version_file.read().strip() or '0'
+    except FileNotFoundError:
+        return '0'
+
+
+def bump_version():
+    """
+    Invalida todas las entradas: las siguientes peticiones usan una versión nueva
+    y los directorios de versiones anteriores se eliminan.
+    """
+    directory = _cache_dir()
+    os.makedirs(directory, exist_ok=True)
+    version = uuid.uuid4().hex
+    temp_path = os.path.join(directory, f"{VERSION_FILE}.{version}.tmp")
+    with open(temp_path, 'w') as version_file:
+        version_file.write(version)
+    os.replace(temp_path, os.path.join(directory, VERSION_FILE))
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False) and entry.name != version:
+                shutil.rmtree(entry.path, ignore_errors=True)
+    with _memory_lock:
+        _memory.clear()
+    metrics.increment('directory_cache.invalidated')
+    return version
+
+
+def _entry_path(version, key):
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return os.path.join(_cache_dir(), version, f"{digest}.json")
+
+
+def get(key, version):
+    """
+    Devuelve (etag, body) de la respuesta cacheada para `key` en `version`, o None.
+    """
+    now = time.time()
+    with _memory_lock:
+        cached = _memory.get((version, key))
+    if cached and now - cached[0] < DIRECTORY_CACHE_TTL:
+        metrics.increment('directory_cache.hit')
+        return cached[1], cached[2]
+
+    path = _entry_path(version, key)
+    try:
+        stored_at = os.path.getmtime(path)
+        if now - stored_at < DIRECTORY_CACHE_TTL:
+            with open(path) as entry_file:
+                entry = json.load(entry_file)
+            _remember(version, key, stored_at, entry['etag'], entry['body'])
+            metrics.increment('directory_cache.hit')
+            return entry['etag'], entry['body']
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    metrics.increment('directory_cache.miss')
+    return None
+
+
+def put(key, body, version):
+    """
+    Guarda la respuesta serializada (JSON) de `key` y devuelve (etag, body).
+
+    `version` es la que se leyó antes de consultar la base de datos: si cambió
+    mientras tanto, la respuesta puede ser anterior al cambio y no se guarda.
+    """
+    etag = hashlib.sha256(f"{version}:{body}".encode('utf-8')).hexdigest()[:32]
+    if current_version() != version:
+        metrics.increment('directory_cache.stale_put')
+        return etag, body
+    path = _entry_path(version, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'w') as entry_file:
+            json.dump({'etag': etag, 'body': body}, entry_file)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    _remember(version, key, time.time(), etag, body)
+    return etag, body
+
+
+def _remember(version, key, stored_at, etag, body):
+    with _memory_lock:
+        if len(_memory) >= MEMORY_ENTRIES:
+            _memory.pop(next(iter(_memory)))
+        _memory[(version, key)] = (stored_at, etag, body)
+
+
+def _affects_directory(obj, added_or_deleted):
+    if isinstance(obj, (Doctor, DoctorReview)):
+        return True
+    if isinstance(obj, User):
+        if added_or_deleted:
+            return bool(obj.is_doctor)
+        state = inspect(obj)
+        return any(state.attrs[field].history.has_changes() for field in DIRECTORY_USER_FIELDS)
+    return False
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_directory_changes(session, flush_context):
+    # En after_flush las colecciones new/dirty/deleted y el historial aún reflejan este flush
+    if session.info.get('directory_changed'):
+        return
+    changed = (
+        any(_affects_directory(obj, True) for obj in list(session.new) + list(session.deleted))
+        or any(_affects_directory(obj, False) for obj in session.dirty)
+    )
+    if changed:
+        session.info['directory_changed'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_directory(session):
+    if not session.info.pop('directory_changed', False):
+        return
+    try:
+        bump_version()
+    except Exception as e:
+        print(f"Error al invalidar la caché del directorio: {str(e)}")
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_directory_changes(session):
+    session.info.pop('directory_changed', None)
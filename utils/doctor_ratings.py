@@ -0,0 +1,96 @@
+from sqlalchemy import func
+from sqlalchemy.orm.util import identity_key
+from models import db, Doctor, DoctorReview
+
+# Agregados de valoración guardados en `doctors` (cantidad, suma, media e
+# histograma de 1 a 5 estrellas). Se actualizan con un UPDATE atómico en la
+# misma transacción que la reseña, de modo que dos reseñas simultáneas no se
+# pisan y mostrar la valoración no requiere cargar las reseñas.
+RATING_VALUES = range(1, 6)
+
+
+def _histogram_column(rating):
+    return getattr(Doctor, f'rating_{rating}')
+
+
+def apply_rating_change(doctor_id, old_rating=None, new_rating=None):
+    """
+    Actualiza los agregados del médico por el alta (old_rating=None), el cambio
+    o la baja (new_rating=None) de una reseña. No hace commit.
+    """
+    count_delta = (new_rating is not None) - (old_rating is not None)
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+    if count_delta == 0 and sum_delta == 0:
+        return
+
+    # En un UPDATE las expresiones leen los valores anteriores de la fila
+    new_count = Doctor.rating_count + count_delta
+    new_sum = Doctor.rating_sum + sum_delta
+    values = {
+        Doctor.rating_count: new_count,
+        Doctor.rating_sum: new_sum,
+        Doctor.rating_average: func.coalesce(new_sum * 1.0 / func.nullif(new_count, 0), 0),
+    }
+    if old_rating is not None:
+        column = _histogram_column(old_rating)
+        values[column] = column - 1
+    if new_rating is not None:
+        column = _histogram_column(new_rating)
+        values[column] = values.get(column, column) + 1
+
+    Doctor.query.filter(Doctor.id == doctor_id).update(values, synchronize_session=False)
+    # El objeto Doctor cargado en la sesión debe releer los agregados
+    doctor = db.session.identity_map.get(identity_key(Doctor, doctor_id))
+    if doctor is not None:
+        db.session.expire(doctor, ['rating_count', 'rating_sum', 'rating_average'] +
+                          [f'rating_{rating}' for rating in RATING_VALUES])
+
+
+def rating_summary(doctor):
+    return {
+        'average_rating': round(doctor.get_average_rating(), 2),
+        'review_count': doctor.rating_count or 0,
+        'rating_histogram': doctor.get_rating_histogram(),
+    }
+
+
+def reconcile_ratings(batch_size=500, dry_run=False):
+    """
+    Recalcula los agregados desde doctor_reviews y corrige los médicos con desvíos.
+
+    Returns:
+        list: [(doctor_id, agregados guardados, agregados correctos)] de los médicos corregidos
+    """
+    drifted = []
+    last_id = 0
+    while True:
+        doctors = Doctor.query.filter(Doctor.id > last_id).order_by(Doctor.id).limit(batch_size).all()
+        if not doctors:
+            break
+        last_id = doctors[-1].id
+
+        histograms = {doctor.id: {rating: 0 for rating in RATING_VALUES} for doctor in doctors}
+        rows = db.session.query(DoctorReview.doctor_id, DoctorReview.rating, func.count(DoctorReview.id))\
+            .filter(DoctorReview.doctor_id.in_(list(histograms)))\
+            .group_by(DoctorReview.doctor_id, DoctorReview.rating)
+        for doctor_id, rating, count in rows:
+            if rating in histograms[doctor_id]:
+                histograms[doctor_id][rating] = count
+
+        for doctor in doctors:
+            histogram = histograms[doctor.id]
+            expected = {f'rating_{rating}': histogram[rating] for rating in RATING_VALUES}
+            expected['rating_count'] = sum(histogram.values())
+            expected['rating_sum'] = sum(rating * count for rating, count in histogram.items())
+            expected['rating_average'] = expected['rating_sum'] / expected['rating_count'] if expected['rating_count'] else 0
+            stored = {field: getattr(doctor, field) for field in expected}
+            if any(stored[field] != value for field, value in expected.items() if field != 'rating_average') \
+                    or abs((stored['rating_average'] or 0) - expected['rating_average']) > 1e-9:
+                drifted.append((doctor.id, stored, expected))
+                if not dry_run:
+                    for field, value in expected.items():
+                        setattr(doctor, field, value)
+        if not dry_run:
+            db.session.commit()
+        db.session.expire_all()
+    return drifted
@@ -0,0 +1,119 @@
+import mimetypes
+import os
+from flask import Response, abort, current_app, jsonify, request, send_file
+from werkzeug.security import safe_join
+from utils import metrics, image_derivatives
+from utils.blob_store import parse_blob_key
+from utils.storage import get_storage
+
+# Los archivos de uploads/ nunca cambian de contenido: los blobs se nombran por
+# su SHA-256 y las rutas antiguas por un uuid. Se pueden cachear "para siempre".
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def upload_etag(filename, path):
+    """
+    ETag fuerte de un archivo de uploads/: el hash del nombre si es un blob,
+    o tamaño y fecha de modificación para las rutas antiguas.
+    """
+    sha256 = parse_blob_key(filename)
+    if sha256:
+        return sha256
+    stat = os.stat(path)
+    return f"{stat.st_size:x}-{int(stat.st_mtime):x}"
+
+
+def _cache_headers(response, etag):
+    response.set_etag(etag)
+    # private: son estudios y fotos de usuarios, no deben quedar en cachés compartidas
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+def serve_upload(filename):
+    """
+    Sirve un archivo de uploads/ con ETag, Cache-Control inmutable,
+    If-None-Match (304) y rangos de bytes (206).
+
+    Con UPLOADS_SENDFILE=x-accel (nginx) o x-sendfile (Apache, lighttpd) solo
+    se responden las cabeceras y el proxy envía los bytes, sin ocupar el worker.
+    """
+    upload_root = current_app.config['UPLOAD_FOLDER']
+    path = safe_join(upload_root, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    etag = upload_etag(filename, path)
+
+    if request.if_none_match.contains(etag):
+        metrics.increment('uploads.not_modified')
+        return _cache_headers(Response(status=304), etag)
+
+    mode = current_app.config.get('UPLOADS_SENDFILE')
+    if mode in ('x-accel', 'x-sendfile'):
+        metrics.increment('uploads.offloaded')
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        response = Response(mimetype=mimetype)
+        if mode == 'x-accel':
+            # nginx resuelve la ubicación interna (location internal) y atiende Range por su cuenta
+            prefix = current_app.config.get('UPLOADS_ACCEL_PREFIX', '/protected-uploads/')
+            response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + filename
+        else:
+            response.headers['X-Sendfile'] = path
+        return _cache_headers(response, etag)
+
+    # Sin proxy: werkzeug resuelve Range/If-Range y envía el archivo por bloques
+    metrics.increment('uploads.served')
+    response = send_file(path, conditional=True, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+    return _cache_headers(response, etag)
+
+
+def serve_image_derivative(filename):
+    """
+    Sirve una versión redimensionada de una imagen de uploads/ (?w=&h=&fmt=).
+
+    El derivado se genera una vez, se guarda en una caché en disco con
+    expulsión LRU acotada por DERIVATIVE_CACHE_MAX_BYTES y se responde con
+    caché inmutable. Solo se aceptan los tamaños de ALLOWED_DIMENSIONS.
+    """
+    try:
+        width, height, fmt = image_derivatives.parse_derivative_args(request.args)
+    except image_derivatives.DerivativeError as e:
+        return jsonify({'error': str(e)}), 400
+    if not image_derivatives.is_resizable(filename):
+        return jsonify({'error': 'Solo se pueden redimensionar imágenes'}), 400
+
+    # Versión del original: el hash en los blobs, fecha y tamaño en las rutas antiguas
+    storage = get_storage()
+    source_version = parse_blob_key(filename)
+    if not source_version:
+        if safe_join(current_app.config['UPLOAD_FOLDER'], filename) is None or not storage.exists(filename):
+            abort(404)
+        source_version = f"{storage.size(filename):x}-{int(storage.modified_time(filename)):x}"
+
+    cache_key = image_derivatives.derivative_cache_key(filename, source_version, width, height, fmt)
+    if request.if_none_match.contains(cache_key):
+        metrics.increment('uploads.not_modified')
+        return _cache_headers(Response(status=304), cache_key)
+
+    cache_dir = current_app.config['DERIVATIVE_CACHE_DIR']
+    path = image_derivatives.cached_path(cache_dir, cache_key, fmt)
+    if not image_derivatives.lookup(path):
+        if not storage.exists(filename):
+            abort(404)
+        try:
+            with storage.local_copy(filename) as source_path:
+                image_derivatives.render(source_path, path, width, height, fmt)
+        except image_derivatives.RenderBusy:
+            response = jsonify({'error': 'Servidor ocupado, reintenta en unos segundos'})
+            response.headers['Retry-After'] = '2'
+            return response, 503
+        except image_derivatives.DerivativeError as e:
+            return jsonify({'error': str(e)}), e.status
+        image_derivatives.record_write(cache_dir, os.path.getsize(path), current_app.config['DERIVATIVE_CACHE_MAX_BYTES'])
+
+    response = send_file(path, conditional=True, etag=cache_key, max_age=IMMUTABLE_MAX_AGE)
+    return _cache_headers(response, cache_key)
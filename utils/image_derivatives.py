@@ -0,0 +1,213 @@
+import hashlib
+import os
+import threading
+import uuid
+from PIL import Image, ImageOps, UnidentifiedImageError
+from utils import metrics
+
+# Tamaños permitidos para /uploads/<ruta>?w=&h=&fmt=. Solo valores de esta lista,
+# para que no se pueda pedir un tamaño distinto en cada petición y agotar CPU y disco.
+ALLOWED_DIMENSIONS = {32, 48, 64, 96, 128, 160, 256, 320, 480, 640}
+ALLOWED_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG', 'jpg': 'JPEG', 'png': 'PNG'}
+SOURCE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp'}
+DERIVATIVE_QUALITY = 82
+
+# Imágenes de origen más grandes que esto no se redimensionan al vuelo
+MAX_SOURCE_PIXELS = 40 * 1000 * 1000
+
+# Redimensionados simultáneos por proceso; el resto espera hasta RENDER_WAIT_SECONDS
+MAX_CONCURRENT_RENDERS = int(os.environ.get('DERIVATIVE_MAX_CONCURRENT', '2'))
+RENDER_WAIT_SECONDS = 5
+_render_slots = threading.BoundedSemaphore(MAX_CONCURRENT_RENDERS)
+
+# La limpieza LRU recorre el directorio cuando se escribió un 5% del límite desde la última vez
+EVICTION_SCAN_FRACTION = 0.05
+EVICTION_TARGET_FRACTION = 0.9
+_eviction_lock = threading.Lock()
+_bytes_since_scan = None
+
+
+class DerivativeError(Exception):
+    """Derivado rechazado; `status` es el código HTTP sugerido."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class RenderBusy(Exception):
+    pass
+
+
+def parse_derivative_args(args):
+    """
+    Valida w, h y fmt de la query string.
+
+    Returns:
+        tuple: (width o None, height o None, fmt)
+    """
+    def dimension(name):
+        value = args.get(name)
+        if value in (None, ''):
+            return None
+        if not value.isdigit() or int(value) not in ALLOWED_DIMENSIONS:
+            raise DerivativeError(f"'{name}' debe ser uno de {sorted(ALLOWED_DIMENSIONS)}")
+        return int(value)
+
+    width = dimension('w')
+    height = dimension('h')
+    fmt = (args.get('fmt') or 'webp').lower()
+    if fmt not in ALLOWED_FORMATS:
+        raise DerivativeError(f"'fmt' debe ser uno de {sorted(ALLOWED_FORMATS)}")
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if width is None and height is None:
+        raise DerivativeError("Se requiere 'w' o 'h'")
+    return width, height, fmt
+
+
+def is_resizable(filename):
+    return os.path.splitext(filename)[1].lower() in SOURCE_EXTENSIONS
+
+
+def derivative_cache_key(filename, source_version, width, height, fmt):
+    """
+    Clave del derivado: cambia si cambia el original (source_version) o los parámetros.
+    """
+    raw = f"{filename}:{source_version}:{width or 0}x{height or 0}:{fmt}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def cached_path(cache_dir, cache_key, fmt):
+    extension = 'jpg' if fmt == 'jpeg' else fmt
+    return os.path.join(cache_dir, cache_key[:2], f"{cache_key}.{extension}")
+
+
+def lookup(path):
+    """
+    Devuelve True si el derivado está en caché y renueva su fecha (orden LRU).
+    """
+    try:
+        os.utime(path, None)
+    except FileNotFoundError:
+        metrics.increment('derivatives.cache_miss')
+        return False
+    metrics.increment('derivatives.cache_hit')
+    return True
+
+
+def _resize(source_path, width, height, fmt):
+    """
+    Abre el original y devuelve la imagen redimensionada, ya decodificada.
+    """
+    with Image.open(source_path) as img:
+        if img.width * img.height > MAX_SOURCE_PIXELS:
+            raise DerivativeError('La imagen original es demasiado grande para redimensionarla', 413)
+
+        # Tamaño final: ambos lados recorta al centro; uno solo mantiene la proporción
+        if width and height:
+            box = (width, height)
+        elif width:
+            box = (width, max(1, round(img.height * width / img.width)))
+        else:
+            box = (max(1, round(img.width * height / img.height)), height)
+
+        img.draft('RGB', box)
+        img = ImageOps.exif_transpose(img)
+        if width and height:
+            img = ImageOps.fit(img, box, Image.LANCZOS)
+        else:
+            img.thumbnail(box, Image.LANCZOS)
+
+        if fmt == 'jpeg' or img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGB' if fmt == 'jpeg' or 'A' not in img.getbands() else 'RGBA')
+        img.load()
+        return img
+
+
+def render(source_path, destination, width, height, fmt):
+    """
+    Redimensiona el original y escribe el derivado de forma atómica.
+    Lanza RenderBusy si ya hay MAX_CONCURRENT_RENDERS redimensionados en curso y
+    DerivativeError si el original es demasiado grande (413), no es una imagen
+    (415) o está dañado o truncado (422).
+    """
+    if not _render_slots.acquire(timeout=RENDER_WAIT_SECONDS):
+        metrics.increment('derivatives.busy')
+        raise RenderBusy()
+    try:
+        with metrics.timed('derivatives.render'):
+            try:
+                img = _resize(source_path, width, height, fmt)
+            except UnidentifiedImageError:
+                metrics.increment('derivatives.invalid_source')
+                raise DerivativeError('El archivo original no es una imagen válida', 415)
+            except OSError as e:
+                # Pillow lanza OSError al decodificar archivos truncados o dañados
+                metrics.increment('derivatives.invalid_source')
+                print(f"No se pudo decodificar {source_path}: {str(e)}")
+                raise DerivativeError('La imagen original está dañada o incompleta', 422)
+
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            temp_path = f"{destination}.{uuid.uuid4().hex}.tmp"
+            try:
+                img.save(temp_path, ALLOWED_FORMATS[fmt], quality=DERIVATIVE_QUALITY, optimize=True)
+                os.replace(temp_path, destination)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        metrics.increment('derivatives.rendered')
+    finally:
+        _render_slots.release()
+
+
+def record_write(cache_dir, size, max_bytes):
+    """
+    Cuenta los bytes escritos y lanza la limpieza LRU cuando corresponde.
+    """
+    global _bytes_since_scan
+    with _eviction_lock:
+        if _bytes_since_scan is not None:
+            _bytes_since_scan += size
+            if _bytes_since_scan < max_bytes * EVICTION_SCAN_FRACTION:
+                return
+        _bytes_since_scan = 0
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir, max_bytes):
+    """
+    Elimina los derivados usados hace más tiempo hasta dejar la caché por debajo
+    del 90% del límite.
+
+    Returns:
+        int: bytes liberados
+    """
+    entries = []
+    total = 0
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    if total <= max_bytes:
+        return 0
+
+    freed = 0
+    target = max_bytes * EVICTION_TARGET_FRACTION
+    for _, size, path in sorted(entries):
+        if total - freed <= target:
+            break
+        try:
+            os.remove(path)
+            freed += size
+        except FileNotFoundError:
+            continue
+    metrics.increment('derivatives.evicted_bytes', freed)
+    print(f"Caché de derivados: {freed} bytes liberados")
+    return freed
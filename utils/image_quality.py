@@ -0,0 +1,121 @@
+import time
+import numpy as np
+from PIL import Image
+from utils import metrics
+
+# Lado máximo de la imagen usada para el análisis (se reduce para que tarde pocos ms)
+ANALYSIS_SIZE = 512
+
+# Resolución mínima (lado corto, en píxeles de la imagen original)
+MIN_SHORT_SIDE = 200
+WARN_SHORT_SIDE = 400
+
+# Varianza del Laplaciano sobre la imagen reducida: valores bajos = imagen borrosa
+BLUR_REJECT_THRESHOLD = 15.0
+BLUR_WARN_THRESHOLD = 60.0
+
+# Brillo medio (0-255) y fracción de píxeles saturados
+DARK_REJECT_MEAN = 30
+DARK_WARN_MEAN = 60
+BRIGHT_REJECT_MEAN = 235
+BRIGHT_WARN_MEAN = 210
+CLIPPED_REJECT_FRACTION = 0.6
+
+
+def _laplacian_variance(gray):
+    """
+    Calcula la varianza del Laplaciano (kernel de 4 vecinos) de una imagen en escala de grises.
+    """
+    center = gray[1:-1, 1:-1]
+    laplacian = (
+        gray[:-2, 1:-1] + gray[2:, 1:-1] +
+        gray[1:-1, :-2] + gray[1:-1, 2:] -
+        4 * center
+    )
+    return float(laplacian.var())
+
+
+def check_image_quality(file_path):
+    """
+    Evalúa localmente la calidad de una foto antes de enviarla al modelo de visión.
+
+    Returns:
+        dict: {'ok': bool, 'errors': [...], 'warnings': [...], 'metrics': {...}}
+        'ok' es False si la imagen debe rechazarse sin llamar al LLM.
+    """
+    start = time.monotonic()
+    errors = []
+    warnings = []
+
+    try:
+        with Image.open(file_path) as img:
+            width, height = img.size
+            # Para JPEG, draft() decodifica directamente a menor escala (mucho más rápido)
+            img.draft('L', (ANALYSIS_SIZE, ANALYSIS_SIZE))
+            gray_img = img.convert('L')
+            gray_img.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+            gray = np.asarray(gray_img, dtype=np.float32)
+    except Exception as e:
+        print(f"Error al abrir la imagen para el control de calidad: {str(e)}")
+        metrics.increment('image_quality.unreadable')
+        return {
+            'ok': False,
+            'errors': ['No se pudo leer la imagen. Verifica que el archivo sea una foto válida (JPG o PNG).'],
+            'warnings': [],
+            'metrics': {}
+        }
+
+    short_side = min(width, height)
+    blur_score = _laplacian_variance(gray) if gray.shape[0] > 2 and gray.shape[1] > 2 else 0.0
+    mean_brightness = float(gray.mean())
+    histogram, _ = np.histogram(gray, bins=256, range=(0, 256))
+    total_pixels = max(int(histogram.sum()), 1)
+    dark_fraction = float(histogram[:16].sum()) / total_pixels
+    bright_fraction = float(histogram[240:].sum()) / total_pixels
+
+    # Resolución
+    if short_side < MIN_SHORT_SIDE:
+        errors.append(f'La imagen es demasiado pequeña ({width}x{height}). Usa una foto de al menos {MIN_SHORT_SIDE}px en su lado más corto.')
+    elif short_side < WARN_SHORT_SIDE:
+        warnings.append('La imagen tiene baja resolución; el análisis puede ser menos preciso.')
+
+    # Nitidez
+    if blur_score < BLUR_REJECT_THRESHOLD:
+        errors.append('La imagen está muy borrosa. Mantén el teléfono quieto y enfoca el plato antes de tomar la foto.')
+    elif blur_score < BLUR_WARN_THRESHOLD:
+        warnings.append('La imagen está algo borrosa; una foto más nítida mejorará la estimación.')
+
+    # Exposición
+    if mean_brightness < DARK_REJECT_MEAN or dark_fraction > CLIPPED_REJECT_FRACTION:
+        errors.append('La imagen está demasiado oscura. Toma la foto con más luz o activa el flash.')
+    elif mean_brightness < DARK_WARN_MEAN:
+        warnings.append('La imagen está algo oscura; más iluminación mejorará el análisis.')
+
+    if mean_brightness > BRIGHT_REJECT_MEAN or bright_fraction > CLIPPED_REJECT_FRACTION:
+        errors.append('La imagen está sobreexpuesta. Evita la luz directa o el flash sobre el plato.')
+    elif mean_brightness > BRIGHT_WARN_MEAN:
+        warnings.append('La imagen está muy clara; reduce la luz directa para ver mejor los alimentos.')
+
+    elapsed_ms = (time.monotonic() - start) * 1000
+    metrics.observe('image_quality.check_time', elapsed_ms / 1000)
+    if errors:
+        metrics.increment('image_quality.rejected')
+    elif warnings:
+        metrics.increment('image_quality.warned')
+    else:
+        metrics.increment('image_quality.passed')
+
+    return {
+        'ok': not errors,
+        'errors': errors,
+        'warnings': warnings,
+        'metrics': {
+            'width': width,
+            'height': height,
+            'blur_score': round(blur_score, 2),
+            'mean_brightness': round(mean_brightness, 2),
+            'dark_fraction': round(dark_fraction, 4),
+            'bright_fraction': round(bright_fraction, 4),
+            'elapsed_ms': round(elapsed_ms, 2)
+        }
+    }
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import uuid
+from utils import metrics
+
+# Ingesta de subidas en una sola pasada: el cuerpo se copia a disco por bloques
+# mientras se calcula el SHA-256, se detecta el tipo real por los bytes mágicos
+# y se aplica el límite de tamaño. Los consumidores reciben estos metadatos y no
+# necesitan volver a leer el archivo para conocerlos.
+INGEST_BLOCK_SIZE = 64 * 1024
+
+# Tipos que aceptan las rutas de subida (detectados por contenido, no por el nombre)
+IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/webp'}
+DOCUMENT_TYPES = {'application/pdf'} | IMAGE_TYPES
+
+EXTENSIONS = {
+    'application/pdf': '.pdf',
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+}
+
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+
+
+class IngestError(Exception):
+    """Subida rechazada; `status` es el código HTTP sugerido (413 o 415)."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class IngestedFile:
+    """Archivo ya escrito en disco y sus metadatos."""
+
+    def __init__(self, path, filename, size, sha256, mime_type):
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.mime_type = mime_type
+
+    @property
+    def extension(self):
+        return EXTENSIONS.get(self.mime_type, '')
+
+    def discard(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def sniff_mime_type(head):
+    """
+    Detecta el tipo de archivo por sus primeros bytes.
+    """
+    if head.startswith(b'%PDF-'):
+        return 'application/pdf'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return None
+
+
+def sniff_file(path):
+    with open(path, 'rb') as source:
+        return sniff_mime_type(source.read(16))
+
+
+def ingest_stream(stream, filename, destination_dir, allowed_types=DOCUMENT_TYPES, max_size=DEFAULT_MAX_SIZE):
+    """
+    Copia un stream a destination_dir en una sola pasada.
+
+    Raises:
+        IngestError: si supera max_size (413) o el contenido no es de un tipo permitido (415)
+
+    Returns:
+        IngestedFile
+    """
+    os.makedirs(destination_dir, exist_ok=True)
+    path = os.path.join(destination_dir, f"{uuid.uuid4()}.ingest")
+    hasher = hashlib.sha256()
+    size = 0
+    mime_type = None
+    head = b''
+
+    try:
+        with metrics.timed('ingest.time'), open(path, 'wb') as destination:
+            for block in iter(lambda: stream.read(INGEST_BLOCK_SIZE), b''):
+                if mime_type is None and len(head) < 16:
+                    head += block[:16 - len(head)]
+                    if len(head) >= 16:
+                        mime_type = sniff_mime_type(head)
+                        if mime_type not in allowed_types:
+                            raise IngestError('Tipo de archivo no permitido', 415)
+                size += len(block)
+                if size > max_size:
+                    raise IngestError(f'El archivo supera el tamaño máximo de {max_size // (1024 * 1024)} MB', 413)
+                hasher.update(block)
+                destination.write(block)
+
+        if mime_type is None:
+            # Archivos de menos de 16 bytes
+            mime_type = sniff_mime_type(head)
+            if mime_type not in allowed_types:
+                raise IngestError('Tipo de archivo no permitido', 415)
+    except Exception:
+        metrics.increment('ingest.rejected')
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    metrics.increment('ingest.accepted')
+    return IngestedFile(path, filename, size, hasher.hexdigest(), mime_type)
+
+
+def ingest_upload(file_storage, destination_dir, allowed_types=DOCUMENT_TYPES, max_size=DEFAULT_MAX_SIZE):
+    """
+    Ingesta de un archivo recibido en multipart (werkzeug FileStorage).
+    """
+    return ingest_stream(file_storage.stream, file_storage.filename, destination_dir, allowed_types, max_size)
@@ -0,0 +1,135 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from models import db, LabResult, MedicalStudy
+from utils import metrics
+from utils.anthropic_utils import extract_lab_values_with_anthropic, extract_text_from_pdf
+
+# La extracción es otra llamada al modelo: se hace en un pool propio después de
+# responder el análisis, para no ocupar el thread de gunicorn que atiende la petición
+LAB_RESULTS_WORKERS = int(os.environ.get('LAB_RESULTS_WORKERS', '2'))
+_executor = ThreadPoolExecutor(max_workers=LAB_RESULTS_WORKERS, thread_name_prefix='lab-results')
+
+
+def normalize_analyte(name):
+    """
+    Normaliza el nombre de un analito para que las consultas por tendencia coincidan.
+    """
+    return ' '.join((name or '').strip().lower().split())[:100]
+
+
+def _to_float(value):
+    if value is None or value == '':
+        return None
+    try:
+        return float(str(value).replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def extract_lab_values(file_path, interpretation):
+    """
+    Pide al modelo los valores de laboratorio del estudio, usando el texto del PDF
+    original si está disponible y la interpretación. No toca la base de datos,
+    así que se puede llamar desde un hilo.
+
+    Returns:
+        dict: respuesta de extract_lab_values_with_anthropic ('success', 'results', 'study_date')
+    """
+    parts = []
+    if file_path and file_path.lower().endswith('.pdf'):
+        pdf_text = extract_text_from_pdf(file_path)
+        if pdf_text:
+            parts.append(pdf_text)
+    if interpretation:
+        parts.append(interpretation)
+    return extract_lab_values_with_anthropic('\n\n'.join(parts))
+
+
+def store_lab_results(study, extraction):
+    """
+    Reemplaza las filas de lab_results del estudio por las de `extraction`
+    (si la extracción falló no cambia nada). No hace commit.
+
+    Returns:
+        int: cantidad de resultados guardados, o None si la extracción falló
+    """
+    if not extraction.get('success'):
+        print(f"No se pudieron extraer valores de laboratorio del estudio {study.id}: {extraction.get('error')}")
+        return None
+
+    study_date = _parse_date(extraction.get('study_date'))
+    if not study_date:
+        study_date = study.created_at.date() if study.created_at else datetime.utcnow().date()
+
+    LabResult.query.filter_by(study_id=study.id).delete()
+
+    count = 0
+    for item in extraction.get('results', []):
+        analyte = normalize_analyte(item.get('analyte'))
+        value = _to_float(item.get('value'))
+        if not analyte or value is None:
+            continue
+        db.session.add(LabResult(
+            study_id=study.id,
+            patient_id=study.patient_id,
+            analyte=analyte,
+            value=value,
+            unit=(item.get('unit') or None) and str(item.get('unit'))[:30],
+            reference_low=_to_float(item.get('reference_low')),
+            reference_high=_to_float(item.get('reference_high')),
+            reference_range=(item.get('reference_range') or None) and str(item.get('reference_range'))[:100],
+            study_date=study_date
+        ))
+        count += 1
+
+    print(f"{count} valores de laboratorio extraídos del estudio {study.id}")
+    return count
+
+
+def extract_and_store_lab_results(study, file_path=None):
+    """
+    Extrae los valores de laboratorio de un estudio y reemplaza sus filas en lab_results.
+    No hace commit: el llamador decide cuándo confirmar la transacción.
+
+    Returns:
+        int: cantidad de resultados guardados, o None si la extracción falló
+    """
+    return store_lab_results(study, extract_lab_values(file_path, study.interpretation))
+
+
+def _run(app, study_id):
+    # Importado aquí: routes.medical_studies importa este módulo
+    from routes.medical_studies import study_local_file
+    with app.app_context():
+        try:
+            study = MedicalStudy.query.get(study_id)
+            if study is None:
+                return
+            with study_local_file(study) as file_path:
+                count = extract_and_store_lab_results(study, file_path)
+            db.session.commit()
+            if count is None:
+                metrics.increment('lab_results.failed')
+        except Exception as e:
+            db.session.rollback()
+            metrics.increment('lab_results.failed')
+            print(f"Error al extraer valores de laboratorio del estudio {study_id}: {str(e)}")
+
+
+def schedule_lab_results(study_id):
+    """
+    Encola la extracción de valores de laboratorio fuera del ciclo de la petición.
+    Llamar después del commit que guarda la interpretación.
+    """
+    _executor.submit(_run, current_app._get_current_object(), study_id)
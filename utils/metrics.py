@@ -0,0 +1,82 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Métricas en memoria del proceso (cada worker de gunicorn tiene las suyas)
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+
+# Cantidad máxima de muestras guardadas por métrica para calcular percentiles
+MAX_SAMPLES = 1000
+
+
+def increment(name, value=1):
+    """
+    Incrementa un contador con nombre.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, seconds):
+    """
+    Registra una duración (en segundos) para la métrica indicada.
+    """
+    with _lock:
+        timing = _timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0, 'samples': []})
+        timing['count'] += 1
+        timing['total'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+        samples = timing['samples']
+        if len(samples) >= MAX_SAMPLES:
+            samples.pop(0)
+        samples.append(seconds)
+
+
+@contextmanager
+def timed(name):
+    """
+    Mide el tiempo de ejecución del bloque y lo registra con observe().
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start)
+
+
+def _percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(pct / 100.0 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def snapshot():
+    """
+    Devuelve una copia serializable de todos los contadores y tiempos.
+    """
+    with _lock:
+        counters = dict(_counters)
+        timings = {}
+        for name, timing in _timings.items():
+            samples = sorted(timing['samples'])
+            timings[name] = {
+                'count': timing['count'],
+                'avg': timing['total'] / timing['count'] if timing['count'] else 0.0,
+                'max': timing['max'],
+                'p50': _percentile(samples, 50),
+                'p95': _percentile(samples, 95),
+                'p99': _percentile(samples, 99)
+            }
+    return {'counters': counters, 'timings': timings}
+
+
+def reset():
+    """
+    Limpia todas las métricas registradas.
+    """
+    with _lock:
+        _counters.clear()
+        _timings.clear()
@@ -0,0 +1,182 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, literal
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, NutritionLog, NutritionDailyTotal
+
+# Totales diarios de nutrición por usuario (nutrition_daily_totals). Cada alta en
+# nutrition_logs suma su entrada al día correspondiente con un upsert en la misma
+# transacción, así los resúmenes leen una fila por día en lugar de agregar el log.
+TOTAL_FIELDS = ('calories', 'proteins', 'carbs', 'fats', 'entry_count')
+
+GRANULARITIES = ('day', 'week', 'month')
+# Máximo de días por consulta de serie (dos años)
+MAX_SERIES_DAYS = 731
+
+
+def _entry_values(log_entry):
+    return {
+        'calories': int(round(log_entry.calories or 0)),
+        'proteins': float(log_entry.proteins or 0.0),
+        'carbs': float(log_entry.carbs or 0.0),
+        'fats': float(log_entry.fats or 0.0),
+        'entry_count': 1,
+    }
+
+
+def _apply(user_id, day, values):
+    table = NutritionDailyTotal.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        statement = insert(table).values(user_id=user_id, day=day, **values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.day],
+            set_={field: table.c[field] + statement.excluded[field] for field in TOTAL_FIELDS}
+        )
+        db.session.execute(statement)
+        return
+
+    # Otros motores: UPDATE y, si el día aún no existe, INSERT
+    updated = db.session.execute(
+        table.update()
+        .where(table.c.user_id == user_id, table.c.day == day)
+        .values({field: table.c[field] + values[field] for field in TOTAL_FIELDS})
+    )
+    if updated.rowcount == 0:
+        db.session.execute(table.insert().values(user_id=user_id, day=day, **values))
+
+
+def record_log_entry(log_entry):
+    """
+    Suma una entrada nueva de NutritionLog a los totales de su día. No hace commit.
+    """
+    _apply(int(log_entry.user_id), log_entry.log_date, _entry_values(log_entry))
+
+
+def daily_total(user_id, day):
+    """
+    Totales de un día (búsqueda por clave primaria), o None si no hay entradas.
+    """
+    return NutritionDailyTotal.query.get((int(user_id), day))
+
+
+def totals_between(user_id, start, end):
+    """
+    Filas diarias entre start y end (inclusive), ordenadas por día.
+    """
+    return NutritionDailyTotal.query.filter(
+        NutritionDailyTotal.user_id == int(user_id),
+        NutritionDailyTotal.day >= start,
+        NutritionDailyTotal.day <= end
+    ).order_by(NutritionDailyTotal.day).all()
+
+
+def _period_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())  # Semanas ISO, desde el lunes
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _next_period(start, granularity):
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def parse_series_args(args):
+    """
+    Lee from, to (YYYY-MM-DD) y granularity de la query string. Sin fechas
+    devuelve los últimos 30 días. Lanza ValueError con el mensaje para el cliente.
+
+    Returns:
+        tuple: (start, end, granularity)
+    """
+    try:
+        end = datetime.strptime(args['to'], '%Y-%m-%d').date() if args.get('to') else date.today()
+        start = datetime.strptime(args['from'], '%Y-%m-%d').date() if args.get('from') else end - timedelta(days=29)
+    except ValueError:
+        raise ValueError('Formato de fecha inválido. Usar YYYY-MM-DD')
+    granularity = args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"'granularity' debe ser uno de {list(GRANULARITIES)}")
+    if start > end:
+        raise ValueError("'from' debe ser anterior o igual a 'to'")
+    if (end - start).days + 1 > MAX_SERIES_DAYS:
+        raise ValueError(f'El rango máximo es de {MAX_SERIES_DAYS} días')
+    return start, end, granularity
+
+
+def summary_series(user_id, start, end, granularity='day'):
+    """
+    Serie densa de totales entre start y end (inclusive) agrupada por día, semana
+    o mes. Los periodos sin registros aparecen con ceros. Los periodos de los
+    extremos se recortan al rango pedido.
+    """
+    by_day = {row.day: row for row in totals_between(user_id, start, end)}
+
+    series = []
+    period = _period_start(start, granularity)
+    while period <= end:
+        period_end = min(_next_period(period, granularity) - timedelta(days=1), end)
+        point = {
+            'start': max(period, start).isoformat(),
+            'end': period_end.isoformat(),
+            'calories': 0,
+            'proteins': 0.0,
+            'carbs': 0.0,
+            'fats': 0.0,
+            'entry_count': 0,
+            'days_logged': 0,
+        }
+        day = max(period, start)
+        while day <= period_end:
+            row = by_day.get(day)
+            if row is not None:
+                for field in TOTAL_FIELDS:
+                    point[field] += getattr(row, field)
+                point['days_logged'] += 1
+            day += timedelta(days=1)
+        series.append(point)
+        period = _next_period(period, granularity)
+    return series
+
+
+def rebuild_daily_totals(user_ids=None, batch_size=500, log=print):
+    """
+    Recalcula los totales desde nutrition_logs, por lotes de usuarios.
+
+    Returns:
+        int: filas diarias escritas
+    """
+    table = NutritionDailyTotal.__table__
+    if user_ids is None:
+        user_ids = [user_id for (user_id,) in db.session.query(NutritionLog.user_id).distinct()
+                    .union(db.session.query(NutritionDailyTotal.user_id).distinct())]
+    user_ids = sorted(set(user_ids))
+
+    written = 0
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        db.session.execute(table.delete().where(table.c.user_id.in_(batch)))
+        aggregated = db.session.query(
+            NutritionLog.user_id,
+            NutritionLog.log_date,
+            func.coalesce(func.sum(NutritionLog.calories), 0),
+            func.coalesce(func.sum(NutritionLog.proteins), literal(0.0)),
+            func.coalesce(func.sum(NutritionLog.carbs), literal(0.0)),
+            func.coalesce(func.sum(NutritionLog.fats), literal(0.0)),
+            func.count(NutritionLog.id)
+        ).filter(NutritionLog.user_id.in_(batch)).group_by(NutritionLog.user_id, NutritionLog.log_date)
+        result = db.session.execute(table.insert().from_select(
+            ['user_id', 'day', 'calories', 'proteins', 'carbs', 'fats', 'entry_count'],
+            aggregated.statement
+        ))
+        db.session.commit()
+        written += max(result.rowcount or 0, 0)
+        log(f"Usuarios {batch[0]}-{batch[-1]}: totales recalculados")
+    return written
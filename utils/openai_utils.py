@@ -1,12 +1,14 @@
 import os
 import base64
 import json
-from openai import OpenAI # Importar el cliente oficial
+from openai import OpenAI, APITimeoutError # Importar el cliente oficial
 from dotenv import load_dotenv
 import fitz # PyMuPDF
 import mimetypes
 import traceback
 import re # Para extraer datos nutricionales
+import time
+from utils import metrics
 
 # Cargar variables de entorno
 load_dotenv()
@@ -24,6 +26,35 @@ except Exception as client_init_error:
     traceback.print_exc()
 
 
+# Presupuesto total (segundos) para el análisis de comida, incluyendo el reintento por rechazo
+FOOD_ANALYSIS_TIME_BUDGET = float(os.environ.get('OPENAI_FOOD_TIME_BUDGET', '45'))
+# No iniciar un intento si queda menos de este tiempo en el presupuesto
+FOOD_ANALYSIS_MIN_ATTEMPT_TIME = 5
+# Un análisis nutricional no necesita 8000 tokens; limitar la salida acota la latencia
+FOOD_ANALYSIS_MAX_TOKENS = 1500
+
+REFUSAL_MARKERS = ("no puedo ayudar con esa solicitud", "no puedo analizar")
+
+FOOD_SYSTEM_PROMPT = "Eres un asistente nutricional que analiza imágenes de alimentos para proporcionar información nutricional aproximada. Tu objetivo es ayudar a los usuarios a entender mejor el contenido nutricional de sus comidas."
+FOOD_USER_PROMPT = "Esta es una imagen de mi comida. Por favor, proporciona la siguiente información:\n1. Identificación de los alimentos visibles\n2. Estimación aproximada de calorías (si es posible)\n3. Estimación aproximada de macronutrientes: proteínas, carbohidratos y grasas (en gramos)\n4. Valoración general de la comida desde una perspectiva nutricional\n5. Sugerencias para mejorar el balance nutricional\n\nSi no puedes identificar claramente la comida, simplemente describe lo que ves e indica que no puedes proporcionar un análisis nutricional preciso."
+
+# Prompt alternativo que combina en una sola llamada la descripción de los
+# alimentos y la estimación nutricional (antes eran dos llamadas separadas)
+FOOD_FALLBACK_SYSTEM_PROMPT = "Eres un nutricionista que describe imágenes de alimentos y proporciona información nutricional aproximada basada en lo que se ve."
+FOOD_FALLBACK_USER_PROMPT = "Describe los alimentos e ingredientes visibles en esta imagen y, a partir de esa descripción, proporciona un análisis nutricional aproximado. Usa este formato:\n\n# Análisis Nutricional\n\n## Alimentos Identificados\n(descripción de los alimentos)\n\n## Información Nutricional\n1. Calorías estimadas\n2. Proteínas (g)\n3. Carbohidratos (g)\n4. Grasas (g)\n5. Valoración nutricional general\n6. Sugerencias para mejorar"
+
+FOOD_ANALYSIS_ERROR_TEXT = """
+        # Análisis Nutricional
+        ## Error
+        No se pudo analizar la imagen debido a un error interno con el cliente OpenAI. Por favor, inténtelo de nuevo más tarde.
+        ## Información Nutricional
+        - Calorías: No disponible
+        - Proteínas: No disponible
+        - Carbohidratos: No disponible
+        - Grasas: No disponible
+        """
+
+
 # --- Funciones Principales (Restauradas para usar el cliente OpenAI) ---
 
 def analyze_medical_study(file_path, study_type):
@@ -103,86 +134,85 @@ def analyze_medical_study(file_path, study_type):
             "provider": "openai"
         }
 
+def _is_refusal(analysis):
+    """
+    Detecta si la respuesta del modelo es un rechazo de la solicitud.
+    """
+    if not analysis:
+        return True
+    lowered = analysis.lower()
+    return any(marker in lowered for marker in REFUSAL_MARKERS)
+
+def _food_messages(system_prompt, user_prompt, base64_image):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": [
+            {"type": "text", "text": user_prompt},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+        ]}
+    ]
+
 def analyze_food_image_from_base64(base64_image):
     """
     Analiza una imagen de comida en base64 usando el cliente OpenAI.
+
+    Hace como máximo dos llamadas (prompt principal y, si hay rechazo, un
+    reintento con un prompt combinado de descripción + estimación) y todas
+    comparten un presupuesto total de FOOD_ANALYSIS_TIME_BUDGET segundos.
     """
     if not client:
+        metrics.increment('openai_food.client_missing')
         return "Error: Cliente OpenAI no inicializado."
 
-    try:
-        # Modificar el prompt para ser más específico y evitar rechazos
-        messages = [
-            {"role": "system", "content": "Eres un asistente nutricional que analiza imágenes de alimentos para proporcionar información nutricional aproximada. Tu objetivo es ayudar a los usuarios a entender mejor el contenido nutricional de sus comidas."},
-            {"role": "user", "content": [
-                {"type": "text", "text": "Esta es una imagen de mi comida. Por favor, proporciona la siguiente información:\n1. Identificación de los alimentos visibles\n2. Estimación aproximada de calorías (si es posible)\n3. Estimación aproximada de macronutrientes: proteínas, carbohidratos y grasas (en gramos)\n4. Valoración general de la comida desde una perspectiva nutricional\n5. Sugerencias para mejorar el balance nutricional\n\nSi no puedes identificar claramente la comida, simplemente describe lo que ves e indica que no puedes proporcionar un análisis nutricional preciso."},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-            ]}
-        ]
-
-        print("Llamando a OpenAI API para análisis de comida (base64)...")
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.3,  # Reducir la temperatura para respuestas más consistentes
-            max_tokens=8000
-        )
-        print("Respuesta recibida de OpenAI.")
-        analysis = response.choices[0].message.content
-        
-        # Verificar si la respuesta contiene un rechazo
-        if "no puedo ayudar con esa solicitud" in analysis.lower() or "no puedo analizar" in analysis.lower():
-            print("OpenAI rechazó la solicitud. Intentando con un prompt alternativo...")
-            
-            # Intentar con un prompt alternativo más simple
-            alt_messages = [
-                {"role": "system", "content": "Eres un asistente que describe imágenes de alimentos."},
-                {"role": "user", "content": [
-                    {"type": "text", "text": "¿Qué alimentos ves en esta imagen? Por favor, describe los ingredientes visibles."},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                ]}
-            ]
-            
-            alt_response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=alt_messages,
-                temperature=0.3,
-                max_tokens=8000
-            )
-            
-            food_description = alt_response.choices[0].message.content
-            
-            # Usar la descripción para generar un análisis nutricional
-            nutrition_messages = [
-                {"role": "system", "content": "Eres un nutricionista que proporciona información nutricional aproximada basada en descripciones de alimentos."},
-                {"role": "user", "content": f"Basado en esta descripción de alimentos: '{food_description}', proporciona un análisis nutricional aproximado incluyendo:\n1. Calorías estimadas\n2. Proteínas (g)\n3. Carbohidratos (g)\n4. Grasas (g)\n5. Valoración nutricional general\n6. Sugerencias para mejorar"}
-            ]
-            
-            nutrition_response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=nutrition_messages,
-                temperature=0.3,
-                max_tokens=8000
-            )
-            
-            analysis = f"# Análisis Nutricional\n\n## Alimentos Identificados\n{food_description}\n\n## Información Nutricional\n{nutrition_response.choices[0].message.content}"
-            print("Análisis generado con enfoque alternativo.")
-        
-        return analysis
+    deadline = time.monotonic() + FOOD_ANALYSIS_TIME_BUDGET
+    attempts = [
+        ('primary', FOOD_SYSTEM_PROMPT, FOOD_USER_PROMPT),
+        ('fallback', FOOD_FALLBACK_SYSTEM_PROMPT, FOOD_FALLBACK_USER_PROMPT)
+    ]
 
+    try:
+        with metrics.timed('openai_food.latency'):
+            analysis = None
+            for branch, system_prompt, user_prompt in attempts:
+                remaining = deadline - time.monotonic()
+                if remaining < FOOD_ANALYSIS_MIN_ATTEMPT_TIME:
+                    print(f"Presupuesto de tiempo agotado antes del intento '{branch}'.")
+                    metrics.increment('openai_food.budget_exhausted')
+                    break
+
+                print(f"Llamando a OpenAI API para análisis de comida (intento '{branch}', timeout {remaining:.1f}s)...")
+                metrics.increment(f'openai_food.{branch}_call')
+                # Sin reintentos internos del cliente: el presupuesto total lo controlamos aquí
+                response = client.with_options(timeout=remaining, max_retries=0).chat.completions.create(
+                    model="gpt-4o",
+                    messages=_food_messages(system_prompt, user_prompt, base64_image),
+                    temperature=0.3,  # Reducir la temperatura para respuestas más consistentes
+                    max_tokens=FOOD_ANALYSIS_MAX_TOKENS
+                )
+                print("Respuesta recibida de OpenAI.")
+                analysis = response.choices[0].message.content
+
+                if not _is_refusal(analysis):
+                    metrics.increment(f'openai_food.{branch}_ok')
+                    return analysis
+
+                print(f"OpenAI rechazó la solicitud (intento '{branch}').")
+                metrics.increment(f'openai_food.{branch}_refused')
+
+        if analysis:
+            # Devolver el último texto recibido aunque sea un rechazo
+            return analysis
+        return FOOD_ANALYSIS_ERROR_TEXT
+
+    except APITimeoutError:
+        metrics.increment('openai_food.timeout')
+        print(f"Tiempo agotado en analyze_food_image_from_base64 (presupuesto {FOOD_ANALYSIS_TIME_BUDGET}s)")
+        return FOOD_ANALYSIS_ERROR_TEXT
     except Exception as e:
+        metrics.increment('openai_food.error')
         print(f"Error en analyze_food_image_from_base64 (OpenAI Client): {str(e)}")
         traceback.print_exc()
-        return """
-        # Análisis Nutricional
-        ## Error
-        No se pudo analizar la imagen debido a un error interno con el cliente OpenAI. Por favor, inténtelo de nuevo más tarde.
-        ## Información Nutricional
-        - Calorías: No disponible
-        - Proteínas: No disponible
-        - Carbohidratos: No disponible
-        - Grasas: No disponible
-        """
+        return FOOD_ANALYSIS_ERROR_TEXT
 
 def analyze_food_image(file_path):
     """
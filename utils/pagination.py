@@ -0,0 +1,149 @@
+import base64
+import json
+from datetime import date, datetime
+from sqlalchemy import and_, or_
+from models import db
+
+# Paginación por cursor (keyset) compartida por los listados. El cursor es opaco
+# para el cliente: los valores de la clave de orden del último elemento de la
+# página, en JSON y base64. Cada página filtra "después del cursor" sobre un
+# índice, así el coste no depende de cuántas filas tenga el historial.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values):
+    raw = json.dumps([value.isoformat() if isinstance(value, date) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def _from_json(value, column):
+    if value is None:
+        raise ValueError('Cursor inválido')
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+
+def decode_cursor(cursor, order_by):
+    """
+    Devuelve los valores de la clave de orden (convertidos al tipo de cada
+    columna) del último elemento de la página anterior, o None.
+    Lanza ValueError si el cursor no es válido.
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if not isinstance(values, list) or len(values) != len(order_by):
+            raise ValueError('Cursor inválido')
+        return [_from_json(value, column) for value, column in zip(values, order_by)]
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError('Cursor inválido') from e
+
+
+def parse_limit(args, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """
+    Lee ?limit= (acotado a `maximum`). Lanza ValueError si no es un entero positivo.
+    """
+    try:
+        limit = int(args.get('limit', default))
+    except (TypeError, ValueError):
+        raise ValueError("'limit' debe ser un entero")
+    if limit < 1:
+        raise ValueError("'limit' debe ser mayor que 0")
+    return min(limit, maximum)
+
+
+def model_fields(model):
+    return list(model.__table__.columns.keys())
+
+
+def parse_fields(args, allowed):
+    """
+    Lee ?fields=a,b,c y devuelve los campos pedidos en orden, o todos los
+    permitidos si no se indica. Lanza ValueError con los campos desconocidos.
+    """
+    requested = [field.strip() for field in (args.get('fields') or '').split(',') if field.strip()]
+    if not requested:
+        return list(allowed)
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise ValueError(f"Campos desconocidos: {', '.join(unknown)}. Permitidos: {', '.join(allowed)}")
+    return list(dict.fromkeys(requested))
+
+
+def select_columns(model, fields, order_by=()):
+    """
+    Columnas a seleccionar: las de los campos pedidos más las de la clave de orden.
+    """
+    names = [field for field in fields if field in model.__table__.columns]
+    names += [column.key for column in order_by]
+    return [getattr(model, name) for name in dict.fromkeys(names)]
+
+
+def keyset_filter(order_by, values, descending=True):
+    """
+    Condición "después de `values`" para el orden dado, p. ej. para (fecha, id)
+    descendente: fecha < v0 OR (fecha = v0 AND id < v1).
+    """
+    clauses = []
+    for position, column in enumerate(order_by):
+        equal = [order_by[i] == values[i] for i in range(position)]
+        after = column < values[position] if descending else column > values[position]
+        clauses.append(and_(*equal, after))
+    return or_(*clauses)
+
+
+def keyset_page(query, order_by, cursor_values, limit, descending=True):
+    """
+    Aplica cursor, orden y límite a `query` (que debe seleccionar las columnas
+    de `order_by`).
+
+    Returns:
+        tuple: (filas de la página, cursor de la siguiente página o None)
+    """
+    if cursor_values is not None:
+        query = query.filter(keyset_filter(order_by, cursor_values, descending))
+    query = query.order_by(*[column.desc() if descending else column for column in order_by])
+    rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in order_by])
+    return rows, next_cursor
+
+
+def row_to_dict(row, fields):
+    """
+    Serializa una fila de columnas con el mismo formato que los to_dict de los modelos.
+    """
+    result = {}
+    for field in fields:
+        value = getattr(row, field)
+        result[field] = value.isoformat() if isinstance(value, date) else value
+    return result
+
+
+def paginate_model(model, filters, order_by, args, fields=None):
+    """
+    Listado paginado de `model` con ?limit=, ?cursor= y ?fields=, seleccionando
+    en SQL solo las columnas necesarias. Lanza ValueError si algún parámetro no
+    es válido.
+
+    Returns:
+        tuple: (filas, campos pedidos, cursor de la siguiente página o None)
+    """
+    limit = parse_limit(args)
+    fields = fields if fields is not None else parse_fields(args, model_fields(model))
+    cursor_values = decode_cursor(args.get('cursor'), order_by)
+    query = db.session.query(*select_columns(model, fields, order_by)).filter(*filters)
+    rows, next_cursor = keyset_page(query, order_by, cursor_values, limit)
+    return rows, fields, next_cursor
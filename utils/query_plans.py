@@ -0,0 +1,89 @@
+from datetime import date, timedelta
+from models import (
+    db, NutritionLog, WeightRecord, BloodPressure, PhysicalActivity, HealthProfile, Medication,
+    MedicalStudy, NutritionAnalysis, DoctorReview, Doctor
+)
+
+# Consultas de los endpoints más usados y el índice que deben usar. `manage.py
+# check-query-plans` ejecuta EXPLAIN sobre cada una contra la base configurada.
+HOT_QUERIES = [
+    ('nutrition/logs', 'nutrition_logs', 'ix_nutrition_logs_user_date_id',
+     lambda: NutritionLog.query.filter(
+         NutritionLog.user_id == 1,
+         NutritionLog.log_date >= date.today() - timedelta(days=30)
+     ).order_by(NutritionLog.log_date.desc())),
+    ('profile/weight', 'weight_records', 'ix_weight_records_user_date_id',
+     lambda: WeightRecord.query.filter_by(user_id=1).order_by(WeightRecord.date.desc()).limit(1)),
+    ('profile/blood-pressure', 'blood_pressure_records', 'ix_blood_pressure_records_user_measured_id',
+     lambda: BloodPressure.query.filter_by(user_id=1)
+         .order_by(BloodPressure.measured_at.desc(), BloodPressure.id.desc()).limit(51)),
+    ('profile/activities', 'physical_activities', 'ix_physical_activities_user_date_id',
+     lambda: PhysicalActivity.query.filter_by(user_id=1)
+         .order_by(PhysicalActivity.date.desc(), PhysicalActivity.id.desc()).limit(51)),
+    ('profile/medications', 'medications', 'ix_medications_user_created_id',
+     lambda: Medication.query.filter_by(user_id=1)
+         .order_by(Medication.created_at.desc(), Medication.id.desc()).limit(51)),
+    ('profile/health', 'health_profiles', 'ix_health_profiles_user_created',
+     lambda: HealthProfile.query.filter_by(user_id=1).order_by(HealthProfile.created_at.desc()).limit(1)),
+    ('medical-studies/studies (paciente)', 'medical_studies', 'ix_medical_studies_patient_created',
+     lambda: MedicalStudy.query.filter(MedicalStudy.patient_id == 1)
+         .order_by(MedicalStudy.created_at.desc(), MedicalStudy.id.desc()).limit(51)),
+    ('medical-studies/studies (médico)', 'medical_studies', 'ix_medical_studies_created_id',
+     lambda: MedicalStudy.query.order_by(MedicalStudy.created_at.desc(), MedicalStudy.id.desc()).limit(51)),
+    ('nutrition/history', 'nutrition_analysis', 'ix_nutrition_analysis_user_created',
+     lambda: NutritionAnalysis.query.filter_by(user_id=1).order_by(NutritionAnalysis.created_at.desc())),
+    ('doctors/<id>/reviews', 'doctor_reviews', 'ux_doctor_reviews_doctor_user',
+     lambda: DoctorReview.query.filter_by(doctor_id=1, user_id=1)),
+    ('doctors (por usuario)', 'doctors', 'ix_doctors_user_id',
+     lambda: Doctor.query.filter_by(user_id=1)),
+]
+
+
+def _explain(query):
+    """
+    Devuelve {tabla: set(índices usados)} según el plan de la base de datos.
+    """
+    connection = db.session.connection()
+    dialect = connection.dialect
+    compiled = query.statement.compile(dialect=dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    used = {}
+    if dialect.name == 'postgresql':
+        # Con tablas casi vacías el planificador prefiere leer la tabla entera;
+        # lo que interesa es si el índice sirve para la consulta
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', params).scalar()
+        nodes = [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            if 'Index Name' in node:
+                used.setdefault(node.get('Relation Name'), set()).add(node['Index Name'])
+            nodes.extend(node.get('Plans', []))
+    elif dialect.name == 'sqlite':
+        for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params):
+            words = row[-1].split()
+            # "SEARCH tabla USING [COVERING] INDEX nombre (...)"
+            if 'INDEX' in words and words[0] in ('SEARCH', 'SCAN'):
+                used.setdefault(words[1], set()).add(words[words.index('INDEX') + 1])
+    else:
+        raise RuntimeError(f'EXPLAIN no soportado para {dialect.name}')
+    return used
+
+
+def check_query_plans():
+    """
+    Returns:
+        list: [(endpoint, índice esperado, índices usados en la tabla, ok)]
+    """
+    results = []
+    try:
+        for endpoint, table, expected, build_query in HOT_QUERIES:
+            used = _explain(build_query()).get(table, set())
+            results.append((endpoint, expected, used, expected in used))
+    finally:
+        db.session.rollback()
+    return results
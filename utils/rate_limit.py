@@ -0,0 +1,27 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Limitador simple por intervalo: como máximo `per_minute` llamadas por minuto,
+    compartido entre hilos.
+    """
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute and per_minute > 0 else 0
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def acquire(self):
+        """
+        Bloquea hasta que haya un turno disponible.
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
@@ -0,0 +1,273 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from flask import current_app, url_for
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+# Backends de almacenamiento de archivos subidos. Las claves son rutas relativas
+# (p. ej. "blobs/ab/cd/<sha256>.pdf"), iguales a las guardadas en las columnas file_path.
+
+PRESIGNED_URL_EXPIRATION = 15 * 60  # segundos
+
+# Cabeceras de un objeto de S3 que hay que conservar al copiarlo sobre sí mismo
+OBJECT_HEADERS = ('ContentType', 'CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage')
+
+
+class LocalStorage:
+    """
+    Archivos en el disco local bajo uploads/. Las URLs "prefirmadas" apuntan a
+    endpoints de la propia API firmados con itsdangerous.
+    """
+
+    name = 'local'
+
+    def __init__(self, root, secret_key):
+        self.root = root
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='local-storage')
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def modified_time(self, key):
+        return os.path.getmtime(self.path(key))
+
+    def touch(self, key):
+        os.utime(self.path(key), None)
+
+    def put_file(self, local_path, key):
+        """
+        Mueve un archivo local a la clave indicada.
+        """
+        destination = self.path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(local_path, destination)
+
+    def delete(self, key):
+        if self.exists(key):
+            os.remove(self.path(key))
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def read_head(self, key, length):
+        with open(self.path(key), 'rb') as source:
+            return source.read(length)
+
+    def move(self, key, destination_key):
+        destination = self.path(destination_key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(self.path(key), destination)
+        # La fecha de la cuarentena cuenta desde que se movió
+        os.utime(destination, None)
+
+    def iter_files(self, prefix='', skip=()):
+        """
+        Recorre los archivos bajo `prefix` sin cargar el listado completo en
+        memoria (os.scandir por directorio). Devuelve (clave, tamaño, mtime).
+        Los directorios de primer nivel en `skip` no se recorren.
+        """
+        stack = [prefix.strip('/')]
+        while stack:
+            relative_dir = stack.pop()
+            try:
+                entries = os.scandir(self.path(relative_dir) if relative_dir else self.root)
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    key = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if key not in skip:
+                            stack.append(key)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        yield key, stat.st_size, stat.st_mtime
+
+    @contextmanager
+    def local_copy(self, key):
+        # En disco local no hace falta copiar
+        yield self.path(key)
+
+    def presigned_put_url(self, key, sha256, content_type=None, expires_in=PRESIGNED_URL_EXPIRATION):
+        token = self._serializer.dumps({'key': key, 'sha256': sha256, 'op': 'put'})
+        return {
+            'url': url_for('storage.local_upload', token=token, _external=True),
+            'method': 'PUT',
+            'headers': {'Content-Type': content_type} if content_type else {}
+        }
+
+    def presigned_get_url(self, key, expires_in=PRESIGNED_URL_EXPIRATION):
+        token = self._serializer.dumps({'key': key, 'op': 'get'})
+        return url_for('uploaded_file', filename=key, token=token, _external=True)
+
+    def verify_token(self, token, op, max_age=PRESIGNED_URL_EXPIRATION):
+        """
+        Devuelve el contenido de un token de URL firmada o None si es inválido o expiró.
+        """
+        try:
+            data = self._serializer.loads(token, max_age=max_age)
+        except (BadSignature, SignatureExpired):
+            return None
+        return data if data.get('op') == op else None
+
+
+class S3Storage:
+    """
+    Bucket S3 o compatible (MinIO, R2...). Los clientes suben y descargan
+    directamente con URLs prefirmadas, sin pasar por un worker de gunicorn.
+    """
+
+    name = 's3'
+
+    def __init__(self, bucket, endpoint_url=None, region=None, access_key=None, secret_key=None):
+        try:
+            import boto3
+            from botocore.config import Config as BotoConfig
+        except ImportError as import_error:
+            raise RuntimeError('STORAGE_BACKEND=s3 requiere el paquete boto3') from import_error
+
+        self.bucket = bucket
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key or None,
+            aws_secret_access_key=secret_key or None,
+            config=BotoConfig(signature_version='s3v4', s3={'addressing_style': 'path'})
+        )
+
+    def _head(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def size(self, key):
+        return self._head(key)['ContentLength']
+
+    def modified_time(self, key):
+        return self._head(key)['LastModified'].timestamp()
+
+    def touch(self, key):
+        # Copiar el objeto sobre sí mismo actualiza LastModified. Con REPLACE S3
+        # descarta las cabeceras del objeto, así que se vuelven a enviar las actuales
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(key)
+        headers = {name: head[name] for name in OBJECT_HEADERS if head.get(name)}
+        self.client.copy_object(
+            Bucket=self.bucket,
+            Key=key,
+            CopySource={'Bucket': self.bucket, 'Key': key},
+            MetadataDirective='REPLACE',
+            Metadata=head.get('Metadata', {}),
+            **headers
+        )
+
+    def put_file(self, local_path, key):
+        """
+        Sube un archivo local y lo elimina del disco.
+        """
+        self.client.upload_file(local_path, self.bucket, key)
+        os.remove(local_path)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+
+    def read_head(self, key, length):
+        response = self.client.get_object(Bucket=self.bucket, Key=key, Range=f'bytes=0-{length - 1}')
+        return response['Body'].read()
+
+    def move(self, key, destination_key):
+        self.client.copy_object(
+            Bucket=self.bucket,
+            Key=destination_key,
+            CopySource={'Bucket': self.bucket, 'Key': key}
+        )
+        self.delete(key)
+
+    def iter_files(self, prefix='', skip=()):
+        """
+        Lista los objetos bajo `prefix` página a página (1000 claves por llamada).
+        Devuelve (clave, tamaño, mtime).
+        """
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                if item['Key'].split('/', 1)[0] in skip:
+                    continue
+                yield item['Key'], item['Size'], item['LastModified'].timestamp()
+
+    @contextmanager
+    def local_copy(self, key):
+        """
+        Descarga el objeto a un archivo temporal (PyMuPDF, Pillow y los SDK de IA necesitan una ruta).
+        """
+        extension = os.path.splitext(key)[1]
+        fd, temp_path = tempfile.mkstemp(suffix=extension)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                self.client.download_fileobj(self.bucket, key, temp_file)
+            yield temp_path
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def presigned_put_url(self, key, sha256, content_type=None, expires_in=PRESIGNED_URL_EXPIRATION):
+        import base64
+        # El checksum firmado obliga a S3 a rechazar contenido que no coincida con el hash declarado
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode('ascii')
+        params = {'Bucket': self.bucket, 'Key': key, 'ChecksumSHA256': checksum}
+        headers = {'x-amz-checksum-sha256': checksum}
+        if content_type:
+            params['ContentType'] = content_type
+            headers['Content-Type'] = content_type
+        url = self.client.generate_presigned_url('put_object', Params=params, ExpiresIn=expires_in)
+        return {'url': url, 'method': 'PUT', 'headers': headers}
+
+    def presigned_get_url(self, key, expires_in=PRESIGNED_URL_EXPIRATION):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': key},
+            ExpiresIn=expires_in
+        )
+
+
+def init_storage(app):
+    """
+    Crea el backend configurado (STORAGE_BACKEND=local|s3) y lo registra en la app.
+    """
+    backend = app.config.get('STORAGE_BACKEND', 'local')
+    if backend == 's3':
+        storage = S3Storage(
+            bucket=app.config['S3_BUCKET'],
+            endpoint_url=app.config.get('S3_ENDPOINT_URL'),
+            region=app.config.get('S3_REGION'),
+            access_key=app.config.get('S3_ACCESS_KEY_ID'),
+            secret_key=app.config.get('S3_SECRET_ACCESS_KEY')
+        )
+    else:
+        storage = LocalStorage(app.config['UPLOAD_FOLDER'], app.config['SECRET_KEY'])
+    app.extensions['storage'] = storage
+    print(f"Almacenamiento de archivos: {storage.name}")
+    return storage
+
+
+def get_storage():
+    return current_app.extensions['storage']
+
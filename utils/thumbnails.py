@@ -0,0 +1,143 @@
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from PIL import Image, ImageOps, features
+from utils import metrics
+from utils.storage import get_storage
+from utils.blob_store import is_blob_key, temp_dir
+
+# Miniaturas de estudios (primera página del PDF) y fotos de comida. Se guardan
+# junto al original: blobs/ab/cd/<sha256>.pdf -> blobs/ab/cd/<sha256>_sm.webp
+THUMBNAIL_SIZES = {
+    'sm': 160,   # listas
+    'md': 480,   # vista previa
+}
+THUMBNAIL_FORMAT = 'webp' if features.check('webp') else 'jpeg'
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_SOURCE_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg', '.webp'}
+THUMBNAIL_PATTERN = re.compile(
+    r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})_(%s)\.[a-z]+$' % '|'.join(THUMBNAIL_SIZES)
+)
+
+# Pool propio para no ocupar los threads de gunicorn que atienden peticiones
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '2'))
+_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix='thumbnails')
+
+
+def thumbnail_key(key, size):
+    """
+    Clave de la miniatura de un archivo para el tamaño indicado ('sm', 'md').
+    """
+    return f"{os.path.splitext(key)[0]}_{size}.{'jpg' if THUMBNAIL_FORMAT == 'jpeg' else THUMBNAIL_FORMAT}"
+
+
+def is_thumbnail_key(key):
+    return THUMBNAIL_PATTERN.match(key) is not None
+
+
+def has_thumbnails(key):
+    # Solo archivos del almacén por contenido; las rutas antiguas con uuid no tienen miniaturas
+    return is_blob_key(key) and os.path.splitext(key)[1].lower() in THUMBNAIL_SOURCE_EXTENSIONS
+
+
+def thumbnail_urls(key):
+    """
+    URLs de las miniaturas de un archivo, para incluir en las respuestas de listas.
+    """
+    if not has_thumbnails(key):
+        return None
+    return {size: f"/uploads/{thumbnail_key(key, size)}" for size in THUMBNAIL_SIZES}
+
+
+def _render_source(path):
+    """
+    Abre el original como imagen RGB reducida al mayor tamaño de miniatura.
+    """
+    largest = max(THUMBNAIL_SIZES.values())
+    if path.lower().endswith('.pdf'):
+        import fitz
+        with fitz.open(path) as doc:
+            page = doc[0]
+            # Renderizar directamente a la resolución necesaria en lugar de a 72 dpi y escalar
+            zoom = largest / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+    with Image.open(path) as img:
+        # draft() decodifica JPEG a menor escala; exif_transpose respeta la orientación de la cámara
+        img.draft('RGB', (largest, largest))
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGB')
+        img.thumbnail((largest, largest))
+        return img
+
+
+def generate_thumbnails(key, force=False):
+    """
+    Genera las miniaturas de un archivo del almacenamiento. Debe ejecutarse
+    con contexto de aplicación.
+
+    Returns:
+        int: miniaturas creadas
+    """
+    if not has_thumbnails(key):
+        return 0
+
+    storage = get_storage()
+    pending = {size: thumbnail_key(key, size) for size in THUMBNAIL_SIZES}
+    if not force:
+        pending = {size: thumb for size, thumb in pending.items() if not storage.exists(thumb)}
+    if not pending:
+        return 0
+
+    with metrics.timed('thumbnails.generate'):
+        with storage.local_copy(key) as source_path:
+            image = _render_source(source_path)
+
+        created = 0
+        # De mayor a menor: cada tamaño se reduce desde el anterior
+        for size, thumb in sorted(pending.items(), key=lambda item: -THUMBNAIL_SIZES[item[0]]):
+            image.thumbnail((THUMBNAIL_SIZES[size], THUMBNAIL_SIZES[size]))
+            temp_path = os.path.join(temp_dir(), f"{uuid.uuid4()}.thumb")
+            try:
+                image.save(temp_path, THUMBNAIL_FORMAT.upper(), quality=THUMBNAIL_QUALITY, optimize=True)
+                storage.put_file(temp_path, thumb)
+                created += 1
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+    metrics.increment('thumbnails.created', created)
+    return created
+
+
+def delete_thumbnails(key):
+    """
+    Elimina las miniaturas de un archivo (al borrar el original).
+    """
+    if not has_thumbnails(key):
+        return
+    storage = get_storage()
+    for size in THUMBNAIL_SIZES:
+        storage.delete(thumbnail_key(key, size))
+
+
+def _run(app, key):
+    with app.app_context():
+        try:
+            generate_thumbnails(key)
+        except Exception as e:
+            metrics.increment('thumbnails.failed')
+            print(f"Error al generar miniaturas de {key}: {str(e)}")
+
+
+def schedule_thumbnails(*keys):
+    """
+    Encola la generación de miniaturas fuera del ciclo de la petición.
+    Llamar después del commit que guarda las claves.
+    """
+    app = current_app._get_current_object()
+    for key in keys:
+        if has_thumbnails(key):
+            _executor.submit(_run, app, key)
@@ -0,0 +1,231 @@
+import os
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from models import db, Blob, MedicalStudy, NutritionAnalysis, User, DoctorCredential, UploadSession
+from utils.storage import get_storage
+from utils.blob_store import temp_dir, release_or_remove
+from utils.chunked_upload import temp_upload_path, discard_upload
+from utils.thumbnails import THUMBNAIL_PATTERN
+
+# Recolector de archivos huérfanos en uploads/: archivos que ninguna fila
+# referencia (subidas fallidas, reemplazos antiguos) y temporales abandonados.
+QUARANTINE_PREFIX = 'quarantine'
+SKIPPED_PREFIXES = {'temp', QUARANTINE_PREFIX}
+# Archivos parciales de las subidas por partes (utils/chunked_upload.temp_upload_path)
+PART_SUFFIX = '.part'
+
+# Columnas que guardan rutas relativas a uploads/
+REFERENCE_COLUMNS = (
+    MedicalStudy.file_path,
+    MedicalStudy.storage_key,
+    NutritionAnalysis.file_path,
+    User.profile_picture,
+    DoctorCredential.file_path,
+    Blob.storage_key,
+)
+
+def _candidates(key):
+    # Los estudios antiguos guardaban solo el nombre del archivo, sin 'medical_studies/'
+    return {key, os.path.basename(key)}
+
+
+def find_referenced(keys):
+    """
+    Devuelve el subconjunto de `keys` que alguna fila de la base de datos referencia.
+    Las miniaturas cuentan como referenciadas si su blob sigue existiendo.
+    """
+    referenced = set()
+    thumbnails = {}
+    lookup = {}
+    for key in keys:
+        match = THUMBNAIL_PATTERN.match(key)
+        if match:
+            thumbnails.setdefault(match.group(1), []).append(key)
+            continue
+        for candidate in _candidates(key):
+            lookup.setdefault(candidate, []).append(key)
+
+    if lookup:
+        values = list(lookup)
+        for column in REFERENCE_COLUMNS:
+            for (value,) in db.session.query(column).filter(column.in_(values)).distinct():
+                referenced.update(lookup.get(value, ()))
+
+    if thumbnails:
+        live = db.session.query(Blob.sha256).filter(Blob.sha256.in_(list(thumbnails))).distinct()
+        for (sha256,) in live:
+            referenced.update(thumbnails[sha256])
+
+    return referenced
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def sweep_orphans(grace_seconds, batch_size=1000, quarantine=False, dry_run=False, log=print):
+    """
+    Recorre el almacenamiento en streaming y elimina (o pone en cuarentena)
+    los archivos sin referencias más antiguos que el periodo de gracia.
+
+    Returns:
+        dict: estadísticas del barrido
+    """
+    storage = get_storage()
+    cutoff = time.time() - grace_seconds
+    stats = {'scanned': 0, 'orphans': 0, 'reclaimed_bytes': 0, 'errors': 0}
+    quarantine_dir = f"{QUARANTINE_PREFIX}/{datetime.utcnow():%Y%m%d}"
+
+    for batch in _batches(storage.iter_files(skip=SKIPPED_PREFIXES), batch_size):
+        stats['scanned'] += len(batch)
+        # Los archivos recientes pueden pertenecer a una petición que aún no hizo commit
+        old_files = {key: size for key, size, mtime in batch if mtime < cutoff}
+        if not old_files:
+            continue
+        referenced = find_referenced(old_files)
+        for key, size in old_files.items():
+            if key in referenced:
+                continue
+            stats['orphans'] += 1
+            stats['reclaimed_bytes'] += size
+            if dry_run:
+                log(f"[dry-run] huérfano: {key} ({size} bytes)")
+                continue
+            try:
+                if quarantine:
+                    storage.move(key, f"{quarantine_dir}/{key}")
+                else:
+                    storage.delete(key)
+            except Exception as e:
+                stats['errors'] += 1
+                log(f"Error al limpiar {key}: {str(e)}")
+        # No mantener objetos de las consultas entre lotes
+        db.session.expire_all()
+
+    return stats
+
+
+def purge_quarantine(max_age_seconds, dry_run=False, log=print):
+    """
+    Elimina definitivamente los archivos en cuarentena más antiguos que `max_age_seconds`.
+    """
+    storage = get_storage()
+    cutoff = time.time() - max_age_seconds
+    stats = {'purged': 0, 'reclaimed_bytes': 0}
+    for key, size, mtime in storage.iter_files(prefix=QUARANTINE_PREFIX):
+        if mtime >= cutoff:
+            continue
+        stats['purged'] += 1
+        stats['reclaimed_bytes'] += size
+        if dry_run:
+            log(f"[dry-run] cuarentena vencida: {key}")
+        else:
+            storage.delete(key)
+    return stats
+
+
+def _live_upload_parts(names):
+    """
+    Nombres de archivos .part de subidas por partes que siguen en curso y sin vencer.
+    """
+    upload_ids = [name[:-len(PART_SUFFIX)] for name in names]
+    if not upload_ids:
+        return set()
+    live = db.session.query(UploadSession.id).filter(
+        UploadSession.id.in_(upload_ids),
+        UploadSession.status == 'uploading',
+        UploadSession.expires_at >= datetime.utcnow()
+    )
+    return {f"{upload_id}{PART_SUFFIX}" for (upload_id,) in live}
+
+
+def clean_temp(max_age_seconds, dry_run=False, log=print):
+    """
+    Elimina de uploads/temp los archivos abandonados (subidas interrumpidas,
+    errores entre el guardado temporal y el almacén). Siempre en disco local.
+    Los .part de subidas por partes en curso se conservan hasta que su sesión
+    vence (expire_upload_sessions), aunque superen `max_age_seconds`.
+    """
+    cutoff = time.time() - max_age_seconds
+    stats = {'removed': 0, 'reclaimed_bytes': 0}
+    candidates = []
+    with os.scandir(temp_dir()) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime < cutoff:
+                candidates.append((entry, stat))
+
+    live_parts = _live_upload_parts([entry.name for entry, _ in candidates if entry.name.endswith(PART_SUFFIX)])
+    for entry, stat in candidates:
+        if entry.name in live_parts:
+            continue
+        stats['removed'] += 1
+        stats['reclaimed_bytes'] += stat.st_size
+        if dry_run:
+            log(f"[dry-run] temporal abandonado: {entry.name}")
+            continue
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+    return stats
+
+
+def expire_upload_sessions(dry_run=False):
+    """
+    Elimina las subidas por partes vencidas y sus archivos parciales.
+
+    Returns:
+        int: sesiones eliminadas
+    """
+    expired = UploadSession.query.filter(
+        UploadSession.status == 'uploading',
+        UploadSession.expires_at < datetime.utcnow()
+    ).all()
+    if dry_run:
+        return len(expired)
+    for upload in expired:
+        discard_upload(temp_upload_path(current_app.root_path, upload.id))
+        db.session.delete(upload)
+    db.session.commit()
+    return len(expired)
+
+
+def release_old_nutrition_images(retention_days, batch_size=500, dry_run=False):
+    """
+    Quita la imagen de los análisis de comida con más de `retention_days` días.
+    El análisis y los valores de NutritionLog se conservan; solo se libera el archivo.
+
+    Returns:
+        int: imágenes liberadas
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    query = NutritionAnalysis.query.filter(
+        NutritionAnalysis.created_at < cutoff,
+        NutritionAnalysis.file_path.isnot(None)
+    )
+    if dry_run:
+        return query.count()
+
+    released = 0
+    while True:
+        analyses = query.order_by(NutritionAnalysis.id).limit(batch_size).all()
+        if not analyses:
+            break
+        for analysis in analyses:
+            release_or_remove(analysis.file_path)
+            analysis.file_path = None
+        # Un commit por lote: los blobs sin referencias se borran después de cada commit
+        db.session.commit()
+        released += len(analyses)
+    return released
@@ -0,0 +1,109 @@
+import os
+import shutil
+import uuid
+from flask import current_app
+from models import db, MedicalStudy, NutritionAnalysis, User, DoctorCredential
+from utils.blob_store import is_blob_key, store_path, temp_dir, release_reference
+
+# Migración de los archivos antiguos (directorios planos con nombres uuid) al
+# almacén por contenido, cuyas claves usan dos niveles de prefijo del hash:
+# blobs/ab/cd/<sha256><ext>. Cada entrada es (nombre, modelo, columna, directorio antiguo).
+LEGACY_SOURCES = (
+    ('medical_studies', MedicalStudy, 'file_path', 'medical_studies'),
+    ('nutrition_analysis', NutritionAnalysis, 'file_path', 'nutrition'),
+    ('profile_pictures', User, 'profile_picture', 'profile_pics'),
+    ('doctor_credentials', DoctorCredential, 'file_path', 'doctor_credentials'),
+)
+
+
+def resolve_legacy_path(file_path, legacy_dir, root_path):
+    """
+    Ruta en disco de un archivo guardado con el formato antiguo, o None si no existe.
+    Cubre las variantes con y sin el directorio como prefijo.
+    """
+    uploads = os.path.join(root_path, 'uploads')
+    name = os.path.basename(file_path)
+    candidates = (
+        os.path.join(uploads, file_path),
+        os.path.join(uploads, legacy_dir, file_path),
+        os.path.join(uploads, legacy_dir, name),
+        os.path.join(uploads, name),
+    )
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def migrate_batch(model, column_name, legacy_dir, after_id, batch_size):
+    """
+    Migra un lote de filas con rutas antiguas. Las copias se suben al almacén
+    antes del commit; los originales no se tocan (se borran después, con
+    remove_migrated_originals, cuando ninguna fila los referencia).
+
+    Returns:
+        dict: {'last_id', 'rows', 'migrated', 'missing': [ids], 'changed': [ids modificados durante
+        la copia, que se omiten], 'originals': {ruta absoluta: clave antigua}}
+    """
+    column = getattr(model, column_name)
+    rows = model.query.filter(model.id > after_id, column.isnot(None), column != '')\
+        .order_by(model.id).limit(batch_size).all()
+    result = {'last_id': rows[-1].id if rows else after_id, 'rows': len(rows), 'migrated': 0, 'missing': [], 'changed': [], 'originals': {}}
+
+    root_path = current_app.root_path
+    for row in rows:
+        old_value = getattr(row, column_name)
+        if is_blob_key(old_value):
+            continue
+        source = resolve_legacy_path(old_value, legacy_dir, root_path)
+        if source is None:
+            result['missing'].append(row.id)
+            continue
+
+        # Copiar a temp para que store_path pueda moverlo sin tocar el original
+        temp_copy = os.path.join(temp_dir(), f"{uuid.uuid4()}.migrate")
+        shutil.copyfile(source, temp_copy)
+        try:
+            new_key = store_path(temp_copy, os.path.splitext(source)[1])
+        finally:
+            if os.path.exists(temp_copy):
+                os.remove(temp_copy)
+
+        # La copia tarda: solo se escribe la clave nueva si la fila sigue apuntando
+        # al archivo antiguo (el usuario pudo subir otro mientras tanto)
+        values = {column: new_key}
+        if model is MedicalStudy:
+            values[MedicalStudy.storage_key] = new_key
+        updated = model.query.filter(model.id == row.id, column == old_value)\
+            .update(values, synchronize_session=False)
+        if not updated:
+            release_reference(new_key)
+            result['changed'].append(row.id)
+            continue
+        result['originals'][source] = os.path.relpath(source, os.path.join(root_path, 'uploads'))
+        result['migrated'] += 1
+
+    return result
+
+
+def remove_migrated_originals(originals):
+    """
+    Borra los archivos antiguos ya migrados que ninguna fila sigue referenciando.
+
+    Returns:
+        int: bytes liberados
+    """
+    from utils.upload_gc import find_referenced
+
+    still_used = find_referenced(list(originals.values()))
+    freed = 0
+    for source, key in originals.items():
+        if key in still_used:
+            continue
+        try:
+            size = os.path.getsize(source)
+            os.remove(source)
+            freed += size
+        except FileNotFoundError:
+            continue
+    return freed